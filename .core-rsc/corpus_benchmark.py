@@ -0,0 +1,904 @@
+"""
+Measurements over the real corpus.db, run from the repository's root :
+    python .core-rsc/corpus_benchmark.py memory [--level 5]
+    python .core-rsc/corpus_benchmark.py analyze book.786 [--page 1]
+    python .core-rsc/corpus_benchmark.py startup
+    python .core-rsc/corpus_benchmark.py shared [--instances 4]
+    python .core-rsc/corpus_benchmark.py predikt [--queries 20000]
+    python .core-rsc/corpus_benchmark.py objects
+    python .core-rsc/corpus_benchmark.py keystrokes book.786 [--save baseline.json | --compare baseline.json]
+    python .core-rsc/corpus_benchmark.py backends book.786 [--processes 2 4]
+    python .core-rsc/corpus_benchmark.py learn library/ [--processes 4]
+    python .core-rsc/corpus_benchmark.py plans [--migrate]
+    python .core-rsc/corpus_benchmark.py quantize book.786 [--bits 8 16]
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import random
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from tools.Corpus import Word, SparseGrammar, QuantizedGrammar, Snapshot, PrediktIndex, Vocabulary, TokenStream, ProcessAnalyzer, \
+    score_contexts, score_fallback, running_best, digest_words, digest_ancestors, connect, enable_wal, weight_tiers, \
+    tier_clause, analyze_tokens, blocks_infos, flatten_solutions, IndexCache, build_indexes, CorpusLearner, \
+    html_blocks, document_blocks, merge_counts, migrate, check_query_plans, renote, PLANNED_QUERIES, SCHEMA_VERSION
+
+
+def appdata_path(file: str = '') -> str:
+    """
+    returns absolute path to the %appdata%/Local/Typer
+    """
+    return os.path.join(os.getenv('LOCALAPPDATA'), 'Typer', file)
+
+
+def human_size(n: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return f'{n:.1f}{unit}'
+        n /= 1024
+    return f'{n:.1f}TB'
+
+
+def load_grammar(db_path: str, level: int) -> SparseGrammar:
+    con = sqlite3.connect(db_path)
+    cur = con.cursor()
+
+    size = len(cur.execute('SELECT name FROM morphs').fetchall())
+    data = cur.execute('SELECT * FROM grammar WHERE w>?', (level,)).fetchall()
+    con.close()
+
+    grammar = SparseGrammar(size)
+    grammar.load(data)
+
+    return grammar
+
+
+def memory(args):
+    grammar = load_grammar(args.db, args.level)
+
+    print(f'morphs          : {grammar.size}')
+    print(f'contexts        : {len(grammar)} / {pow(grammar.size, 3)}')
+    print(f'dense grammar   : {human_size(grammar.dense_nbytes)}')
+    print(f'sparse grammar  : {human_size(grammar.nbytes)}')
+    print(f'ratio           : {grammar.dense_nbytes / max(grammar.nbytes, 1):.1f}x')
+
+
+def read_page(path: str, page: int) -> str:
+    """
+    returns the plain text of a .786 book's page, or the content of a .txt file
+    """
+    if os.path.splitext(path)[-1] == '.txt':
+        with open(path, mode='r', encoding='utf-8') as f:
+            return f.read()
+
+    con = sqlite3.connect(path)
+    content = con.execute('SELECT text FROM book WHERE page=?', (page,)).fetchone()[0]
+    con.close()
+
+    return '\n'.join(html_blocks(content))
+
+
+def page_contexts(db_path: str, text: str) -> list:
+    """
+    the (x1, x2, y, z) roles of every token of the text, as the Analyze job reads them
+    """
+    from tools import T
+
+    roles = {}
+    con = sqlite3.connect(db_path)
+    for word, role in con.execute('SELECT word, role FROM dict ORDER BY weight ASC').fetchall():
+        try:
+            roles[word].append(role)
+        except KeyError:
+            roles[word] = [role]
+    con.close()
+
+    vocabulary = Vocabulary(roles, {})
+    stream = TokenStream.encode(vocabulary, T.Regex.tokenize(text))
+    contexts = [[vocabulary.infos(token)[0] for token in key] for key in stream.keys()]
+
+    return contexts
+
+
+def legacy_scores(grammar, x1, x2, y, z):
+    """
+    the scoring loops of Analyze.run before the vectorized kernel, kept as the reference
+    """
+    chain, floor, fail = [], .0, True
+    for a in x1:
+        for b in x2:
+            for d in z:
+                best_suggestion_idx = np.argsort(grammar[a, b, :, d])[::-1][0]
+                best_suggestion_score = grammar[a, b, best_suggestion_idx, d]
+
+                for c in y:
+                    if grammar[a, b, c, d]:
+                        if best_suggestion_score:
+                            note = math.log10(grammar[a, b, c, d]) / math.log10(best_suggestion_score)
+                            if note > floor:
+                                chain.append((a, b, c, d))
+                                floor = note
+                            if note == 1:
+                                fail = False
+                    else:
+                        fail = True
+
+    if fail:
+        for d in z:
+            for b in x2:
+                for c in y:
+                    u, j = np.amax(grammar[:, b, c, d]), np.amax(grammar[:, b, :, d], axis=(0, 1))
+                    if j and u:
+                        res = math.log10(u) / math.log10(j)
+                        if res > floor:
+                            chain.append((np.argmax(grammar[:, b, c, d]), b, c, d))
+                            floor = res
+
+    return chain
+
+
+def kernel_scores(grammar, x1, x2, y, z):
+    chain = []
+    notes, fail = score_contexts(grammar, x1, x2, y, z)
+    contexts = [(a, b, d) for a in x1 for b in x2 for d in z]
+    floor = .0
+    for k in running_best(notes.ravel(), floor):
+        (a, b, d), c = contexts[k // len(y)], y[k % len(y)]
+        chain.append((a, b, c, d))
+        floor = notes.flat[k]
+
+    if fail:
+        notes, best_x1 = score_fallback(grammar, x2, y, z)
+        contexts = [(b, d) for d in z for b in x2]
+        for k in running_best(notes.ravel(), floor):
+            (b, d), c = contexts[k // len(y)], y[k % len(y)]
+            chain.append((int(best_x1.flat[k]), b, c, d))
+
+    return chain
+
+
+def analyze(args):
+    grammar = load_grammar(args.db, args.level)
+    contexts = page_contexts(args.db, read_page(args.book, args.page))
+
+    timings = {}
+    chains = {}
+    for name, scorer in (('loops', legacy_scores), ('kernel', kernel_scores)):
+        s = time.perf_counter()
+        for _ in range(args.repeat):
+            chains[name] = [scorer(grammar, *context) for context in contexts]
+        timings[name] = (time.perf_counter() - s) / args.repeat
+
+    mismatches = sum(a != b for a, b in zip(chains['loops'], chains['kernel']))
+    print(f'tokens          : {len(contexts)}')
+    print(f'loops           : {timings["loops"] * 1000:.1f}ms')
+    print(f'kernel          : {timings["kernel"] * 1000:.1f}ms')
+    print(f'speedup         : {timings["loops"] / max(timings["kernel"], 1e-9):.1f}x')
+    print(f'mismatches      : {mismatches}')
+
+
+def load_sqlite(db_path: str, level: int):
+    """
+    the SQLite path of Corpus.init
+    """
+    con = sqlite3.connect(db_path)
+    cur = con.cursor()
+    size = len(cur.execute('SELECT name FROM morphs').fetchall())
+    data = cur.execute('SELECT * FROM dict ORDER BY weight ASC').fetchall()
+    predikt_data = cur.execute('SELECT * FROM predikt WHERE w>? ORDER BY w ASC', (level,)).fetchall()
+    grammar_data = cur.execute('SELECT * FROM grammar WHERE w>?', (level,)).fetchall()
+    con.close()
+
+    grammar = SparseGrammar(size)
+    grammar.load(grammar_data)
+
+    return grammar, digest_words(data), digest_ancestors(predikt_data)
+
+
+def load_parallel(db_path: str, level: int, phases: dict = None):
+    """
+    the SQLite path of Corpus.init, each table read concurrently on a read-only connection
+    """
+    phases = {} if phases is None else phases
+
+    def read(name, query, *params):
+        s = time.perf_counter()
+        connector = connect(db_path, readonly=True)
+        rows = connector.execute(query, params).fetchall()
+        connector.close()
+        phases[f'read {name}'] = time.perf_counter() - s
+        return rows
+
+    with ThreadPoolExecutor(3) as pool:
+        dict_data = pool.submit(read, 'dict', 'SELECT * FROM dict ORDER BY weight ASC')
+        predikt_data = pool.submit(read, 'predikt', 'SELECT * FROM predikt WHERE w>? ORDER BY w ASC', level)
+        grammar_data = pool.submit(read, 'grammar', 'SELECT * FROM grammar WHERE w>?', level)
+
+        connector = sqlite3.connect(db_path)
+        size = len(connector.execute('SELECT name FROM morphs').fetchall())
+        connector.close()
+
+        grammar_data, dict_data, predikt_data = grammar_data.result(), dict_data.result(), predikt_data.result()
+
+    s = time.perf_counter()
+    grammar = SparseGrammar(size)
+    grammar.load(grammar_data)
+    phases['load grammar'] = time.perf_counter() - s
+
+    s = time.perf_counter()
+    words = digest_words(dict_data)
+    phases['digest words'] = time.perf_counter() - s
+
+    s = time.perf_counter()
+    ancestors = digest_ancestors(predikt_data)
+    phases['digest ancestors'] = time.perf_counter() - s
+
+    return grammar, words, ancestors
+
+
+def load_tiers(db_path: str, level: int, bounds: tuple) -> list:
+    """
+    the tiered SQLite path of Corpus.init
+    :return: the elapsed time when each tier's grammar and predikt index are usable
+    """
+    s = time.perf_counter()
+    connector = connect(db_path, readonly=True)
+    size = len(connector.execute('SELECT name FROM morphs').fetchall())
+    words, *_ = digest_words(connector.execute('SELECT * FROM dict ORDER BY weight ASC').fetchall())
+
+    elapsed, grammar, predikt_data = [], SparseGrammar(size), []
+    for n, tier in enumerate(weight_tiers(level, bounds)):
+        clause, params = tier_clause(tier)
+        grammar = grammar.copy() if n else grammar
+        grammar.load(connector.execute(f'SELECT * FROM grammar WHERE {clause}', params).fetchall())
+
+        predikt_data = connector.execute(f'SELECT * FROM predikt WHERE {clause} ORDER BY w ASC',
+                                         params).fetchall() + predikt_data
+        digest_ancestors(predikt_data)
+        PrediktIndex([(words[x1][0], words[x2][0], words[y][0]) for x1, x2, y, w in predikt_data[::-1]
+                      if x1 in words and x2 in words and y in words])
+        elapsed.append((tier, time.perf_counter() - s))
+
+    connector.close()
+    return elapsed
+
+
+def load_snapshot(snapshot: Snapshot, mmap_mode: str = None):
+    """
+    the snapshot path of Corpus.init
+    """
+    data = snapshot.load(mmap_mode)
+
+    grammar = SparseGrammar(data['morphs'])
+    grammar.restore(**data['grammar'])
+
+    return grammar, digest_words(data['dict']), digest_ancestors(data['predikt'])
+
+
+def startup(args):
+    snapshot = Snapshot(args.snapshot)
+
+    s = time.perf_counter()
+    snapshot.write(args.db, args.level)
+    written = time.perf_counter() - s
+
+    enable_wal(args.db)
+
+    cache = IndexCache(args.indexes)
+    s = time.perf_counter()
+    cache.write(args.db, args.level)
+    cached = time.perf_counter() - s
+    assert cache.valid(args.db, args.level)
+
+    timings, phases = {}, {}
+    for name, loader in (('sqlite', partial(load_sqlite, args.db, args.level)),
+                         ('parallel', partial(load_parallel, args.db, args.level, phases)),
+                         ('snapshot', partial(load_snapshot, snapshot)),
+                         ('build indexes', partial(build_indexes, args.db, args.level)),
+                         ('cached indexes', partial(cache.load, args.db))):
+        s = time.perf_counter()
+        for _ in range(args.repeat):
+            loader()
+        timings[name] = (time.perf_counter() - s) / args.repeat
+
+    folder = os.path.dirname(snapshot.file(''))
+    size = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+    print(f'snapshot write  : {written * 1000:.1f}ms ({human_size(size)})')
+    print(f'sqlite load     : {timings["sqlite"] * 1000:.1f}ms')
+    print(f'parallel load   : {timings["parallel"] * 1000:.1f}ms')
+    for name, elapsed in phases.items():
+        print(f'  {name:<16}: {elapsed * 1000:.1f}ms')
+    for (low, high), elapsed in load_tiers(args.db, args.level, args.tiers):
+        print(f'  tier {low}-{high or "max"}'.ljust(18) + f': usable after {elapsed * 1000:.1f}ms')
+    print(f'snapshot load   : {timings["snapshot"] * 1000:.1f}ms')
+    print(f'speedup         : {timings["sqlite"] / max(timings["snapshot"], 1e-9):.1f}x')
+    print(f'indexes write   : {cached * 1000:.1f}ms ({human_size(os.path.getsize(args.indexes))})')
+    print(f'indexes build   : {timings["build indexes"] * 1000:.1f}ms')
+    print(f'indexes load    : {timings["cached indexes"] * 1000:.1f}ms')
+    print(f'speedup         : {timings["build indexes"] / max(timings["cached indexes"], 1e-9):.1f}x')
+
+
+class LegacyWord:
+    """
+    Corpus.Word before its slots, as used by the former predikt's dicts
+    """
+
+    def __init__(self, word, ancestors, _weight=1):
+        self.word = str(word)
+        self.tag = ''
+        self.weight = _weight
+        self._ancestors = list(ancestors)
+        self.first_ancestor, self.last_ancestor = ancestors
+        self.tail = ' '.join(ancestors)
+
+    def __hash__(self):
+        return hash(' '.join(self._ancestors) + self.word)
+
+
+def legacy_predikt(rows: list) -> (dict, dict):
+    """
+    the prefix lists built by Loader.Predikt before the PrediktIndex
+    """
+    words_tail, wide = {}, {}
+    for w1, w2, y in rows:
+        word = LegacyWord(y, ancestors=[w1, w2])
+        words_tail.setdefault(word.last_ancestor, []).append(word)
+
+        if len(word.word) > 2:
+            for i in range(1, len(word.word)):
+                wide.setdefault(word.word[:i], []).append(word)
+
+    return words_tail, wide
+
+
+def legacy_predict(words_tail, wide, w1, w2, word, greedy=True):
+    res = ''
+    tail = ' '.join((w1, w2,))
+
+    try:
+        results = filter(lambda x: x.tail.endswith(tail), wide[word])
+        try:
+            res = next(results).word
+        except StopIteration:
+            if not greedy:
+                raise KeyError
+
+    except KeyError:
+        try:
+            results = filter(lambda x: x.word.startswith(word), words_tail[w2])
+            try:
+                res = next(results).word
+            except StopIteration:
+                res = wide[word][0].word
+                raise KeyError
+        except (IndexError, KeyError):
+            pass
+
+    return res
+
+
+def predikt_rows(db_path: str, level: int) -> list:
+    """
+    the (first ancestor, last ancestor, word) entries of the predikt table, the heaviest first
+    """
+    con = sqlite3.connect(db_path)
+    words = dict((i, word) for i, word in con.execute('SELECT id, word FROM dict').fetchall())
+    data = con.execute('SELECT * FROM predikt WHERE w>? ORDER BY w ASC', (level,)).fetchall()
+    con.close()
+
+    return [(words[x1], words[x2], words[y]) for x1, x2, y, w in data[::-1]
+            if x1 in words and x2 in words and y in words]
+
+
+def measure(builder):
+    """
+    returns the built object, its build time and the memory it allocated
+    """
+    tracemalloc.start()
+    s = time.perf_counter()
+    res = builder()
+    elapsed = time.perf_counter() - s
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return res, elapsed, size
+
+
+def predikt(args):
+    rows = predikt_rows(args.db, args.level)
+
+    (words_tail, wide), legacy_time, legacy_size = measure(partial(legacy_predikt, rows))
+    index, index_time, index_size = measure(partial(PrediktIndex, rows))
+
+    # the words being typed after known ancestors, and a part of unknown ones
+    rng = random.Random(0)
+    vocabulary = [word for _, _, word in rows]
+    queries = []
+    for _ in range(args.queries):
+        w1, w2, word = rng.choice(rows)
+        if rng.random() < .3:
+            w1, w2 = rng.choice(vocabulary), rng.choice(vocabulary)
+        queries.append((w1, w2, word[:rng.randint(1, len(word))], rng.random() < .5))
+
+    timings, results = {}, {}
+    for name, predict in (('dicts', partial(legacy_predict, words_tail, wide)),
+                          ('index', index.predict)):
+        latencies = []
+        for query in queries:
+            s = time.perf_counter()
+            results.setdefault(name, []).append(predict(*query))
+            latencies.append(time.perf_counter() - s)
+        timings[name] = np.percentile(np.array(latencies) * 1e6, (50, 95, 99, 100))
+
+    mismatches = sum(a != b for a, b in zip(results['dicts'], results['index']))
+    print(f'entries         : {len(rows)}')
+    print(f'dicts build     : {legacy_time * 1000:.1f}ms ({human_size(legacy_size)})')
+    print(f'index build     : {index_time * 1000:.1f}ms ({human_size(index_size)})')
+    for name, (p50, p95, p99, worst) in timings.items():
+        print(f'{name} predict   : p50 {p50:.1f}µs, p95 {p95:.1f}µs, p99 {p99:.1f}µs, max {worst:.1f}µs')
+    print(f'mismatches      : {mismatches} / {len(queries)}')
+
+
+def objects(args):
+    rows = predikt_rows(args.db, args.level)
+
+    print(f'entries         : {len(rows)}')
+    for name, builder in (('legacy words', lambda: [LegacyWord(y, [w1, w2]) for w1, w2, y in rows]),
+                          ('slotted words', lambda: [Word(y, [w1, w2]) for w1, w2, y in rows]),
+                          ('predikt index', lambda: PrediktIndex(rows))):
+        gc.collect()
+        res, elapsed, size = measure(builder)
+        print(f'{name:<16}: {elapsed * 1000:.1f}ms, {human_size(size)}')
+
+        if isinstance(res, list):
+            s = time.perf_counter()
+            set(res)
+            print(f'{"  hashing":<16}: {(time.perf_counter() - s) * 1000:.1f}ms')
+
+
+def typed_blocks(path: str, page: int = None) -> list:
+    """
+    returns the blocks to type, the pages of a .786 book (all of them if no page given) or the lines of a
+    text file, a recorded keystroke stream is a text file whose backspaces are kept as '\\b'
+    """
+    if os.path.splitext(path)[-1] == '.786' and page is None:
+        con = sqlite3.connect(path)
+        pages = [p for p, in con.execute('SELECT page FROM book ORDER BY page').fetchall()]
+        con.close()
+        text = '\n'.join(read_page(path, p) for p in pages)
+    else:
+        text = read_page(path, page or 1)
+
+    return [block for block in text.replace('\\b', '\b').split('\n') if block.strip()]
+
+
+def replay(blocks: list, index: PrediktIndex, allocations=False, predictions: list = None) -> (list, list):
+    """
+    types the blocks char by char and predicts after each keystroke like Typer.displayPrediction
+    :param allocations: also traces the memory allocated by each keystroke, slower
+    :param predictions: if given, the prediction of every keystroke is appended to it
+    :return: the latencies (s) and the allocated bytes of every keystroke
+    """
+    from tools import T
+
+    latencies, allocated = [], []
+    if allocations:
+        tracemalloc.start()
+
+    for block in blocks:
+        typed = ''
+        for key in block:
+            typed = typed[:-1] if key == '\b' else typed + key
+            if allocations:
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+
+            s = time.perf_counter()
+            # the word under the cursor
+            current = T.Regex.Predikt_hard_soft_w_split.split(typed)[-1]
+            try:
+                w1, w2, word = T.Regex.Predikt_context(typed)
+                prediction = index.predict(w1, w2, word, not len(current))
+            except (AssertionError, IndexError):
+                prediction = None
+            latencies.append(time.perf_counter() - s)
+
+            if predictions is not None:
+                predictions.append(prediction)
+
+            if allocations:
+                _, peak = tracemalloc.get_traced_memory()
+                allocated.append(peak - base)
+
+    if allocations:
+        tracemalloc.stop()
+
+    return latencies, allocated
+
+
+def keystrokes(args):
+    index = PrediktIndex(predikt_rows(args.db, args.level))
+    blocks = typed_blocks(args.book, args.page)
+
+    # warm up, then the timings without tracing and the allocations in a second pass
+    replay(blocks[:10], index)
+    gc.collect()
+    collections = sum(stat['collections'] for stat in gc.get_stats())
+    latencies, _ = replay(blocks, index)
+    collections = sum(stat['collections'] for stat in gc.get_stats()) - collections
+    _, allocated = replay(blocks, index, allocations=True)
+
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1e6, (50, 95, 99))
+    a50, a99 = np.percentile(allocated, (50, 99))
+    report = {
+        'keystrokes': len(latencies),
+        'p50': p50, 'p95': p95, 'p99': p99, 'max': max(latencies) * 1e6,
+        'allocated_p50': a50, 'allocated_p99': a99,
+        'gc_collections': collections
+    }
+
+    print(f'keystrokes      : {report["keystrokes"]}')
+    print(f'latency         : p50 {p50:.1f}µs, p95 {p95:.1f}µs, p99 {p99:.1f}µs, max {report["max"]:.1f}µs')
+    print(f'allocated       : p50 {human_size(a50)}, p99 {human_size(a99)} per keystroke')
+    print(f'gc              : {collections} collections')
+
+    if args.save:
+        with open(args.save, mode='w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, mode='r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+        regressions = [key for key in ('p50', 'p95', 'p99')
+                       if report[key] > baseline[key] * (1 + args.tolerance)]
+        for key in regressions:
+            print(f'REGRESSION {key:<5}: {baseline[key]:.1f}µs -> {report[key]:.1f}µs')
+        if regressions:
+            sys.exit(1)
+
+
+def private_memory(pid: int) -> (int, int):
+    """
+    returns the resident and the private (not shared with another process) memory of the process
+    """
+    try:
+        import psutil
+    except ImportError:
+        # Linux only fallback
+        fields = {}
+        with open(f'/proc/{pid}/smaps_rollup', mode='r') as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                if value.strip().endswith('kB'):
+                    fields[name] = int(value.split()[0]) * 1024
+        return fields['Rss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+    info = psutil.Process(pid).memory_full_info()
+    return info.rss, info.uss
+
+
+def hold(args):
+    """
+    loads the snapshot and waits for the parent to measure it
+    """
+    snapshot = Snapshot(args.snapshot)
+    grammar, _, _ = load_snapshot(snapshot, args.mmap)
+
+    # the cells an upvote would touch
+    for packed in grammar.keys[:args.upvotes].tolist():
+        x1, x2, z = packed // pow(grammar.size, 2), packed // grammar.size % grammar.size, packed % grammar.size
+        grammar[x1, x2, 0, z] += 1
+
+    print('ready', flush=True)
+    sys.stdin.readline()
+
+
+def shared(args):
+    snapshot = Snapshot(args.snapshot)
+    if not snapshot.valid(args.db, args.level):
+        snapshot.write(args.db, args.level)
+
+    for mode in (None, 'c'):
+        command = [sys.executable, __file__, '--db', args.db, '--level', str(args.level), 'hold',
+                   '--snapshot', args.snapshot, '--upvotes', str(args.upvotes)]
+        if mode:
+            command += ['--mmap', mode]
+
+        instances = []
+        for _ in range(args.instances):
+            instance = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+            instance.stdout.readline()
+            instances.append(instance)
+
+        memory = [private_memory(instance.pid) for instance in instances]
+        for instance in instances:
+            instance.communicate('\n')
+
+        rss, private = zip(*memory)
+        print(f'{"mapped" if mode else "copied"} x{args.instances:<7}: rss {human_size(sum(rss))}, '
+              f'private {human_size(sum(private))} ({human_size(private[-1])} per instance)')
+
+
+def backends(args):
+    """
+    the grammar analysis of a whole book, by AnalyzeBlocks' thread and by the ProcessAnalyzer
+    """
+    from tools import T
+
+    # the spawned workers run the main module again, inside the app it's Typer.py
+    sys.modules['__main__'].__file__ = os.path.join(root, 'Typer.py')
+
+    snapshot = Snapshot(args.snapshot)
+    snapshot.write(args.db, args.level)
+    grammar, (words, lemmas, roles, words_id, unique_words), ancestors = load_snapshot(snapshot, mmap_mode='c')
+
+    vocabulary = Vocabulary(roles, words_id)
+    blocks = [TokenStream.encode(vocabulary, T.Regex.tokenize(block)).keys() for block in typed_blocks(args.book, args.page)]
+    infos, words, ancestors = blocks_infos(vocabulary, blocks, ancestors)
+
+    def analyze(keys):
+        return flatten_solutions(analyze_tokens(grammar, keys, infos.__getitem__, words, ancestors))
+
+    print(f'blocks          : {len(blocks)}')
+    print(f'tokens          : {sum(map(len, blocks))}')
+
+    s = time.perf_counter()
+    for _ in range(args.repeat):
+        reference = [analyze(keys) for keys in blocks]
+    print(f'{"thread":<16}: {(time.perf_counter() - s) / args.repeat * 1000:.1f}ms')
+
+    for n in args.processes:
+        with ThreadPoolExecutor(n) as pool:
+            s = time.perf_counter()
+            for _ in range(args.repeat):
+                results = list(pool.map(analyze, blocks))
+            print(f'{f"{n} threads":<16}: {(time.perf_counter() - s) / args.repeat * 1000:.1f}ms')
+
+        s = time.perf_counter()
+        analyzer = ProcessAnalyzer(snapshot.path, n)
+        # the first tasks spawn the workers and map the snapshot
+        analyzer.analyze(blocks[:n], infos, words, ancestors, {})
+        spawned = time.perf_counter() - s
+
+        s = time.perf_counter()
+        for _ in range(args.repeat):
+            results = analyzer.analyze(blocks, infos, words, ancestors, {})
+        elapsed = (time.perf_counter() - s) / args.repeat
+        analyzer.close()
+
+        mismatches = sum(a != b for a, b in zip(reference, results))
+        print(f'{f"{n} processes":<16}: {elapsed * 1000:.1f}ms (spawn {spawned * 1000:.0f}ms, mismatches {mismatches})')
+
+
+def learn(args):
+    """
+    the throughput of Corpus.Learn on a library, merged into a copy of the corpus.db
+    """
+    import shutil
+    from tools import T
+
+    paths = []
+    for path in args.library:
+        if os.path.isdir(path):
+            paths += [os.path.join(path, f) for f in sorted(os.listdir(path)) if os.path.splitext(f)[-1] in ('.786', '.txt')]
+        else:
+            paths.append(path)
+
+    db_path = os.path.join(tempfile.gettempdir(), 'corpus.learn.db')
+    shutil.copyfile(args.db, db_path)
+    snapshot = Snapshot(args.snapshot)
+    snapshot.write(db_path, args.level)
+    indexes = build_indexes(db_path, args.level)
+    words_id = indexes['words_id']
+
+    def skip(word):
+        return (T.Regex.is_title(word) and word not in words_id) or T.Regex.is_digit(word)
+
+    def tokenize(block):
+        return list(T.Regex.tokenize(block[0].lower() + block[1:]))
+
+    s = time.perf_counter()
+    learner = CorpusLearner(snapshot.path, indexes['roles'], words_id, indexes['predict_ancestors'],
+                            processes=args.processes)
+    for path in paths:
+        blocks = document_blocks(path)
+        for i in range(0, len(blocks), args.batch):
+            tokens = [tokenize(block) for block in blocks[i:i + args.batch]]
+            learner.feed(tokens, {word for block in tokens for _, _, word, _ in block if skip(word)})
+    counts = learner.finish()
+    counted = time.perf_counter() - s
+    learner.close()
+
+    size = os.path.getsize(db_path)
+    s = time.perf_counter()
+    report = merge_counts(db_path, *counts)
+    merged = time.perf_counter() - s
+
+    print(f'documents       : {len(paths)}')
+    print(f'words           : {learner.tokens}')
+    print(f'processes       : {learner.processes}')
+    print(f'counting        : {counted:.2f}s ({learner.tokens / max(counted, 1e-9):.0f} words/s)')
+    print(f'merge           : {merged:.2f}s (+{human_size(os.path.getsize(db_path) - size)})')
+    for table, rows in report.items():
+        print(f'  {table:<14}: {rows["updated"]} updated, {rows["inserted"]} inserted')
+
+
+def plans(args):
+    """
+    fails if a query of the loaders or of the journal scans its table, see check_query_plans
+    """
+    if args.migrate:
+        s = time.perf_counter()
+        version = migrate(args.db)
+        print(f'migration       : v{version} -> v{SCHEMA_VERSION} in {(time.perf_counter() - s) * 1000:.1f}ms')
+
+    failures = dict(check_query_plans(args.db))
+    for query, params, index in PLANNED_QUERIES:
+        print(f'{"FAIL" if query in failures else "ok":<6}{query}')
+        for detail in failures.get(query, ()):
+            print(f'        {detail}')
+
+    if failures:
+        sys.exit(1)
+
+
+def quantized_rows(db_path: str, level: int, bits: int = 0) -> list:
+    """
+    the entries of the predikt table like predikt_rows, ordered by their weights quantized on the given bits
+    (0 for the full weights), the ties are kept in the table's order for both precisions
+    """
+    con = sqlite3.connect(db_path)
+    words = dict((i, word) for i, word in con.execute('SELECT id, word FROM dict').fetchall())
+    data = con.execute('SELECT x1, x2, word_id, w FROM predikt WHERE w>? ORDER BY rowid', (level,)).fetchall()
+    con.close()
+
+    weights = np.array([w for *_, w in data], dtype=np.int64)
+    if bits:
+        weights = QuantizedGrammar(0, capacity=0, bits=bits).encode(weights).astype(np.int64)
+    order = np.argsort(-weights, kind='stable')
+
+    return [(words[x1], words[x2], words[y]) for x1, x2, y, w in (data[i] for i in order)
+            if x1 in words and x2 in words and y in words]
+
+
+def quantize(args):
+    """
+    the full precision vs the quantized grammar and predikt weights : the roles and the flags of the grammar
+    analysis of a book, the top-1 predictions of its keystrokes and the memory saved
+    """
+    from tools import T
+
+    grammar = load_grammar(args.db, args.level)
+    indexes = build_indexes(args.db, args.level)
+    vocabulary = Vocabulary(indexes['roles'], indexes['words_id'])
+    typed = typed_blocks(args.book, args.page)
+    blocks = [TokenStream.encode(vocabulary, T.Regex.tokenize(block)).keys() for block in typed]
+    infos, words, ancestors = blocks_infos(vocabulary, blocks, indexes['predict_ancestors'])
+
+    def analyze(model) -> dict:
+        solutions = {}
+        for keys in blocks:
+            solutions.update(analyze_tokens(model, keys, infos.__getitem__, words, ancestors))
+        return solutions
+
+    def flagged(solutions: dict) -> set:
+        return {key for key, solution in solutions.items() if renote(solution.score * 100) < 30}
+
+    def predictions(rows: list) -> list:
+        res = []
+        replay(typed, PrediktIndex(rows), predictions=res)
+        return res
+
+    reference = analyze(grammar)
+    flags = flagged(reference)
+    predicted = predictions(quantized_rows(args.db, args.level))
+
+    print(f'tokens          : {len(reference)}, {len(flags)} flagged')
+    print(f'keystrokes      : {len(predicted)}')
+    print(f'{"full":<16}: grammar {human_size(grammar.nbytes)}')
+
+    for bits in args.bits:
+        s = time.perf_counter()
+        model = QuantizedGrammar.quantize(grammar, bits)
+        elapsed = time.perf_counter() - s
+
+        solutions = analyze(model)
+        roles = sum(solutions[key].role != solution.role for key, solution in reference.items())
+        flips = len(flags ^ flagged(solutions))
+        misses = sum(a != b for a, b in zip(predicted, predictions(quantized_rows(args.db, args.level, bits))))
+
+        print(f'{f"{bits} bits":<16}: grammar {human_size(model.nbytes)} '
+              f'(-{(1 - model.nbytes / grammar.nbytes) * 100:.0f}%, quantized in {elapsed * 1000:.0f}ms)')
+        print(f'{"  disagreements":<16}: roles {roles}, flags {flips}, top-1 predictions {misses}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=appdata_path('corpus.db'))
+    parser.add_argument('--level', type=int, default=5)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('memory', help='dense vs sparse grammar size').set_defaults(func=memory)
+
+    command = commands.add_parser('analyze', help='grammar scoring loops vs vectorized kernel on a page')
+    command.add_argument('book', help='a .786 book or a .txt file')
+    command.add_argument('--page', type=int, default=1)
+    command.add_argument('--repeat', type=int, default=3)
+    command.set_defaults(func=analyze)
+
+    command = commands.add_parser('startup', help='SQLite vs snapshot corpus loading')
+    command.add_argument('--snapshot', default=os.path.join(tempfile.gettempdir(), 'corpus.snapshot'))
+    command.add_argument('--repeat', type=int, default=3)
+    command.add_argument('--tiers', type=int, nargs='*', default=(1000, 100), help='weights separating the tiers')
+    command.add_argument('--indexes', default=os.path.join(tempfile.gettempdir(), 'corpus.indexes'))
+    command.set_defaults(func=startup)
+
+    command = commands.add_parser('shared', help='memory of several instances, mapped vs copied snapshot')
+    command.add_argument('--snapshot', default=os.path.join(tempfile.gettempdir(), 'corpus.snapshot'))
+    command.add_argument('--instances', type=int, default=4)
+    command.add_argument('--upvotes', type=int, default=100)
+    command.set_defaults(func=shared)
+
+    command = commands.add_parser('predikt', help='predikt prefix dicts vs PrediktIndex')
+    command.add_argument('--queries', type=int, default=20000)
+    command.set_defaults(func=predikt)
+
+    command = commands.add_parser('objects', help='heap and construction time of the predikt entries')
+    command.set_defaults(func=objects)
+
+    command = commands.add_parser('keystrokes', help='per-keystroke latency of the autocompletion')
+    command.add_argument('book', help='a .786 book, a .txt file or a recorded keystroke stream')
+    command.add_argument('--page', type=int, default=None)
+    command.add_argument('--save', help='writes the report to this json file')
+    command.add_argument('--compare', help='fails if the latencies regressed from this json report')
+    command.add_argument('--tolerance', type=float, default=.2)
+    command.set_defaults(func=keystrokes)
+
+    command = commands.add_parser('backends', help='grammar analysis of a book by threads vs processes')
+    command.add_argument('book', help='a .786 book or a .txt file')
+    command.add_argument('--page', type=int, default=None)
+    command.add_argument('--snapshot', default=os.path.join(tempfile.gettempdir(), 'corpus.snapshot'))
+    command.add_argument('--processes', type=int, nargs='*', default=(2, 4))
+    command.add_argument('--repeat', type=int, default=3)
+    command.set_defaults(func=backends)
+
+    command = commands.add_parser('learn', help='throughput of the bulk learning on a library')
+    command.add_argument('library', nargs='+', help='.786 books, .txt files or folders of them')
+    command.add_argument('--snapshot', default=os.path.join(tempfile.gettempdir(), 'corpus.snapshot'))
+    command.add_argument('--processes', type=int, default=0)
+    command.add_argument('--batch', type=int, default=200)
+    command.set_defaults(func=learn)
+
+    command = commands.add_parser('plans', help='checks the query plans of the loaders and the journal')
+    command.add_argument('--migrate', action='store_true', help='migrates the corpus.db first')
+    command.set_defaults(func=plans)
+
+    command = commands.add_parser('quantize', help='accuracy and memory of the quantized grammar and predikt weights')
+    command.add_argument('book', help='a .786 book or a .txt file')
+    command.add_argument('--page', type=int, default=None)
+    command.add_argument('--bits', type=int, nargs='*', default=(8, 16))
+    command.set_defaults(func=quantize)
+
+    command = commands.add_parser('hold')
+    command.add_argument('--snapshot', required=True)
+    command.add_argument('--mmap', default=None)
+    command.add_argument('--upvotes', type=int, default=0)
+    command.set_defaults(func=hold)
+
+    arguments = parser.parse_args()
+    arguments.func(arguments)
@@ -1,5 +1,20 @@
-import sqlite3
+"""
+Merges and deletes words of the corpus.db from a mapping file, run from the repository's root with Typer closed :
+    python .core-rsc/realign_corpus.py mapping.txt [--db corpus.db]
+
+A line of the mapping file per word, "source destination" merges the source into the destination, "source"
+alone deletes it :
+    muhammed Muhammad
+    hadithsqui
+"""
+import argparse
 import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from tools.Corpus import read_mapping, realign
 
 
 def appdata_path(file: str = '') -> str:
@@ -9,90 +24,28 @@ def appdata_path(file: str = '') -> str:
     return os.path.join(os.getenv('LOCALAPPDATA'), 'Typer', file)
 
 
-con = sqlite3.connect(appdata_path('corpus.db'))
-cur = con.cursor()
-
-
-def update(sid, did, sw, dw, word):
-    print(f'REALIGN {sid} TO {did}')
-    cur.execute(
-        'UPDATE dict SET weight=? WHERE id=?',
-        (sw + dw, did)
-    )
-    cur.execute(
-        'UPDATE dict SET lemma=? WHERE lemma=?',
-        (did, sid)
-    )
-    cur.execute(
-        'UPDATE dict SET lemma=? WHERE lemma=?',
-        (did, word)
-    )
-    cur.execute(
-        'DELETE FROM dict WHERE id=?',
-        (sid,)
-    )
-    for field in ('x1', 'x2', 'word_id'):
-        try:
-            cur.execute(
-                f'UPDATE predikt SET {field}=? WHERE {field}=?',
-                (did, sid)
-            )
-        except sqlite3.IntegrityError:
-            psw = cur.execute(f'SELECT w FROM predikt WHERE {field}=?', (sid,)).fetchone()[0]
-            pdw = cur.execute(f'SELECT w FROM predikt WHERE {field}=?', (did,)).fetchone()[0]
-            cur.execute(
-                f'UPDATE predikt SET w=? WHERE {field}=?',
-                (psw + pdw, did)
-            )
-            cur.execute(
-                f'DELETE FROM predikt WHERE {field}=?',
-                (sid,)
-            )
-
-
-def TRANSLATE(SRC, DST):
-    consumed = 0
-
-    source_res = cur.execute('SELECT * FROM dict WHERE word=? ORDER BY weight DESC', (SRC,)).fetchall()
-    dest_res = cur.execute('SELECT * FROM dict WHERE word=? ORDER BY weight DESC', (DST,)).fetchall()
-
-    for sid, sword, srole, slemma, sw in source_res:
-        for did, dword, drole, dlemma, dw in dest_res:
-            if srole == drole:
-                update(sid, did, sw, dw, sword)
-                consumed += 1
-
-    print(consumed, len(source_res))
-
-    if consumed == 0 and len(source_res) == 1 and len(dest_res):
-        best = dest_res[0]
-        update(source_res[0][0], best[0], source_res[0][-1], best[-1], source_res[0][1])
-
-    con.commit()
-
-
-def DELETE(SRC):
-    consumed = 0
-
-    targets = cur.execute('SELECT * FROM dict WHERE word=? ORDER BY weight DESC', (SRC,)).fetchall()
-
-    for sid, sword, srole, slemma, sw in targets:
-        cur.execute('DELETE FROM dict WHERE id=?', (sid,))
-
-        for field in ('x1', 'x2', 'word_id'):
-            cur.execute(f'DELETE FROM predikt WHERE {field}=?', (sid, ))
-
-        cur.execute(
-            'UPDATE dict SET lemma=? WHERE lemma=?',
-            (sword, sid)
-        )
-
-        consumed += 1
+def human_size(n: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024:
+            return f'{n:.1f}{unit}'
+        n /= 1024
+    return f'{n:.1f}TB'
 
-    print(consumed, len(targets))
-    con.commit()
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mapping', help='the mapping file')
+    parser.add_argument('--db', default=appdata_path('corpus.db'))
+    arguments = parser.parse_args()
 
-TRANSLATE('muhammed', "Muhammad")
-# DELETE('hadithsqui')
+    mapping = read_mapping(arguments.mapping)
+    report = realign(arguments.db, mapping)
 
+    print(f'mapping         : {len(mapping)} words')
+    print(f'dict            : {report["merged"]} merged, {report["deleted"]} deleted, {report["unmatched"]} unmatched')
+    print(f'predikt         : {report["predikt deleted"]} removed, {report["predikt merged"]} merged, '
+          f'{report["predikt moved"]} moved')
+    for step, elapsed in report['timings'].items():
+        print(f'{step:<16}: {elapsed:.2f}s')
+    print(f'size            : {human_size(report["size before"])} -> {human_size(report["size after"])} '
+          f'({human_size(report["reclaimed"])} reclaimed)')
@@ -822,6 +822,7 @@ class Settings(QDialog):
         self.verbose_level.currentIndexChanged.connect(partial(self.updateGlobalSettings, 'verbose_level'))
 
         self.check_grammar_box = self.addGlobalOption('check_grammar', 'Enable Grammar Checking')
+        self.grammar_processes_box = self.addGlobalOption('grammar_processes', 'Analyze Grammar in Processes')
 
         # LOCAL SETTINGS
         self.G_local = QGroupBox('Local Settings')
@@ -968,19 +969,14 @@ class Settings(QDialog):
         elif domain == 'check_grammar':
             S.GLOBAL.check_grammar = state
 
-            def forward_analysis(*args, **kwargs):
-                S.GLOBAL.CORPUS.get_solutions(*args, **kwargs)
+            self._win.typer.analyzePage()
+            if not state:
                 self._win.typer.W_syntaxHighlighter.rehighlight()
-                self._win.typer.update()
-
-            S.POOL.start(
-                S.GLOBAL.CORPUS.Analyze(
-                    T.Regex.tokenize(self._win.typer.toPlainText()),
-                    S.GLOBAL.CORPUS,
-                    forward_analysis
-                ),
-                uniq='grammar_note'
-            )
+
+        elif domain == 'grammar_processes':
+            S.GLOBAL.grammar_processes = state
+            if not state:
+                S.GLOBAL.CORPUS.close_analyzer()
 
         if domain != 'verbose_level':
             S.GLOBAL.saveSetting(domain)
@@ -998,6 +994,7 @@ class Settings(QDialog):
         self.auto_load_box.setChecked(S.GLOBAL.auto_load)
         self.minimum_word_length.setValue(S.GLOBAL.minimum_word_length)
         self.check_grammar_box.setChecked(S.GLOBAL.check_grammar)
+        self.grammar_processes_box.setChecked(S.GLOBAL.grammar_processes)
 
         self.audio_map.setChecked(S.LOCAL.audio_map)
         self.connected_box.setChecked(S.LOCAL.connected)
@@ -15,6 +15,7 @@ from UI import QuranWorker
 from UI.Dialogs import Conjugate, DateTimePickerDialog
 from tools.styles import Styles, Styles_Shortcut, TyperStyle
 from tools import G, T, S, translitteration, Audio
+from tools.Cache import LRUCache
 
 
 class Typer(QTextEdit):
@@ -43,6 +44,11 @@ class Typer(QTextEdit):
 
     contentChanged = pyqtSignal()
     contentEdited = pyqtSignal()
+    grammarAnalyzed = pyqtSignal(dict)
+    spellScanned = pyqtSignal(dict)
+
+    # count of misspelled words whose suggestions are kept, the least recently used are dropped
+    suggestions_size = 5000
 
     def __init__(self, parent=None):
         super(Typer, self).__init__(parent)
@@ -117,6 +123,24 @@ class Typer(QTextEdit):
         # applying a simple syntax highlighter
         self.W_syntaxHighlighter = TyperHighlighter(self, self.document())
 
+        # the blocks waiting for a grammar analysis, those whose solutions are all recorded are skipped
+        self.dirty_blocks = set()
+
+        # the text of the blocks scanned by the spell checker and their misspelled words {offset: word},
+        # by block's number
+        self.misspellings = {}
+        # the suggestions prepared for the misspelled words of the book, see SpellChecker.suggest
+        self.suggestions = LRUCache(self.suggestions_size)
+
+        self.analysis_timer = QTimer(self)
+        self.analysis_timer.setSingleShot(True)
+        self.analysis_timer.setInterval(300)
+        self.analysis_timer.timeout.connect(self.analyzeBlocks)
+
+        self.document().contentsChange.connect(self.markBlocks)
+        self.grammarAnalyzed.connect(self.updateAnalysis)
+        self.spellScanned.connect(self.updateMisspellings)
+
         self.W_audioMap = TyperAudioMap(self)
         self.enableAudioMap()
 
@@ -179,23 +203,98 @@ class Typer(QTextEdit):
             self.setTextCursor(tc)
             self.ensureCursorVisible()
 
-            def forward_analysis(*args, **kwargs):
-                S.GLOBAL.CORPUS.get_solutions(*args, **kwargs)
-                self.W_syntaxHighlighter.rehighlight()
-                self.update()
-
-            S.POOL.start(
-                S.GLOBAL.CORPUS.Analyze(
-                    T.Regex.tokenize(self.toPlainText()),
-                    S.GLOBAL.CORPUS,
-                    forward_analysis
-                ),
-                uniq='grammar_note'
-            )
+            self.analyzePage()
 
         except KeyError:
             pass
 
+    def markBlocks(self, position: int, removed: int, added: int):
+        """
+        flags the blocks changed by an edit for the next grammar analysis and spell scan
+        """
+        first = self.document().findBlock(position).blockNumber()
+        last = self.document().findBlock(position + added).blockNumber()
+
+        self.dirty_blocks.update(range(first, max(first, last) + 1))
+        self.analysis_timer.start()
+
+    def analyzeBlocks(self):
+        """
+        starts the grammar analysis and the spell scan of the changed blocks, the blocks whose solutions are
+        all recorded, or scanned at the same place, are skipped
+        """
+        self.analysis_timer.stop()
+
+        blocks, scans = {}, {}
+        for number in sorted(self.dirty_blocks):
+            block = self.document().findBlockByNumber(number)
+            text = TyperHighlighter.plainText(block.text())
+
+            if not block.isValid() or not len(text):
+                continue
+
+            if not S.GLOBAL.CORPUS.analyzed(text):
+                blocks[number] = text
+
+            if self.misspellings.get(number, ('', ))[0] != text:
+                scans[number] = text
+
+        self.dirty_blocks.clear()
+
+        if len(blocks):
+            S.POOL.start(S.GLOBAL.CORPUS.AnalyzeBlocks(blocks, S.GLOBAL.CORPUS, self.forwardAnalysis))
+
+        if len(scans) and T.SPELL.loaded:
+            S.POOL.start(T.SPELL.Scan(scans, T.SPELL, self.forwardMisspellings, known=self.suggestions))
+
+    def analyzePage(self):
+        """
+        checks every block of the page, those whose solutions were evicted or outdated are analyzed again and
+        those changed are scanned
+        """
+        self.dirty_blocks.update(range(self.document().blockCount()))
+        self.analyzeBlocks()
+
+    def scanPage(self):
+        """
+        forces the spell scan of every block of the page, once the dictionary changed
+        """
+        self.misspellings.clear()
+        self.dirty_blocks.update(range(self.document().blockCount()))
+        self.analyzeBlocks()
+
+    def forwardAnalysis(self, records: dict, blocks: dict):
+        """
+        called from the analysis' thread, the highlight is forwarded to the UI's thread
+        """
+        S.GLOBAL.CORPUS.get_solutions(records)
+        self.grammarAnalyzed.emit(blocks)
+
+    def updateAnalysis(self, blocks: dict):
+        self.rehighlightBlocks(list(blocks.keys()))
+
+    def forwardMisspellings(self, blocks: dict, misspellings: dict, suggestions: dict):
+        """
+        called from the spell scan's thread, the highlight is forwarded to the UI's thread
+        """
+        self.suggestions.update(suggestions)
+        self.spellScanned.emit({number: (text, misspellings[number]) for number, text in blocks.items()})
+
+    def updateMisspellings(self, scanned: dict):
+        self.misspellings.update(scanned)
+        self.rehighlightBlocks(list(scanned.keys()))
+
+    def addWord(self, word: str):
+        T.SPELL.add(word)
+
+        # the suggestions of the other words could now include it
+        self.suggestions.clear()
+        self.scanPage()
+
+    def rehighlightBlocks(self, blocks: list):
+        for number in blocks:
+            self.W_syntaxHighlighter.rehighlightBlock(self.document().findBlockByNumber(number))
+
     def initFormatting(self):
         self.default_blockFormat = QTextBlockFormat()
         T.QOperator.ApplyDefault.BlockFormat(self.default_blockFormat)
@@ -564,14 +663,8 @@ class Typer(QTextEdit):
         last_words = tc.selectedText()
 
         try:
-            hard_split = T.Regex.Predikt_hard_split.split(last_words)[-1]
-            hard_split = hard_split[0].lower() + hard_split[1:]
-            words = T.Regex.Predikt_soft_split.split(hard_split)
-            words_tuple = (('', '',) + tuple(words))[-3:]
-            tail, word = words_tuple[:-1] + ('', '',), words_tuple[-1]
-
-            assert (not T.Regex.Predikt_ignore_token.match(''.join(tail + (word,))))
-            candidate = S.GLOBAL.CORPUS.predict(*tail[:2], word, not len(self.word))
+            w1, w2, word = T.Regex.Predikt_context(last_words)
+            candidate = S.GLOBAL.CORPUS.predict(w1, w2, word, not len(self.word))
 
         except (AssertionError, IndexError):
             candidate, word = None, self.word
@@ -739,14 +832,40 @@ class Typer(QTextEdit):
         :return: the length of the suggestions
         """
 
-        # looking for corrections
-        suggestions = T.SPELL.lookup(text, max_edit_distance=2, verbosity=Verbosity.CLOSEST,
-                                     include_unknown=False, transfer_casing=False)
+        # the corrections prepared by the spell scan, or looking for them
+        try:
+            terms = [term for term, _ in self.suggestions[text]]
+        except KeyError:
+            suggestions = T.SPELL.lookup(text, max_edit_distance=2, verbosity=Verbosity.CLOSEST,
+                                         include_unknown=False, transfer_casing=False)
+            terms = [a.term for a in suggestions]
 
         # adding results to menu
-        self.insertItemsToMenu([a.term for a in suggestions], cursor, menu)
+        self.insertItemsToMenu(terms, cursor, menu)
+
+        return len(terms)
+
+    def autoCorrection(self, word: str) -> str:
+        """
+        the closest correction of the word within one edit, the word itself if there's none
+        """
+        # the prepared suggestions are sorted by distance then frequency, they match the lookup for the lowercase
+        # words only, since it transfers the casing
+        if word.islower():
+            try:
+                term, distance = self.suggestions[word][0]
+                return term if distance <= 1 else word
+            except IndexError:
+                return word
+            except KeyError:
+                pass
+
+        # applies an automatic spell correction, the ignore token to be sure we don't try
+        # to correct the digits, proper names or glyphs
+        suggestions = T.SPELL.lookup(word, max_edit_distance=1, verbosity=Verbosity.TOP,
+                                     include_unknown=True, transfer_casing=True)
 
-        return len(suggestions)
+        return suggestions[0].term
 
     def insertItemsToMenu(self, terms: set | list, cursor: QTextCursor, menu: QMenu):
         """
@@ -763,7 +882,7 @@ class Typer(QTextEdit):
             action.setData((cursor, solution))
             menu.addAction(action)
 
-    def upvoteGrammar(self, s: S.GLOBAL.CORPUS.Solution, text:str):
+    def upvoteGrammar(self, s: S.GLOBAL.CORPUS.Solution):
         x1 = s.x1 if isinstance(s.x1, S.GLOBAL.CORPUS.Solution) else S.GLOBAL.CORPUS.Solution(role=s.x1)
         x2 = s.x2 if isinstance(s.x2, S.GLOBAL.CORPUS.Solution) else S.GLOBAL.CORPUS.Solution(role=s.x2)
         z = s.z if isinstance(s.z, S.GLOBAL.CORPUS.Solution) else S.GLOBAL.CORPUS.Solution(role=s.z)
@@ -780,15 +899,7 @@ class Typer(QTextEdit):
 
         if res == QMessageBox.StandardButton.Yes:
             S.GLOBAL.CORPUS.upvote_grammar(x1, x2, y, z)
-            S.POOL.start(
-                S.GLOBAL.CORPUS.Analyze(
-                    T.Regex.tokenize(text),
-                    S.GLOBAL.CORPUS,
-                    S.GLOBAL.CORPUS.get_solutions
-                ),
-                uniq='grammar_note'
-            )
-            self.W_syntaxHighlighter.rehighlight()
+            self.analyzePage()
 
     # OVERRIDES
 
@@ -938,13 +1049,8 @@ class Typer(QTextEdit):
 
                     # needs to be implemented in settings and should be customizable by user
                     if ratio <= 0.15 and not self.word[0].isupper():
-                        # applies an automatic spell correction, the ignore token to be sure we don't try
-                        # to correct the digits, proper names or glyphs
-                        suggestions = T.SPELL.lookup(self.word, max_edit_distance=1, verbosity=Verbosity.TOP,
-                                                     include_unknown=True, transfer_casing=True)
-
                         # this is the first and closest correction
-                        correction = suggestions[0].term
+                        correction = self.autoCorrection(self.word)
 
                         # automatically replace it if correction is different
                         if tc.selectedText() != correction:
@@ -1335,7 +1441,7 @@ class Typer(QTextEdit):
         tc.select(tc.SelectionType.BlockUnderCursor)
         block_text = tc.selectedText()
         block_text = '.'.join([(s[0].lower() + s[1:]) if len(s) else '' for s in T.Regex.Predikt_hard_split.split(block_text)])
-        tokenized_block_text = [token for token in T.Regex.tokenize(block_text)]
+        stream = S.GLOBAL.CORPUS.encode(block_text)
 
         # getting the block
         c_block = self.cursorForPosition(pos)
@@ -1473,20 +1579,16 @@ class Typer(QTextEdit):
             A_addWord.setIcon(G.icon('Textfield-Add'))
             A_addWord.setData(text)
             M_main.insertAction(M_main.actions()[0], A_addWord)
-            A_addWord.triggered.connect(partial(T.SPELL.add, text))
+            A_addWord.triggered.connect(partial(self.addWord, text))
 
             # if suggestions for the word are at least one we display the menu
             if cnt >= 1:
                 M_main.insertMenu(M_main.actions()[0], M_suggestions)
 
-        x1, x2, y, z = None, None, None, None
-        for i, x2, y, z in tokenized_block_text:
-            if (i + len(text)) >= p >= i:
-                break
-            x1 = x2
+        key = stream.find(p, len(text))
 
         if S.GLOBAL.check_grammar:
-            solutions = S.GLOBAL.CORPUS.solve(x1, x2, y, z)
+            solutions = S.GLOBAL.CORPUS.solve(key)
 
             if solutions:
                 original_tc = self.cursorForPosition(pos)
@@ -1523,8 +1625,7 @@ class Typer(QTextEdit):
                 A_upvote_grammar.setIcon(G.icon('Thumb-Up'))
                 A_upvote_grammar.triggered.connect(partial(
                     self.upvoteGrammar,
-                    S.GLOBAL.CORPUS.get_solution(x1, x2, y, z),
-                    block_text
+                    S.GLOBAL.CORPUS.get_solution(key)
                 ))
                 M_grammar.insertAction(M_grammar.actions()[0], A_upvote_grammar)
 
@@ -1624,6 +1725,28 @@ class TyperHighlighter(QSyntaxHighlighter):
         self.typer = parent
         super(TyperHighlighter, self).__init__(*args)
 
+    def rehighlight(self):
+        s = time()
+        super().rehighlight()
+
+        stats = T.SPELL.stats()
+        G.logger.info(f'TyperHighlighter : {self.document().blockCount()} blocks rehighlighted in '
+                      f'{(time() - s) * 1000:.1f}ms, spell verdicts exact {stats["exact"]}, '
+                      f'cached {stats["hits"]}, looked up {stats["misses"]} ({stats["ratio"]:.0%} hits)')
+
+    @staticmethod
+    def plainText(text: str) -> str:
+        """
+        the block's text the way the grammar analysis reads it
+        """
+        text = text.replace(chr(T.TEXT.para_char), '')
+        text = text.replace(chr(T.TEXT.audio_char), '')
+
+        if len(text):
+            text = text[0].lower() + text[1:]
+
+        return text
+
     def highlightBlock(self, text):
         """
         Overridden QSyntaxHighlighter method to apply the highlight
@@ -1635,30 +1758,26 @@ class TyperHighlighter(QSyntaxHighlighter):
         data = QTextBlockUserData()
         data.state = state = G.State_Default
 
-        previous_word = None
+        text = self.plainText(text)
+        stream = S.GLOBAL.CORPUS.encode(text)
+        words = S.GLOBAL.CORPUS.vocabulary.words
 
-        text = text.replace(chr(T.TEXT.para_char), '')
-        text = text.replace(chr(T.TEXT.audio_char), '')
-
-        if len(text):
-            text = text[0].lower() + text[1:]
-
-        S.POOL.start(
-            S.GLOBAL.CORPUS.Analyze(
-                T.Regex.tokenize(text),
-                S.GLOBAL.CORPUS,
-                S.GLOBAL.CORPUS.get_solutions
-            ),
-            uniq='grammar_note',
-            weight=0
-        )
+        # the misspelled words found by the last spell scan of the block, until the scan of its current text
+        # is done, only the verdicts already known are shown
+        try:
+            scanned, misspelled = self.typer.misspellings[self.currentBlock().blockNumber()]
+            if scanned != text:
+                misspelled = None
+        except KeyError:
+            misspelled = None
 
-        for pos, x, y, z in T.Regex.tokenize(text):
+        for pos, key in zip(stream.positions.tolist(), stream.keys()):
+            y = words[key[2]]
             if len(y) > 1:
                 # a word with # around is a reference
                 # TODO: should match a regex pattern, same for the audio
 
-                solution = S.GLOBAL.CORPUS.get_solution(previous_word, x, y, z)
+                solution = S.GLOBAL.CORPUS.get_solution(key)
                 # grammar_note = 0
                 if solution and solution.to_notify():
                     self.setFormat(pos, len(y), self.grammar_format)
@@ -1671,14 +1790,12 @@ class TyperHighlighter(QSyntaxHighlighter):
                     state = G.State_Reference
 
                 # otherwise we check if word' spelling is invalid
-                if not T.SPELL.word_check(y):
+                if (not T.SPELL.cached_check(y)) if misspelled is None else pos in misspelled:
                     # if we reach this point it means the word is incorrect and have some spell suggestions
                     self.setFormat(pos, len(y), self.err_format)
 
                     state = G.State_Correction
 
-                previous_word = x
-
                 # finally setting the data state
                 data.state = state
 
@@ -0,0 +1,524 @@
+# بسم الله الرحمان الرحيم
+"""
+The Qt-free kernels of the corpus checked against the code they replaced (the dense grammar, the loops of
+Analyze and the prefix lists of the predikt), and the corpus.db's queries against their index, run from the
+repository's root :
+    python -m pytest -q tests
+"""
+import math
+import os
+import random
+import sqlite3
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.Cache import LRUCache
+from tools.Corpus import IndexCache, PrediktIndex, QuantizedGrammar, Snapshot, SparseGrammar, UpvoteJournal, check_query_plans, \
+    merge_counts, migrate, realign, running_best, score_contexts, score_fallback, SCHEMA_VERSION, Vocabulary, TokenStream
+
+
+def build_corpus(path: str, size: int = 2000):
+    """
+    writes a small corpus.db with the schema of the ones shipped before the indexes
+    """
+    rng = random.Random(786)
+    connector = sqlite3.connect(path)
+    connector.executescript("""
+        CREATE TABLE morphs(name TEXT);
+        CREATE TABLE dict(id INTEGER PRIMARY KEY, word TEXT, role INTEGER, lemma, weight INTEGER);
+        CREATE TABLE predikt(x1 INTEGER, x2 INTEGER, word_id INTEGER, w INTEGER, UNIQUE(x1,x2,word_id));
+        CREATE TABLE grammar(x1 INTEGER, x2 INTEGER, y INTEGER, z INTEGER, w INTEGER);
+    """)
+    connector.executemany('INSERT INTO morphs VALUES (?)', [(f'role{n}',) for n in range(20)])
+    connector.executemany('INSERT INTO dict VALUES (?, ?, ?, ?, ?)', [
+        (n, f'word{n}', rng.randrange(20), '', rng.randrange(1, 1000)) for n in range(1, size)
+    ])
+    connector.executemany('INSERT OR IGNORE INTO predikt VALUES (?, ?, ?, ?)', [
+        (rng.randrange(size), rng.randrange(size), rng.randrange(1, size), rng.randrange(1, 1000)) for _ in range(size)
+    ])
+    connector.executemany('INSERT INTO grammar VALUES (?, ?, ?, ?, ?)', [
+        tuple(rng.randrange(20) for _ in range(4)) + (rng.randrange(1, 1000),) for _ in range(size)
+    ])
+    connector.commit()
+    connector.close()
+
+
+def corpus_rows(path: str, table: str) -> list:
+    connector = sqlite3.connect(path)
+    try:
+        return sorted(connector.execute(f'SELECT * FROM {table}').fetchall(), key=repr)
+    finally:
+        connector.close()
+
+
+def grammar_rows(size: int, contexts: int, rng: random.Random) -> list:
+    """
+    (x1, x2, y, z, w) records of a few filled contexts, the weights stay over 1 so their logs never divide by 0
+    """
+    cells = {}
+    for _ in range(contexts):
+        x1, x2, z = (rng.randrange(size) for _ in range(3))
+        for y in rng.sample(range(size), rng.randint(1, size)):
+            cells[(x1, x2, y, z)] = rng.randrange(2, 100000)
+
+    return [key + (w,) for key, w in cells.items()]
+
+
+def dense_grammar(size: int, rows: list) -> np.ndarray:
+    dense = np.zeros(shape=(size,) * 4, dtype=np.int32)
+    for x1, x2, y, z, w in rows:
+        dense[x1, x2, y, z] = w
+
+    return dense
+
+
+def assert_same_grammar(grammar: SparseGrammar, dense: np.ndarray):
+    size = len(dense)
+    for b in range(size):
+        for d in range(size):
+            assert np.array_equal(grammar[:, b, :, d], dense[:, b, :, d])
+            for c in range(size):
+                assert np.array_equal(grammar[:, b, c, d], dense[:, b, c, d])
+            for a in range(size):
+                assert np.array_equal(grammar[a, b, :, d], dense[a, b, :, d])
+                assert grammar[a, b, 3, d] == dense[a, b, 3, d]
+                assert grammar.best(a, b, d) == dense[a, b, :, d].max()
+
+
+def legacy_scores(grammar, x1, x2, y, z) -> list:
+    """
+    the scoring loops of Analyze.run before the kernel
+    """
+    chain, floor, fail = [], .0, True
+    for a in x1:
+        for b in x2:
+            for d in z:
+                best_suggestion_score = grammar[a, b, np.argsort(grammar[a, b, :, d])[::-1][0], d]
+
+                for c in y:
+                    if grammar[a, b, c, d]:
+                        if best_suggestion_score:
+                            note = math.log10(grammar[a, b, c, d]) / math.log10(best_suggestion_score)
+                            if note > floor:
+                                chain.append((a, b, c, d))
+                                floor = note
+                            if note == 1:
+                                fail = False
+                    else:
+                        fail = True
+
+    if fail:
+        for d in z:
+            for b in x2:
+                for c in y:
+                    u, j = np.amax(grammar[:, b, c, d]), np.amax(grammar[:, b, :, d], axis=(0, 1))
+                    if j and u:
+                        res = math.log10(u) / math.log10(j)
+                        if res > floor:
+                            chain.append((np.argmax(grammar[:, b, c, d]), b, c, d))
+                            floor = res
+
+    return chain
+
+
+def kernel_scores(grammar: SparseGrammar, x1, x2, y, z) -> list:
+    """
+    the same chain from score_contexts and score_fallback
+    """
+    chain, floor = [], .0
+    notes, fail = score_contexts(grammar, x1, x2, y, z)
+    contexts = [(a, b, d) for a in x1 for b in x2 for d in z]
+    for k in running_best(notes.ravel(), floor):
+        (a, b, d), c = contexts[k // len(y)], y[k % len(y)]
+        chain.append((a, b, c, d))
+        floor = notes.flat[k]
+
+    if fail:
+        notes, best_x1 = score_fallback(grammar, x2, y, z)
+        contexts = [(b, d) for d in z for b in x2]
+        for k in running_best(notes.ravel(), floor):
+            (b, d), c = contexts[k // len(y)], y[k % len(y)]
+            chain.append((int(best_x1.flat[k]), b, c, d))
+            floor = notes.flat[k]
+
+    return chain
+
+
+def test_sparse_grammar():
+    rng = random.Random(786)
+    rows = grammar_rows(6, 40, rng)
+    dense = dense_grammar(6, rows)
+
+    grammar = SparseGrammar(6, capacity=4)
+    grammar.load(rows)
+    assert_same_grammar(grammar, dense)
+    assert np.allclose(grammar.logs[1:grammar.count].max(axis=1), np.log10(grammar.best_score[1:grammar.count]))
+
+    # an upvote, in a filled and in a new context
+    for key in ((rows[0][:4]), (5, 5, 5, 5), (0, 5, 1, 5)):
+        grammar[key] = dense[key] = dense[key] + 1000
+    assert_same_grammar(grammar, dense)
+
+    # restored from its export, then changed again
+    restored = SparseGrammar(6)
+    restored.restore(**grammar.export(spare=8))
+    assert_same_grammar(restored, dense)
+
+    restored[4, 4, 0, 4] = dense[4, 4, 0, 4] = 7
+    restored[rows[1][:4]] = dense[rows[1][:4]] = 70000
+    assert_same_grammar(restored, dense)
+    assert_same_grammar(restored.copy(), dense)
+
+
+def test_scoring_kernel():
+    rng = random.Random(786)
+    rows = grammar_rows(8, 120, rng)
+    dense = dense_grammar(8, rows)
+    grammar = SparseGrammar(8)
+    grammar.load(rows)
+
+    for _ in range(500):
+        x1, x2, y, z = (rng.sample(range(8), rng.randint(1, 3)) for _ in range(4))
+        assert kernel_scores(grammar, x1, x2, y, z) == legacy_scores(dense, x1, x2, y, z)
+
+
+def test_quantized_grammar():
+    rng = random.Random(786)
+    rows = grammar_rows(6, 40, rng)
+    dense = dense_grammar(6, rows)
+    grammar = SparseGrammar(6)
+    grammar.load(rows)
+    filled = dense > 0
+
+    for bits in (8, 16):
+        quantized = QuantizedGrammar(6, bits=bits)
+        quantized.load(rows)
+        # rounded in the log domain, then to the nearest weight
+        tolerance = dense * (pow(10, .5 / quantized.scale) - 1) + 1
+
+        for table in (quantized, QuantizedGrammar.quantize(grammar, bits)):
+            decoded = np.array([[[[table[a, b, c, d] for d in range(6)] for c in range(6)] for b in range(6)]
+                                for a in range(6)])
+            assert np.array_equal(decoded > 0, filled)
+            assert np.all(np.abs(decoded - dense) <= tolerance)
+
+            # the weights keep their order
+            order = np.argsort(dense[filled], kind='stable')
+            assert np.all(np.diff(decoded[filled][order]) >= 0)
+            # the best role of the full precision grammar keeps the best code, close weights may share it
+            filled_rows = np.arange(1, table.count)
+            assert np.array_equal(table.data[filled_rows, grammar.best_role[filled_rows]], table.best_score[filled_rows])
+
+            # notes lose less than 1 / scale
+            logs = table.logs[filled_rows]
+            assert np.all(np.abs(logs - grammar.logs[filled_rows]) <= .5 / table.scale + 1e-6)
+
+            # a full precision grammar gets the decoded weights back, and quantizes them the same
+            restored = SparseGrammar(6)
+            restored.restore(**table.export())
+            assert_same_grammar(restored, decoded)
+            requantized = QuantizedGrammar(6, bits=bits)
+            requantized.restore(**grammar.export())
+            assert_same_grammar(requantized, decoded)
+
+        quantized[0, 0, 0, 0] = 123456
+        assert abs(quantized[0, 0, 0, 0] - 123456) <= 123456 * (pow(10, .5 / quantized.scale) - 1) + 1
+
+
+def test_snapshot(tmp_path):
+    path = str(tmp_path / 'corpus.db')
+    build_corpus(path)
+    snapshot = Snapshot(str(tmp_path / 'snapshot'))
+    assert not snapshot.valid(path, 5)
+
+    snapshot.write(path, 5)
+    assert snapshot.valid(path, 5)
+    assert not snapshot.valid(path, 6)
+
+    connector = sqlite3.connect(path)
+    dict_data = connector.execute('SELECT * FROM dict ORDER BY weight ASC').fetchall()
+    predikt_data = connector.execute('SELECT * FROM predikt WHERE w>? ORDER BY w ASC', (5,)).fetchall()
+    grammar_data = connector.execute('SELECT * FROM grammar WHERE w>?', (5,)).fetchall()
+    connector.close()
+
+    for mmap_mode in (None, 'c'):
+        data = snapshot.load(mmap_mode)
+        assert (data['morphs'], data['dict'], data['predikt']) == (20, dict_data, predikt_data)
+
+        grammar = SparseGrammar(data['morphs'])
+        grammar.restore(**data['grammar'])
+        assert grammar.mapped == bool(mmap_mode)
+        assert_same_grammar(grammar, dense_grammar(20, grammar_data))
+
+    # rewritten, the former generation goes
+    snapshot.write(path, 5)
+    assert len(os.listdir(snapshot.path)) == 2
+
+
+def test_query_plans(tmp_path):
+    path = str(tmp_path / 'corpus.db')
+    build_corpus(path)
+
+    # the check sees the scans of a corpus.db without the indexes
+    assert len(check_query_plans(path))
+
+    assert migrate(path) == 0
+    assert check_query_plans(path) == []
+
+    # already migrated
+    assert migrate(path) == SCHEMA_VERSION
+    assert check_query_plans(path) == []
+
+
+def test_vocabulary_rotation():
+    recorded = LRUCache(100)
+    vocabulary = Vocabulary({'le': [1], 'chat': [2]}, {'le': [10], 'chat': [20]}, limit=10,
+                            forget=lambda tokens: recorded.invalidate(lambda key: not tokens.isdisjoint(key)))
+
+    tokens = [(0, None, 'le', 'chat'), (3, 'le', 'chat', None)]
+    keys = TokenStream.encode(vocabulary, tokens).keys()
+    recorded.update({key: 'solution' for key in keys})
+    # a key left by a job started before the rotations
+    stale = keys[0]
+
+    # the partial words typed, two generations
+    for n in range(25):
+        vocabulary.encode(f'word{n}')
+
+    assert not any(key in recorded for key in keys)
+    assert vocabulary.infos(stale[2]) == ([], [], True)
+
+    # the upvote of the (1, 2) context drops the solutions scored in it, the stale key included
+    recorded.update({stale: 'solution'})
+    recorded.invalidate(lambda key: 1 in vocabulary.infos(key[1])[0] and 2 in vocabulary.infos(key[3])[0])
+
+    # the words encoded again get new ids
+    assert TokenStream.encode(vocabulary, tokens).keys() != keys
+
+
+def test_realign_merge_and_delete(tmp_path):
+    path = str(tmp_path / 'corpus.db')
+    build_corpus(path, size=0)
+
+    connector = sqlite3.connect(path)
+    connector.executemany('INSERT INTO dict VALUES (?, ?, ?, ?, ?)', [
+        (1, 'b', 1, '', 10), (2, 'a', 1, 2, 5), (3, 'c', 1, 'c', 3), (4, 'd', 1, 3, 7)
+    ])
+    connector.executemany('INSERT INTO predikt VALUES (?, ?, ?, ?)', [
+        (2, 3, 4, 20), (3, 2, 4, 7), (2, 4, 1, 5), (1, 4, 1, 2), (4, 2, 4, 9), ('', 3, 1, 4)
+    ])
+    connector.commit()
+    connector.close()
+
+    # a merged into b, c deleted
+    report = realign(path, [('a', 'b'), ('c', None)])
+
+    assert (report['merged'], report['deleted'], report['unmatched']) == (1, 1, 0)
+    assert corpus_rows(path, 'dict') == sorted([(1, 'b', 1, '', 15), (4, 'd', 1, 'c', 7)], key=repr)
+    # the entries of c are gone even when they point to a too, the others follow a and are summed
+    assert corpus_rows(path, 'predikt') == sorted([(1, 4, 1, 7), (4, 1, 4, 9)], key=repr)
+
+
+def test_index_cache_hash(tmp_path):
+    path = str(tmp_path / 'corpus.db')
+    build_corpus(path, size=200)
+    cache = IndexCache(str(tmp_path / 'corpus.indexes'))
+    cache.write(path, 5)
+
+    assert cache.valid(path, 5)
+    assert cache.valid(path, 6) is False
+    indexes = cache.load(path)
+    assert indexes is not None
+
+    # copied or restored, only the modification time changed : recognized by its hash when loaded
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.valid(path, 5)
+    assert cache.load(path)['words'] == indexes['words']
+    assert cache.header()['signature']['mtime'] == stat.st_mtime_ns + 10 ** 9
+
+    # a weight changed in place, the size is the same
+    connector = sqlite3.connect(path)
+    connector.execute('UPDATE dict SET weight=weight + 1 WHERE id=1')
+    connector.commit()
+    connector.close()
+    assert os.path.getsize(path) == stat.st_size
+    assert cache.valid(path, 5)
+    assert cache.load(path) is None
+
+
+def test_upvote_journal_replay(tmp_path):
+    path = str(tmp_path / 'corpus.db')
+    build_corpus(path, size=0)
+    connector = sqlite3.connect(path)
+    connector.executemany('INSERT INTO grammar VALUES (?, ?, ?, ?, ?)', [(1, 2, 3, 4, 10), (1, 2, 5, 4, 20)])
+    connector.commit()
+    connector.close()
+
+    journal = UpvoteJournal(str(tmp_path / 'journal'))
+    assert journal.record(1, 2, 3, 4, 30)
+    assert not journal.record(1, 2, 3, 4, 60)
+    assert not journal.record(1, 2, 5, 4, 80)
+
+    # the journal of a running instance is left to it
+    assert UpvoteJournal(journal.path).replay(path) == 0
+    assert corpus_rows(path, 'grammar') == [(1, 2, 3, 4, 10), (1, 2, 5, 4, 20)]
+
+    # closed without its flush, the votes are written by the next start
+    journal.close()
+    assert UpvoteJournal(journal.path).replay(path) == 2
+    assert corpus_rows(path, 'grammar') == [(1, 2, 3, 4, 60), (1, 2, 5, 4, 80)]
+    assert os.listdir(journal.path) == []
+
+    # flushed, nothing is left to replay
+    journal = UpvoteJournal(journal.path)
+    journal.record(1, 2, 3, 4, 90)
+    assert journal.flush(path) == 1
+    journal.close()
+    assert corpus_rows(path, 'grammar') == [(1, 2, 3, 4, 90), (1, 2, 5, 4, 80)]
+    assert UpvoteJournal(journal.path).replay(path) == 0
+
+
+class SmallNodesIndex(PrediktIndex):
+    # every node but the smallest carries its answers, and the completions often go past the top_k
+    node_size = 2
+    top_k = 2
+
+
+def test_predikt_index():
+    rng = random.Random(786)
+    letters = 'abcde'
+    words = sorted({''.join(rng.choice(letters) for _ in range(rng.randint(1, 6))) for _ in range(300)})
+    ancestors = words[:30] + ['']
+    # heaviest first
+    rows = [(rng.choice(ancestors), rng.choice(ancestors[:8]), rng.choice(words)) for _ in range(3000)]
+
+    def best(prefix):
+        return next((w for _, _, w in rows if prefix and w.startswith(prefix) and len(w) > max(len(prefix), 2)), None)
+
+    def complete(first, last, prefix):
+        return next((w for f, l, w in rows if l == last and f.endswith(first) and w.startswith(prefix)
+                     and len(w) > max(len(prefix), 2)), None)
+
+    def follow(last, prefix):
+        return next((w for _, l, w in rows if l == last and w.startswith(prefix)), None)
+
+    indexes = PrediktIndex(rows), SmallNodesIndex(rows)
+    assert all(len(index.heads) and len(index.tops) for index in indexes)
+
+    for index in indexes:
+        for _ in range(2000):
+            first, last = rng.choice(ancestors + ['e', 'zz']), rng.choice(ancestors[:10])
+            prefix = rng.choice(words)[:rng.randint(0, 4)]
+
+            assert index.best(prefix) == best(prefix)
+            assert index.complete(first, last, prefix) == complete(first, last, prefix)
+            if last in index.groups:
+                assert index.follow(last, prefix) == follow(last, prefix)
+
+
+def legacy_predikt(rows: list) -> (dict, dict):
+    """
+    the prefix lists of Loader.Predikt before the PrediktIndex, as (tail, word), rows are the heaviest first
+    """
+    words_tail, wide = {}, {}
+    for first, last, y in rows:
+        words_tail.setdefault(last, []).append((f'{first} {last}', y))
+        if len(y) > 2:
+            for i in range(1, len(y)):
+                wide.setdefault(y[:i], []).append((f'{first} {last}', y))
+
+    return words_tail, wide
+
+
+def legacy_predict(words_tail: dict, wide: dict, w1: str, w2: str, word: str, greedy=True) -> str:
+    """
+    Predikt.run before the PrediktIndex
+    """
+    res = ''
+    tail = f'{w1} {w2}'
+    try:
+        results = (y for x, y in wide[word] if x.endswith(tail))
+        try:
+            res = next(results)
+        except StopIteration:
+            if not greedy:
+                raise KeyError
+    except KeyError:
+        try:
+            results = (y for _, y in words_tail[w2] if y.startswith(word))
+            try:
+                res = next(results)
+            except StopIteration:
+                res = wide[word][0][1]
+        except (IndexError, KeyError):
+            pass
+
+    return res
+
+
+def test_predikt_predict():
+    rng = random.Random(786)
+    words = sorted({''.join(rng.choice('abcd') for _ in range(rng.randint(1, 5))) for _ in range(200)})
+    ancestors = words[:20] + ['']
+    rows = [(rng.choice(ancestors), rng.choice(ancestors[:6]), rng.choice(words)) for _ in range(2000)]
+
+    words_tail, wide = legacy_predikt(rows)
+
+    for index in (PrediktIndex(rows), SmallNodesIndex(rows)):
+        for _ in range(3000):
+            w1, w2 = rng.choice(ancestors + ['zz']), rng.choice(ancestors[:8])
+            word, greedy = rng.choice(words)[:rng.randint(0, 4)], rng.random() < .5
+            assert index.predict(w1, w2, word, greedy) == legacy_predict(words_tail, wide, w1, w2, word, greedy)
+
+
+def test_merge_counts(tmp_path):
+    path = str(tmp_path / 'corpus.db')
+    build_corpus(path, size=0)
+    migrate(path)
+
+    connector = sqlite3.connect(path)
+    connector.executemany('INSERT INTO dict VALUES (?, ?, ?, ?, ?)', [(1, 'le', 1, '', 10), (2, 'chat', 2, '', 5),
+                                                                     (3, 'chat', 2, '', 1)])
+    connector.executemany('INSERT INTO predikt VALUES (?, ?, ?, ?)', [('', 1, 2, 4)])
+    connector.executemany('INSERT INTO grammar VALUES (?, ?, ?, ?, ?)', [(1, 2, 3, 4, 10)])
+    connector.commit()
+    connector.close()
+
+    words = {('le', 1): 2, ('chat', 2): 3, ('dort', 3): 1}
+    predikt = {(None, None, 'le', 1, 'chat', 2): 2, ('le', 1, 'chat', 2, 'dort', 3): 1}
+    contexts = {(1, 2, 3, 4): 5, (1, 2, 5, 4): 1}
+    report = merge_counts(path, words, predikt, contexts)
+
+    assert report == {'dict': {'updated': 2, 'inserted': 1}, 'predikt': {'updated': 1, 'inserted': 1},
+                      'grammar': {'updated': 1, 'inserted': 1}}
+    # the counts of a word go to its heaviest row
+    assert corpus_rows(path, 'dict') == sorted([(1, 'le', 1, '', 12), (2, 'chat', 2, '', 8), (3, 'chat', 2, '', 1),
+                                                (4, 'dort', 3, '', 1)], key=repr)
+    # the missing ancestors are the '' sentinel
+    assert corpus_rows(path, 'predikt') == sorted([('', 1, 2, 6), (1, 2, 4, 1)], key=repr)
+    assert corpus_rows(path, 'grammar') == [(1, 2, 3, 4, 15), (1, 2, 5, 4, 1)]
+
+    # merged again, everything is updated
+    report = merge_counts(path, words, predikt, contexts)
+    assert [rows['inserted'] for rows in report.values()] == [0, 0, 0]
+    assert corpus_rows(path, 'grammar') == [(1, 2, 3, 4, 20), (1, 2, 5, 4, 2)]
+
+
+def test_lru_cache():
+    cache = LRUCache(3)
+    cache.update({1: 'a', 2: 'b', 3: 'c'})
+    assert cache[1] == 'a'
+
+    # the least recently used goes
+    cache.update({4: 'd'})
+    assert 2 not in cache and list(cache.entries) == [3, 1, 4]
+    assert cache.get(2) is None
+
+    assert cache.invalidate(lambda key: key % 2) == 2
+    assert cache.pop(4) == 'd' and cache.pop(4) is None
+    assert len(cache) == 0
+    assert cache.stats() == {'size': 0, 'hits': 1, 'misses': 1, 'ratio': .5}
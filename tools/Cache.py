@@ -0,0 +1,97 @@
+# بسم الله الرحمان الرحيم
+"""
+The caches shared by the modules, this module must stay free of any Qt dependency
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A bounded mapping, thread-safe, the least recently used entries are evicted once maxsize is reached
+    """
+
+    def __init__(self, maxsize: int = 50000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __getitem__(self, key):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                raise
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, records: dict):
+        with self.lock:
+            for key, value in records.items():
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        removes the entry of the key
+        :return: its value, or default if it's missing
+        """
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def invalidate(self, predicate) -> int:
+        """
+        removes the entries whose key matches the predicate
+        :return: the count of removed entries
+        """
+        with self.lock:
+            keys = [key for key in self.entries if predicate(key)]
+            for key in keys:
+                del self.entries[key]
+
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'ratio': self.hits / total if total else .0
+        }
+
+
+def file_digest(path: str, chunk: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, mode='rb') as f:
+        while data := f.read(chunk):
+            digest.update(data)
+
+    return digest.hexdigest()
@@ -0,0 +1,2179 @@
+# بسم الله الرحمان الرحيم
+"""
+The corpus' core data structures, this module must stay free of any Qt dependency
+"""
+import bisect
+import html
+import json
+import math
+import multiprocessing
+import os
+import pathlib
+import pickle
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tools.Cache import file_digest
+
+
+class Word:
+    """
+    A predicted word and its two ancestors, its hash is computed once since the words are used as keys
+    """
+    __slots__ = ('word', 'tag', 'weight', 'first_ancestor', 'last_ancestor', 'tail', '_hash')
+
+    def __init__(self, word, ancestors=('', ''), tag='', _weight=1):
+        self.word = str(word)
+        self.tag = tag
+        self.weight = _weight
+
+        self.ancestors = ancestors
+
+    @property
+    def ancestors(self):
+        return [self.first_ancestor, self.last_ancestor]
+
+    @ancestors.setter
+    def ancestors(self, value: [str]):
+        self.first_ancestor, self.last_ancestor = value
+        self.tail = ' '.join(value)
+        self._hash = hash(self.tail + self.word)
+
+    def __repr__(self):
+        return f'"{self.word}" ({self.weight}) [{", ".join(map(str, self.ancestors))}] #{self._hash}'
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, Word):
+            return self._hash == other._hash and self.tail + self.word == other.tail + other.word
+
+        return False
+
+
+class SparseGrammar:
+    """
+    A sparse storage for the grammar tensor (x1, x2, y, z), only the filled (x1, x2, z) contexts are stored
+    as rows over the y axis, it keeps the lookups of the dense tensor :
+        grammar[a, b, c, d], grammar[a, b, :, d], grammar[:, b, c, d] and grammar[:, b, :, d]
+
+    For every row it also maintains the derived tables used for scoring : the best role, its weight and
+    the log10 of the weights, they're rebuilt for the loaded rows and updated on every cell's change
+    """
+
+    def __init__(self, size: int, capacity: int = 1024, dtype=np.int32):
+        self.size = size
+        self.dtype = dtype
+
+        # the row 0 is never assigned, it's returned for the missing contexts
+        self.data = np.zeros(shape=(capacity + 1, size), dtype=dtype)
+        self.count = 1
+
+        # derived tables
+        self.logs = np.zeros(shape=self.data.shape, dtype=np.float32)
+        self.best_role = np.zeros(shape=len(self.data), dtype=np.int32)
+        self.best_score = np.zeros(shape=len(self.data), dtype=dtype)
+
+        # the contexts restored from an export, as sorted arrays searched in place so they can stay mapped :
+        # the packed (x1, x2, z) of the rows 1 to len(keys), and the packed (x2, z, x1) with their rows,
+        # needed for the lookups over the x1 axis
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.column_keys = np.zeros(0, dtype=np.int64)
+        self.column_rows = np.zeros(0, dtype=np.int32)
+
+        # the contexts allocated since, (x1, x2, z) -> row
+        self.index = {}
+        # (x2, z) -> {x1: row}
+        self.columns = {}
+
+    @property
+    def shape(self):
+        return (self.size,) * 4
+
+    @property
+    def nbytes(self) -> int:
+        return sum(table[:self.count].nbytes for table in (self.data, self.logs, self.best_role, self.best_score))
+
+    @property
+    def dense_nbytes(self) -> int:
+        return pow(self.size, 4) * np.dtype(self.dtype).itemsize
+
+    def __len__(self):
+        return self.count - 1
+
+    def _grow(self, needed: int):
+        capacity = len(self.data)
+        if needed <= capacity:
+            return
+
+        while capacity < needed:
+            capacity *= 2
+
+        for name in ('data', 'logs', 'best_role', 'best_score'):
+            table = getattr(self, name)
+            grown = np.zeros(shape=(capacity,) + table.shape[1:], dtype=table.dtype)
+            grown[:self.count] = table[:self.count]
+            setattr(self, name, grown)
+
+    def _update_tables(self, rows: np.ndarray):
+        """
+        rebuilds the derived tables of the given rows
+        """
+        data = self.data[rows]
+        self.best_role[rows] = data.argmax(axis=1)
+        self.best_score[rows] = data.max(axis=1)
+
+        with np.errstate(divide='ignore'):
+            self.logs[rows] = np.where(data > 0, np.log10(data), 0)
+
+    def _register(self, x1: int, x2: int, z: int, row: int):
+        self.index[(x1, x2, z)] = row
+
+        try:
+            self.columns[(x2, z)][x1] = row
+        except KeyError:
+            self.columns[(x2, z)] = {x1: row}
+
+    def _restored(self, packed) -> np.ndarray:
+        """
+        the rows of the given packed contexts in the restored keys, 0 for the missing ones
+        """
+        pos = np.searchsorted(self.keys, packed)
+        found = np.take(self.keys, pos, mode='clip') == packed
+
+        return np.where(found, pos + 1, 0)
+
+    def row(self, x1: int, x2: int, z: int, create=False) -> int:
+        """
+        returns the row's number of the given context, 0 if it doesn't exist
+        :param create: if True, the context is allocated when missing
+        """
+        try:
+            return self.index[(x1, x2, z)]
+        except KeyError:
+            pass
+
+        if len(self.keys):
+            row = int(self._restored((x1 * self.size + x2) * self.size + z))
+            if row:
+                return row
+
+        if not create:
+            return 0
+
+        self._grow(self.count + 1)
+        row = self.count
+        self.count += 1
+        self._register(x1, x2, z, row)
+
+        return row
+
+    def load(self, data: list):
+        """
+        bulk load of the (x1, x2, y, z, w) records, as returned by the grammar table
+        """
+        if not len(data):
+            return
+
+        records = np.asarray(data, dtype=np.int64)
+        x1, x2, y, z, w = records.T
+        contexts = (x1 * self.size + x2) * self.size + z
+        uniques, first, inverse = np.unique(contexts, return_index=True, return_inverse=True)
+
+        rows = np.empty(len(uniques), dtype=np.int64)
+        for i, pos in enumerate(first):
+            rows[i] = self.row(int(x1[pos]), int(x2[pos]), int(z[pos]), create=True)
+
+        self.data[rows[inverse], y] = w
+        self._update_tables(rows)
+
+    def rows(self, x1: list, x2: list, z: list) -> np.ndarray:
+        """
+        the rows of the given contexts, contexts are iterated as x1 > x2 > z
+        """
+        if not len(self.keys):
+            return np.array([self.row(a, b, d) for a in x1 for b in x2 for d in z], dtype=np.int64)
+
+        packed = (np.asarray(x1, dtype=np.int64)[:, None] * self.size + np.asarray(x2, dtype=np.int64)) * self.size
+        rows = self._restored((packed[:, :, None] + np.asarray(z, dtype=np.int64)).ravel())
+        if len(self.index):
+            contexts = [(a, b, d) for a in x1 for b in x2 for d in z]
+            for i in np.flatnonzero(rows == 0):
+                rows[i] = self.index.get(contexts[i], 0)
+
+        return rows
+
+    def take(self, x1: list, x2: list, z: list) -> np.ndarray:
+        """
+        gather the rows of the given contexts in a 2D array, contexts are iterated as x1 > x2 > z
+        """
+        return self.data[self.rows(x1, x2, z)]
+
+    def best(self, x1: int, x2: int, z: int) -> int:
+        """
+        the weight of the best role for the given context
+        """
+        return int(self.best_score[self.row(x1, x2, z)])
+
+    def ranking(self, x1: int, x2: int, z: int) -> np.ndarray:
+        """
+        the roles of the given context from the best to the worst one
+        """
+        return np.argsort(self.data[self.row(x1, x2, z)])[::-1]
+
+    def column(self, x2: int, z: int) -> (np.ndarray, np.ndarray):
+        """
+        the filled contexts over the x1 axis
+        :return: their x1 sorted, and their rows
+        """
+        base = (x2 * self.size + z) * self.size
+        start, end = np.searchsorted(self.column_keys, [base, base + self.size])
+        x1, rows = self.column_keys[start:end] - base, self.column_rows[start:end]
+
+        added = self.columns.get((x2, z))
+        if added:
+            x1 = np.concatenate([x1, np.fromiter(added.keys(), dtype=np.int64, count=len(added))])
+            rows = np.concatenate([rows, np.fromiter(added.values(), dtype=np.int64, count=len(added))])
+            order = np.argsort(x1)
+            x1, rows = x1[order], rows[order]
+
+        return x1, rows
+
+    def __getitem__(self, key):
+        a, b, c, d = key
+
+        if isinstance(a, slice):
+            x1, rows = self.column(b, d)
+            if isinstance(c, slice):
+                res = np.zeros(shape=(self.size, self.size), dtype=self.dtype)
+            else:
+                res = np.zeros(shape=self.size, dtype=self.dtype)
+
+            if len(rows):
+                res[x1] = self.data[rows, c]
+            return res
+
+        row = self.data[self.row(a, b, d)]
+        if isinstance(c, slice):
+            row = row[c]
+            row.flags.writeable = False
+            return row
+
+        return row[c]
+
+    def copy(self):
+        """
+        returns an independent copy, to be changed while this one is still in use
+        """
+        res = SparseGrammar(self.size, capacity=0, dtype=self.dtype)
+        res.data, res.logs = self.data.copy(), self.logs.copy()
+        res.best_role, res.best_score = self.best_role.copy(), self.best_score.copy()
+        res.count = self.count
+        self._share_contexts(res)
+
+        return res
+
+    def _share_contexts(self, res):
+        """
+        gives the contexts to the given grammar of the same rows, the restored arrays are never changed so
+        they're shared
+        """
+        res.keys, res.column_keys, res.column_rows = self.keys, self.column_keys, self.column_rows
+        res.index = dict(self.index)
+        res.columns = {key: dict(rows) for key, rows in self.columns.items()}
+
+    @property
+    def mapped(self) -> bool:
+        """
+        True while the rows are backed by a memory-mapped snapshot, shared with the other instances
+        """
+        return isinstance(self.data, np.memmap)
+
+    def export(self, spare: int = 0) -> dict:
+        """
+        the arrays backing the grammar, see restore, the rows are sorted by context
+        :param spare: count of empty rows appended, the new contexts will be allocated there
+        """
+        keys = np.zeros(self.count - 1, dtype=np.int64)
+        keys[:len(self.keys)] = self.keys
+        for (x1, x2, z), row in self.index.items():
+            keys[row - 1] = (x1 * self.size + x2) * self.size + z
+
+        order = np.argsort(keys)
+        keys = keys[order]
+        rows = np.concatenate([[0], order + 1])
+
+        tables = {
+            'data': self.data[rows],
+            'logs': self.logs[rows],
+            'best_role': self.best_role[rows],
+            'best_score': self.best_score[rows]
+        }
+        if spare:
+            for name, table in tables.items():
+                tables[name] = np.concatenate([table, np.zeros(shape=(spare,) + table.shape[1:], dtype=table.dtype)])
+
+        # (x2, z, x1)
+        column_keys = (keys // self.size % self.size * self.size + keys % self.size) * self.size + keys // pow(self.size, 2)
+        column_order = np.argsort(column_keys)
+
+        return {
+            'keys': keys,
+            'column_keys': column_keys[column_order],
+            'column_rows': (column_order + 1).astype(np.int32),
+            **tables
+        }
+
+    def restore(self, keys: np.ndarray, column_keys: np.ndarray, column_rows: np.ndarray, data: np.ndarray,
+                logs: np.ndarray, best_role: np.ndarray, best_score: np.ndarray):
+        """
+        replace the whole content by the arrays previously exported, the row n of the arrays is the
+        context keys[n - 1], the rows after the last key are free.
+        The arrays can be memory-mapped in copy-on-write mode ('c'), only the pages touched by a change are
+        then copied in the process' memory, the contexts are searched in the keys' arrays so they're never
+        copied
+        """
+        self.keys, self.column_keys, self.column_rows = keys, column_keys, column_rows
+        self.index, self.columns = {}, {}
+
+        self.data, self.logs, self.best_role, self.best_score = data, logs, best_role, best_score
+        self.count = len(keys) + 1
+
+    def __setitem__(self, key, value):
+        a, b, c, d = key
+        row = self.row(a, b, d, create=True)
+        self.data[row, c] = value
+        self._update_tables(np.array([row]))
+
+
+class LogCodes:
+    """
+    The logs table of a QuantizedGrammar, computed on access from the codes of the cells it's indexed by
+    """
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+
+    def __getitem__(self, index) -> np.ndarray:
+        codes = self.grammar.data[index]
+        return np.maximum(codes.astype(np.float32) - 1, 0) / self.grammar.scale
+
+
+class QuantizedGrammar(SparseGrammar):
+    """
+    A SparseGrammar storing log-scaled codes on 8 or 16 bits instead of the weights, the code of a weight w is
+    1 + round(log10(w) * scale), 0 for an empty cell, so the weights keep their order and the notes (log ratios)
+    lose less than 1 / scale. The logs table isn't stored, it's read from the codes, the cells take 1 or 2 bytes
+    instead of the 8 of the weight and its log
+    """
+
+    def __init__(self, size: int, capacity: int = 1024, bits: int = 16):
+        assert bits in (8, 16), 'only 8 and 16 bits codes are supported'
+        self.bits = bits
+        self.top = pow(2, bits) - 1
+        # the largest weight (int32) gets the last code
+        self.scale = (self.top - 1) / math.log10(np.iinfo(np.int32).max)
+
+        super().__init__(size, capacity=capacity, dtype=np.uint8 if bits == 8 else np.uint16)
+        self.logs = LogCodes(self)
+
+    @classmethod
+    def quantize(cls, grammar: SparseGrammar, bits: int = 16):
+        """
+        returns a quantized copy of the given grammar
+        """
+        res = cls(grammar.size, capacity=0, bits=bits)
+        res.data = res.encode(grammar.data[:grammar.count])
+        res.best_role = np.array(grammar.best_role[:grammar.count], dtype=np.int32)
+        res.best_score = res.encode(grammar.best_score[:grammar.count])
+        res.count = grammar.count
+        grammar._share_contexts(res)
+
+        return res
+
+    def encode(self, weights) -> np.ndarray:
+        """
+        the codes of the given weights
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            codes = np.where(weights >= 1, np.rint(np.log10(weights) * self.scale) + 1, 0)
+
+        return np.minimum(codes, self.top).astype(self.dtype)
+
+    def decode(self, codes) -> np.ndarray:
+        """
+        the approximated weights of the given codes
+        """
+        codes = np.asarray(codes, dtype=np.float64)
+        return np.where(codes > 0, np.rint(np.power(10, (codes - 1) / self.scale)), 0).astype(np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(table[:self.count].nbytes for table in (self.data, self.best_role, self.best_score))
+
+    def _grow(self, needed: int):
+        capacity = len(self.data)
+        if needed <= capacity:
+            return
+
+        while capacity < needed:
+            capacity *= 2
+
+        for name in ('data', 'best_role', 'best_score'):
+            table = getattr(self, name)
+            grown = np.zeros(shape=(capacity,) + table.shape[1:], dtype=table.dtype)
+            grown[:self.count] = table[:self.count]
+            setattr(self, name, grown)
+
+    def _update_tables(self, rows: np.ndarray):
+        data = self.data[rows]
+        self.best_role[rows] = data.argmax(axis=1)
+        self.best_score[rows] = data.max(axis=1)
+
+    def load(self, data: list):
+        if not len(data):
+            return
+
+        records = np.asarray(data, dtype=np.int64)
+        records[:, 4] = self.encode(records[:, 4])
+        super().load(records)
+
+    def best(self, x1: int, x2: int, z: int) -> int:
+        return int(self.decode(self.best_score[self.row(x1, x2, z)]))
+
+    def __getitem__(self, key):
+        res = super().__getitem__(key)
+        return self.decode(res) if isinstance(res, np.ndarray) else int(self.decode(res))
+
+    def copy(self):
+        res = QuantizedGrammar(self.size, capacity=0, bits=self.bits)
+        res.data = self.data.copy()
+        res.best_role, res.best_score = self.best_role.copy(), self.best_score.copy()
+        res.count = self.count
+        self._share_contexts(res)
+
+        return res
+
+    def export(self, spare: int = 0) -> dict:
+        """
+        the arrays of the full precision grammar, with the decoded weights, see SparseGrammar.export
+        """
+        tables = super().export(spare)
+        tables['data'] = self.decode(tables['data']).astype(np.int32)
+        tables['best_score'] = self.decode(tables['best_score']).astype(np.int32)
+        with np.errstate(divide='ignore'):
+            tables['logs'] = np.where(tables['data'] > 0, np.log10(tables['data']), 0).astype(np.float32)
+
+        return tables
+
+    def restore(self, keys: np.ndarray, column_keys: np.ndarray, column_rows: np.ndarray, data: np.ndarray,
+                logs: np.ndarray, best_role: np.ndarray, best_score: np.ndarray):
+        """
+        replace the whole content by the arrays exported by a full precision grammar, the weights are encoded,
+        so the codes are held in the process' memory
+        """
+        super().restore(keys, column_keys, column_rows, self.encode(data), self.logs, np.array(best_role),
+                        self.encode(best_score))
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, self.encode(value))
+
+
+class Vocabulary:
+    """
+    Interns the tokens of the texts as integer ids, with their roles and dict ids resolved once from the
+    corpus, the id 0 is the missing token (None or '').
+    When bounded, the words are kept by generations : once the current one is full the former one is
+    forgotten, the words encoded meanwhile are moved to the current one with their id. The ids are never
+    reused, a key made of forgotten ids is never found again
+    """
+
+    def __init__(self, roles: dict, words_id: dict, skip=None, limit: int = None, forget=None):
+        """
+        :param roles: the corpus' word -> [role] index
+        :param words_id: the corpus' word -> [dict id] index
+        :param skip: a predicate telling whether a word is ignored by the grammar analysis
+        :param limit: count of words of a generation, None keeps them all
+        :param forget: called with the set of ids forgotten, to drop the keys made of them
+        """
+        self.roles = roles
+        self.words_id = words_id
+        self.skip = skip
+        self.limit = limit
+        self.forget = forget
+
+        # word -> id, for the current and the former generation
+        self.ids = {None: 0, '': 0}
+        self.former = {}
+        # id -> word
+        self.words = {0: None}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+        # id -> (roles, dict ids, skipped), resolved on demand
+        self._infos = {}
+
+    def __len__(self):
+        return len(self.words)
+
+    def encode(self, word: str) -> int:
+        try:
+            return self.ids[word]
+        except KeyError:
+            pass
+
+        with self.lock:
+            if word in self.ids:
+                return self.ids[word]
+
+            token = self.former.pop(word, None)
+            if token is None:
+                token = self.next_id
+                self.next_id += 1
+                self.words[token] = word
+
+            self.ids[word] = token
+            if self.limit and len(self.ids) > self.limit:
+                self._rotate()
+
+            return token
+
+    def _rotate(self):
+        """
+        forgets the former generation, the current one becomes the former
+        """
+        forgotten = set(self.former.values())
+        for token in forgotten:
+            self.words.pop(token, None)
+            self._infos.pop(token, None)
+
+        self.former, self.ids = self.ids, {None: 0, '': 0}
+        del self.former[None], self.former['']
+
+        if self.forget and len(forgotten):
+            self.forget(forgotten)
+
+    def infos(self, token: int) -> (list, list, bool):
+        """
+        the roles and dict ids of the token, [0] if unknown, and whether the analysis skips it, a forgotten
+        token has no role and is skipped
+        """
+        try:
+            return self._infos[token]
+        except KeyError:
+            pass
+
+        try:
+            word = self.words[token]
+        except KeyError:
+            return [], [], True
+        try:
+            roles, words_id = self.roles[word], self.words_id[word]
+        except KeyError:
+            roles, words_id = [0], [0]
+
+        res = self._infos[token] = (roles, words_id, bool(token and self.skip and self.skip(word)))
+        return res
+
+    def reset(self):
+        """
+        forgets the resolved infos, must be called once the corpus' words changed
+        """
+        self._infos = {}
+
+
+class TokenStream:
+    """
+    The tokens of a text encoded as vocabulary ids, a (x1, x2, y, z) row per token : the word before the
+    previous one, the previous one, the word and the next one, x1 is 0 after a sentence's break.
+    The rows are the keys of the grammar's solutions
+    """
+    __slots__ = ('positions', 'ids')
+
+    def __init__(self, positions: np.ndarray, ids: np.ndarray):
+        self.positions = positions
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.positions)
+
+    @classmethod
+    def encode(cls, vocabulary: Vocabulary, tokens):
+        """
+        :param tokens: the (position, previous word, word, next word) tokens, as yielded by T.Regex.tokenize
+        """
+        positions, ids = [], []
+        x1 = 0
+        for pos, a2, word, n in tokens:
+            x2 = vocabulary.encode(a2)
+            positions.append(pos)
+            ids.append((x1 if x2 else 0, x2, vocabulary.encode(word), vocabulary.encode(n)))
+            x1 = x2
+
+        return cls(np.array(positions, dtype=np.int32), np.array(ids, dtype=np.int32).reshape(-1, 4))
+
+    def keys(self) -> list:
+        return list(map(tuple, self.ids.tolist()))
+
+    def find(self, position: int, length: int) -> tuple:
+        """
+        the key of the token of the given length at this position, None if there is no token
+        """
+        for k, pos in enumerate(self.positions.tolist()):
+            if pos + length >= position >= pos:
+                return tuple(self.ids[k].tolist())
+
+        return None
+
+
+class PrediktIndex:
+    """
+    A prefix index over the predikt's (first ancestor, last ancestor, word) entries, like a trie whose nodes
+    are contiguous ranges of sorted arrays, a node is found by bisection and its heaviest entry by the
+    minimum rank of the range. The entries are stored twice : sorted by word, and grouped by last ancestor
+    then sorted by word.
+    The rank of an entry is its position in the rows given heaviest first, the lookups return the same
+    word as a scan of the weight ordered lists.
+    The nodes holding more than node_size entries carry their answers computed once : the heaviest word of
+    the node, and for every last ancestor the top_k heaviest ranks a completion walks, so the lookups of the
+    common prefixes don't scan their whole range. A completion whose first ancestor is none of the top_k's
+    is looked for in the node at once, by the ids of the first ancestors
+    """
+    # greater than any character, prefix + end is greater than every word starting by prefix
+    end = chr(0x10ffff)
+    node_size = 64
+    top_k = 16
+
+    def __init__(self, rows=()):
+        """
+        :param rows: the (first ancestor, last ancestor, word) entries, the heaviest first
+        """
+        self.first, self.last, self.word = [], [], []
+        for first, last, word in rows:
+            self.first.append(str(first))
+            self.last.append(str(last))
+            self.word.append(str(word))
+
+        # by word
+        order = sorted(range(len(self.word)), key=lambda i: (self.word[i], i))
+        self.words = [self.word[i] for i in order]
+        self.ranks = np.array(order, dtype=np.int32)
+        self.lengths = np.array([len(word) for word in self.words], dtype=np.int32)
+
+        # by last ancestor, then by word
+        order = sorted(range(len(self.word)), key=lambda i: (self.last[i], self.word[i], i))
+        self.tail_words = [self.word[i] for i in order]
+        self.tail_ranks = np.array(order, dtype=np.int32)
+        self.tail_lengths = np.array([len(word) for word in self.tail_words], dtype=np.int32)
+
+        # the first ancestors' ids in the tail order, the ids follow the reversed ancestors' order so those ending
+        # by a given word are contiguous
+        ancestors = sorted(set(self.first), key=lambda ancestor: ancestor[::-1])
+        self.reversed_ancestors = [ancestor[::-1] for ancestor in ancestors]
+        ids = {ancestor: n for n, ancestor in enumerate(ancestors)}
+        self.tail_first = np.array([ids[self.first[i]] for i in order], dtype=np.int32)
+
+        # last ancestor -> (start, end) in the tail arrays
+        self.groups = {}
+        for pos, i in enumerate(order):
+            start, _ = self.groups.get(self.last[i], (pos, pos))
+            self.groups[self.last[i]] = (start, pos + 1)
+
+        # the large nodes' answers, prefix -> rank of the heaviest word, -1 if none
+        self.heads = {}
+        for prefix, lo, hi in self._large_nodes(self.words, 0, len(self.words)):
+            ranks = self._completions(self.ranks, self.lengths, prefix, lo, hi)
+            self.heads[prefix] = int(ranks.min()) if len(ranks) else -1
+
+        # (last ancestor, prefix) -> (the top_k completions' ranks sorted, rank of the heaviest word)
+        self.tops = {}
+        for last, (start, end) in self.groups.items():
+            for prefix, lo, hi in self._large_nodes(self.tail_words, start, end):
+                ranks = self._completions(self.tail_ranks, self.tail_lengths, prefix, lo, hi)
+                self.tops[last, prefix] = (np.sort(ranks)[:self.top_k], int(self.tail_ranks[lo:hi].min()))
+
+    def __len__(self):
+        return len(self.word)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.ranks, self.lengths, self.tail_ranks, self.tail_lengths,
+                                              self.tail_first)) + \
+            sum(top.nbytes for top, _ in self.tops.values())
+
+    def _node(self, words: list, prefix: str, start: int, end: int) -> (int, int):
+        lo = bisect.bisect_left(words, prefix, start, end)
+        return lo, bisect.bisect_left(words, prefix + self.end, lo, end)
+
+    def _large_nodes(self, words: list, start: int, end: int):
+        """
+        yields the (prefix, lo, hi) nodes of the sorted words' range holding more than node_size entries, a
+        node's children are only visited if it's large
+        """
+        stack = [('', start, end)]
+        while len(stack):
+            prefix, lo, hi = stack.pop()
+            if hi - lo <= self.node_size:
+                continue
+            if prefix:
+                yield prefix, lo, hi
+
+            # the words equal to the prefix have no child
+            pos = bisect.bisect_right(words, prefix, lo, hi)
+            while pos < hi:
+                child = prefix + words[pos][len(prefix)]
+                child_end = bisect.bisect_left(words, child + self.end, pos, hi)
+                stack.append((child, pos, child_end))
+                pos = child_end
+
+    @staticmethod
+    def _completions(ranks: np.ndarray, lengths: np.ndarray, prefix: str, lo: int, hi: int) -> np.ndarray:
+        """
+        the ranks of the node's words longer than the prefix and 2 characters
+        """
+        return ranks[lo:hi][lengths[lo:hi] > max(len(prefix), 2)]
+
+    def best(self, prefix: str) -> str:
+        """
+        the heaviest word longer than the prefix and 2 characters starting by the prefix, None if no word
+        """
+        if not prefix:
+            return None
+
+        try:
+            rank = self.heads[prefix]
+            return self.word[rank] if rank >= 0 else None
+        except KeyError:
+            pass
+
+        lo, hi = self._node(self.words, prefix, 0, len(self.words))
+        ranks = self._completions(self.ranks, self.lengths, prefix, lo, hi)
+        return self.word[ranks.min()] if len(ranks) else None
+
+    def complete(self, first: str, last: str, prefix: str) -> str:
+        """
+        the heaviest word longer than the prefix and 2 characters starting by the prefix whose ancestors
+        end by "first last", None if no word
+        """
+        try:
+            start, end = self.groups[last]
+        except KeyError:
+            return None
+
+        try:
+            top, _ = self.tops[last, prefix]
+        except KeyError:
+            pass
+        else:
+            for rank in top.tolist():
+                if self.first[rank].endswith(first):
+                    return self.word[rank]
+
+            # the node holds no other completion
+            if len(top) < self.top_k:
+                return None
+
+        # the ids of the first ancestors ending by first
+        suffix = first[::-1]
+        a = bisect.bisect_left(self.reversed_ancestors, suffix)
+        b = bisect.bisect_left(self.reversed_ancestors, suffix + self.end, a)
+
+        lo, hi = self._node(self.tail_words, prefix, start, end)
+        ids = self.tail_first[lo:hi]
+        ranks = self.tail_ranks[lo:hi][(self.tail_lengths[lo:hi] > max(len(prefix), 2)) & (ids >= a) & (ids < b)]
+        return self.word[ranks.min()] if len(ranks) else None
+
+    def follow(self, last: str, prefix: str) -> str:
+        """
+        the heaviest word starting by the prefix after the last ancestor, None if no word
+        :raise KeyError: the last ancestor is unknown
+        """
+        start, end = self.groups[last]
+        try:
+            return self.word[self.tops[last, prefix][1]]
+        except KeyError:
+            pass
+
+        lo, hi = self._node(self.tail_words, prefix, start, end)
+        return self.word[self.tail_ranks[lo:hi].min()] if lo < hi else None
+
+    def predict(self, w1: str, w2: str, word: str, greedy=True) -> str:
+        """
+        the completion of the word being typed after w1 and w2
+        :param greedy: if False and no word follows both ancestors, looks for a word following the last one
+        """
+        # the heaviest word starting by the word and following both ancestors
+        if self.best(word) is not None:
+            res = self.complete(w1, w2, word)
+            if res or greedy:
+                return res or ''
+
+        # the heaviest word starting by the word and following the last ancestor, the heaviest word
+        # starting by the word otherwise
+        try:
+            return self.follow(w2, word) or self.best(word) or ''
+        except KeyError:
+            return ''
+
+
+def _try_lock(f) -> bool:
+    """
+    non blocking exclusive lock of an opened file, released when it's closed
+    """
+    try:
+        f.seek(0)
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+
+    return True
+
+
+class UpvoteJournal:
+    """
+    A write-behind queue for the grammar's upvotes, every vote is appended to an instance's journal file
+    before being acknowledged and coalesced per (x1, x2, y, z) cell, the cells are then written to the
+    corpus.db in a single transaction by flush.
+    The journals are replayed at startup, the records hold the cell's new weight so replaying them twice
+    is harmless, the journals locked by a running instance are skipped
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.file = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.file = open(os.path.join(self.path, f'{os.getpid()}.journal'), mode='a+', encoding='utf-8')
+        _try_lock(self.file)
+
+    def _write(self, records: dict):
+        for (x1, x2, y, z), w in records.items():
+            self.file.write(f'{x1} {x2} {y} {z} {w}\n')
+        self.file.flush()
+        # an upvote is a confirmed user action, it's on the disk before being acknowledged
+        os.fsync(self.file.fileno())
+
+    def record(self, x1: int, x2: int, y: int, z: int, w: int) -> bool:
+        """
+        journals the new weight of the cell
+        :return: True if it's the first pending vote, a flush should then be scheduled
+        """
+        with self.lock:
+            if self.file is None:
+                self._open()
+
+            self._write({(x1, x2, y, z): w})
+            first = not len(self.pending)
+            self.pending[(x1, x2, y, z)] = w
+
+        return first
+
+    @staticmethod
+    def _commit(db_path: str, records: dict):
+        connector = sqlite3.connect(db_path)
+        with connector:
+            connector.executemany(
+                'UPDATE grammar SET w=? WHERE x1=? AND x2=? AND y=? AND z=?',
+                [(w, x1, x2, y, z) for (x1, x2, y, z), w in records.items()]
+            )
+        connector.close()
+
+    def flush(self, db_path: str) -> int:
+        """
+        writes the pending votes to the corpus.db, the journal then only keeps the votes received meanwhile
+        :return: the count of written cells
+        """
+        with self.lock:
+            records, self.pending = self.pending, {}
+
+        if not len(records):
+            return 0
+
+        try:
+            self._commit(db_path, records)
+        except sqlite3.Error:
+            # they'll be written by the next flush
+            with self.lock:
+                self.pending = {**records, **self.pending}
+            raise
+
+        with self.lock:
+            self.file.truncate(0)
+            self._write(self.pending)
+
+        return len(records)
+
+    def replay(self, db_path: str) -> int:
+        """
+        writes the votes left by the instances which didn't flush their journal
+        :return: the count of written cells
+        """
+        if not os.path.isdir(self.path):
+            return 0
+
+        count = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if self.file is not None and path == self.file.name:
+                continue
+
+            records = {}
+            try:
+                with open(path, mode='r+', encoding='utf-8') as f:
+                    # locked by its running instance, which will flush it
+                    if not _try_lock(f):
+                        continue
+
+                    for line in f:
+                        try:
+                            x1, x2, y, z, w = map(int, line.split())
+                        except ValueError:
+                            # the last line of a journal interrupted while writing
+                            continue
+                        records[(x1, x2, y, z)] = w
+            except OSError:
+                continue
+
+            if len(records):
+                self._commit(db_path, records)
+                count += len(records)
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        return count
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+
+            self.file.close()
+            if not len(self.pending):
+                try:
+                    os.remove(self.file.name)
+                except OSError:
+                    pass
+            self.file = None
+
+
+class Snapshot:
+    """
+    A binary copy of the corpus.db's tables read at startup, stored as raw numpy arrays and string tables
+    in a folder, it's only valid for the corpus.db it was built from (size and modification time), for the
+    given weight level and format version.
+
+    The arrays are meant to be memory-mapped by every running instance, since a mapped file can't be
+    replaced (on Windows), each write goes to a new generation's subfolder and the manifest is switched
+    to it once complete, the former generations are removed when no instance maps them anymore
+    """
+    version = 3
+
+    # empty grammar rows appended to the snapshot for the contexts learnt during the session
+    spare_rows = 4096
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def file(self, name: str, generation: str = None) -> str:
+        if generation is None:
+            generation = self.manifest().get('generation', '')
+        return os.path.join(self.path, generation, name)
+
+    def signature(self, db_path: str, level: int) -> dict:
+        return {'version': self.version, 'level': level, **db_signature(db_path)}
+
+    def manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.path, 'manifest.json'), mode='r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def valid(self, db_path: str, level: int) -> bool:
+        try:
+            signature = self.signature(db_path, level)
+        except OSError:
+            return False
+
+        manifest = self.manifest()
+        return all(manifest.get(key) == value for key, value in signature.items()) and \
+            os.path.isdir(os.path.join(self.path, manifest.get('generation', '')))
+
+    def _save_strings(self, path: str, strings: list):
+        with open(path, mode='wb') as f:
+            f.write('\x00'.join(strings).encode('utf-8'))
+
+    def _load_strings(self, path: str) -> list:
+        with open(path, mode='rb') as f:
+            content = f.read()
+        return content.decode('utf-8').split('\x00') if len(content) else []
+
+    def _clean(self, current: str):
+        """
+        removes the former generations, the ones still mapped by another instance will be removed by a
+        later write
+        """
+        for generation in os.listdir(self.path):
+            path = os.path.join(self.path, generation)
+            if generation in (current, 'manifest.json'):
+                continue
+
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def write(self, db_path: str, level: int):
+        """
+        reads the corpus.db's tables and writes the snapshot in a new generation, the manifest is replaced
+        last so an interrupted write leaves the previous snapshot untouched
+        """
+        signature = self.signature(db_path, level)
+
+        connector = connect(db_path, readonly=True)
+        cursor = connector.cursor()
+        size = len(cursor.execute('SELECT name FROM morphs').fetchall())
+        dict_data = cursor.execute('SELECT * FROM dict ORDER BY weight ASC').fetchall()
+        predikt_data = cursor.execute('SELECT * FROM predikt WHERE w>? ORDER BY w ASC', (level,)).fetchall()
+        grammar_data = cursor.execute('SELECT * FROM grammar WHERE w>?', (level,)).fetchall()
+        connector.close()
+
+        grammar = SparseGrammar(size)
+        grammar.load(grammar_data)
+
+        generation = f'{time.time_ns():x}'
+        os.makedirs(os.path.join(self.path, generation))
+
+        def file(name):
+            return self.file(name, generation)
+
+        ids, words, roles, lemmas, weights = zip(*dict_data) if len(dict_data) else ((),) * 5
+        np.save(file('dict_id.npy'), np.array(ids, dtype=np.int64))
+        np.save(file('dict_role.npy'), np.array(roles, dtype=np.int32))
+        np.save(file('dict_weight.npy'), np.array(weights, dtype=np.int64))
+        np.save(file('dict_lemma_id.npy'), np.array([isinstance(lemma, int) for lemma in lemmas], dtype=bool))
+        self._save_strings(file('dict_word.bin'), [str(word) for word in words])
+        self._save_strings(file('dict_lemma.bin'), ['' if lemma is None else str(lemma) for lemma in lemmas])
+
+        np.save(file('predikt.npy'), np.array(predikt_data, dtype=np.int64).reshape(-1, 4))
+
+        for name, array in grammar.export(spare=self.spare_rows).items():
+            np.save(file(f'grammar_{name}.npy'), array)
+
+        manifest = os.path.join(self.path, 'manifest.json')
+        with open(f'{manifest}.tmp', mode='w', encoding='utf-8') as f:
+            json.dump({**signature, 'morphs': size, 'generation': generation}, f)
+        os.replace(f'{manifest}.tmp', manifest)
+
+        self._clean(generation)
+
+    def load(self, mmap_mode: str = None) -> dict:
+        """
+        reads the snapshot back
+        :param mmap_mode: the grammar's arrays are memory-mapped with this mode (see numpy.load),
+        'c' shares the pages between the instances and keeps the changes private
+        :return: the dict and predikt tables as lists of rows, like they're fetched from SQLite, and the
+        grammar's arrays
+        """
+        manifest = self.manifest()
+
+        def file(name):
+            return self.file(name, manifest['generation'])
+
+        ids = np.load(file('dict_id.npy')).tolist()
+        roles = np.load(file('dict_role.npy')).tolist()
+        weights = np.load(file('dict_weight.npy')).tolist()
+        lemma_id = np.load(file('dict_lemma_id.npy')).tolist()
+        words = self._load_strings(file('dict_word.bin'))
+        lemmas = [int(lemma) if is_id else lemma for lemma, is_id in zip(self._load_strings(file('dict_lemma.bin')), lemma_id)]
+
+        return {
+            'morphs': manifest['morphs'],
+            'dict': list(zip(ids, words, roles, lemmas, weights)),
+            'predikt': list(map(tuple, np.load(file('predikt.npy')).tolist())),
+            'grammar': self.load_grammar(mmap_mode, manifest['generation'])
+        }
+
+    def load_grammar(self, mmap_mode: str = None, generation: str = None) -> dict:
+        """
+        reads only the grammar's arrays back, see load
+        """
+        generation = generation or self.manifest()['generation']
+
+        return {
+            name: np.load(self.file(f'grammar_{name}.npy', generation), mmap_mode=mmap_mode)
+            for name in ('keys', 'column_keys', 'column_rows', 'data', 'logs', 'best_role', 'best_score')
+        }
+
+
+class IndexCache:
+    """
+    The indexes derived from the dict and predikt tables (see build_indexes) pickled in one file, after a
+    header holding the signature of the corpus.db they were built from and its content's hash.
+    A corpus.db whose modification time changed but not its content (copied, restored) is recognized by
+    its hash, the header is then updated
+    """
+    version = 2
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def header(self) -> dict:
+        try:
+            with open(self.path, mode='rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return {}
+
+    def valid(self, db_path: str, level: int) -> bool:
+        """
+        whether the cache may match the corpus.db, only the header is read : a corpus.db whose modification
+        time alone changed is hashed by load, away from the UI's thread
+        """
+        try:
+            signature = db_signature(db_path)
+        except OSError:
+            return False
+
+        header = self.header()
+        if header.get('version') != self.version or header.get('level') != level:
+            return False
+
+        if header['signature'] == signature:
+            return True
+
+        # only the modification time changed
+        return header['signature']['size'] == signature['size'] and 'wal' not in signature
+
+    def _dump(self, header: dict, indexes: dict):
+        with open(f'{self.path}.tmp', mode='wb') as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(indexes, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def load(self, db_path: str):
+        """
+        reads the indexes back, valid must have been checked before
+        :return: the indexes, see build_indexes, None if the corpus.db's content changed
+        """
+        with open(self.path, mode='rb') as f:
+            header = pickle.load(f)
+
+            # recognized by its hash, the next start won't need to hash it again
+            signature = db_signature(db_path)
+            if header['signature'] != signature:
+                if header['hash'] != file_digest(db_path):
+                    return None
+
+                header['signature'] = signature
+                indexes = pickle.load(f)
+                try:
+                    self._dump(header, indexes)
+                except OSError:
+                    pass
+
+                return indexes
+
+            return pickle.load(f)
+
+    def write(self, db_path: str, level: int):
+        """
+        builds the indexes from the corpus.db and replaces the cache
+        """
+        # taken before reading, a change made meanwhile makes the cache stale
+        header = {
+            'version': self.version,
+            'level': level,
+            'signature': db_signature(db_path),
+            'hash': file_digest(db_path)
+        }
+
+        self._dump(header, build_indexes(db_path, level))
+
+
+def db_signature(db_path: str) -> dict:
+    """
+    the size and modification time of the corpus.db, and of its write-ahead log if not empty
+    """
+    stat = os.stat(db_path)
+    signature = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns
+    }
+
+    # in WAL mode the last changes may not be checkpointed in the corpus.db yet
+    try:
+        wal = os.stat(f'{db_path}-wal')
+        if wal.st_size:
+            signature['wal'] = [wal.st_size, wal.st_mtime_ns]
+    except FileNotFoundError:
+        pass
+
+    return signature
+
+
+def connect(db_path: str, readonly=False) -> sqlite3.Connection:
+    """
+    opens the corpus.db, in WAL mode the read-only connections neither wait for nor block the other ones
+    """
+    if readonly:
+        return sqlite3.connect(f'{pathlib.Path(db_path).absolute().as_uri()}?mode=ro', uri=True)
+
+    return sqlite3.connect(db_path)
+
+
+def enable_wal(db_path: str):
+    """
+    switches the corpus.db to the write-ahead log journal, it's persistent
+    """
+    connector = sqlite3.connect(db_path)
+    connector.execute('PRAGMA journal_mode=WAL')
+    connector.close()
+
+
+def weight_tiers(level: int, bounds: tuple) -> list:
+    """
+    splits the weights above level into tiers, the heaviest first
+    :param bounds: the decreasing weights separating the tiers
+    :return: the (low, high) weights of each tier, low < w <= high, high is None for the first one
+    """
+    tiers, high = [], None
+    for bound in bounds:
+        if bound > level:
+            tiers.append((bound, high))
+            high = bound
+
+    tiers.append((level, high))
+    return tiers
+
+
+def tier_clause(tier: tuple) -> (str, tuple):
+    """
+    returns the WHERE clause of the tier's rows and its parameters
+    """
+    low, high = tier
+    if high is None:
+        return 'w>?', (low,)
+
+    return 'w>? AND w<=?', (low, high)
+
+
+def digest_words(data: list) -> (dict, dict, dict, dict, dict):
+    """
+    builds the words' indexes from the dict table's rows
+    :return: words, lemmas, roles, words_id and unique_words
+    """
+    words = {'': (0, 0, '', 0)}
+    lemmas = {}
+    roles = {}
+    words_id = {}
+
+    words.update({word_id: (word, role, lemma, weight) for word_id, word, role, lemma, weight in data})
+    for word_id, word, role, lemma, weight in data:
+        try:
+            new_lemma = word if lemma in ('', 0) else (lemma if isinstance(lemma, str) else words[lemma][0])
+            lemmas[new_lemma][role] = word_id
+        except KeyError:
+            lemmas[new_lemma] = {role: word_id}
+
+        try:
+            roles[word].append(role)
+            words_id[word].append(word_id)
+        except KeyError:
+            roles[word] = [role]
+            words_id[word] = [word_id]
+
+    return words, lemmas, roles, words_id, {word_id: word for word_id, word, role, lemma, weight in data}
+
+
+def digest_ancestors(predikt_data: list) -> dict:
+    """
+    builds the (x1, x2) -> [word_id] index from the predikt table's rows
+    """
+    res = {}
+
+    for x1, x2, word_id, w in predikt_data:
+        try:
+            res[(x1, x2)].append(word_id)
+        except KeyError:
+            res[(x1, x2)] = [word_id]
+
+    return res
+
+
+def digest_predikt(predikt_data: list, words: dict) -> (dict, dict):
+    """
+    builds the predikt's (x1, x2, role) -> word_id and (x1, role) -> [x2] indexes from the predikt table's rows
+    """
+    predict_roles = {
+        (x1, x2, words[word_id][1]): word_id
+        for x1, x2, word_id, w in predikt_data
+    }
+
+    predict_after = {}
+    for x1, x2, word_id, w in predikt_data:
+        try:
+            predict_after[(x1, words[word_id][1])].append(x2)
+        except KeyError:
+            predict_after[(x1, words[word_id][1])] = [x2]
+
+    return predict_roles, predict_after
+
+
+def predikt_entries(predikt_data: list, words: dict) -> list:
+    """
+    returns the (first ancestor, last ancestor, word) entries of the PrediktIndex, the heaviest first
+    :param predikt_data: the predikt table's rows, the lightest first
+    """
+    rows = []
+    for x1, x2, word_id, w in reversed(predikt_data):
+        try:
+            rows.append((words[x1][0], words[x2][0], words[word_id][0]))
+        except KeyError:
+            continue
+
+    return rows
+
+
+def build_indexes(db_path: str, level: int) -> dict:
+    """
+    returns the indexes the Corpus derives from the dict and predikt tables :
+    words, lemmas, roles, words_id and unique_words, predict_roles, predict_after, predict_ancestors and predikt
+    """
+    connector = connect(db_path, readonly=True)
+    dict_data = connector.execute('SELECT * FROM dict ORDER BY weight ASC').fetchall()
+    predikt_data = connector.execute('SELECT * FROM predikt WHERE w>? ORDER BY w ASC', (level,)).fetchall()
+    connector.close()
+
+    words, lemmas, roles, words_id, unique_words = digest_words(dict_data)
+    predict_roles, predict_after = digest_predikt(predikt_data, words)
+
+    return {
+        'words': words,
+        'lemmas': lemmas,
+        'roles': roles,
+        'words_id': words_id,
+        'unique_words': unique_words,
+        'predict_roles': predict_roles,
+        'predict_after': predict_after,
+        'predict_ancestors': digest_ancestors(predikt_data),
+        'predikt': PrediktIndex(predikt_entries(predikt_data, words))
+    }
+
+
+def renote(n: float) -> float:
+    """
+    the note (0-100) displayed for a score (0-100), the solutions noted under 30 are notified as grammar errors
+    """
+    ramp = 1.75
+    return (pow(n, ramp) / (pow(100, ramp) / 100)) * (1 - n / 100) + \
+        (1 - math.cos(pow(n, pow(n, .5) / 10) / (100 / math.pi))) * 50 * (n / 100)
+
+
+def log_notes(logs: np.ndarray, best_logs: np.ndarray, cells: np.ndarray) -> np.ndarray:
+    """
+    the notes log10(cell) / log10(best) from the log tables, the notes are NaN when the cell or the best are empty
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        notes = logs / best_logs
+
+    notes[(cells <= 0) | ~np.isfinite(notes)] = np.nan
+    return notes
+
+
+def running_best(notes: np.ndarray, floor: float = .0) -> np.ndarray:
+    """
+    returns the indexes of the notes improving the previous best one, in order, this is what the
+    Analyze job appends to the solutions of a token
+    :param notes: flat array of notes, NaN are ignored
+    :param floor: the score to beat
+    """
+    scores = np.where(np.isnan(notes), -np.inf, notes)
+    previous = np.maximum.accumulate(np.concatenate(([floor], scores)))[:-1]
+
+    return np.flatnonzero(scores > previous)
+
+
+def score_contexts(grammar: SparseGrammar, x1, x2, y, z) -> (np.ndarray, bool):
+    """
+    scores all the roles y of a token against all its contexts in one pass
+    :return: the notes as a (len(x1) * len(x2) * len(z), len(y)) array, contexts iterated as x1 > x2 > z,
+    and if the token fails to find a context where one of its roles is the best
+    """
+    rows = grammar.rows(x1, x2, z)
+    cells = grammar.data[np.ix_(rows, y)]
+    best = grammar.best_score[rows][:, None]
+
+    notes = log_notes(
+        grammar.logs[np.ix_(rows, y)],
+        grammar.logs[rows, grammar.best_role[rows]][:, None],
+        cells
+    )
+
+    # the last event decides : an empty cell fails, a cell matching the best of its context succeeds
+    events = np.where(cells == 0, 1, np.where(cells == best, 0, -1)).ravel()
+    decisive = np.flatnonzero(events >= 0)
+    fail = not len(decisive) or bool(events[decisive[-1]])
+
+    return notes, fail
+
+
+def score_fallback(grammar: SparseGrammar, x2, y, z) -> (np.ndarray, np.ndarray):
+    """
+    scores all the roles y of a token ignoring the x1 axis
+    :return: the notes as a (len(z) * len(x2), len(y)) array, contexts iterated as z > x2, and the best x1
+    for each of them
+    """
+    notes = np.full(shape=(len(z) * len(x2), len(y)), fill_value=np.nan)
+    best_x1 = np.zeros(shape=notes.shape, dtype=np.int64)
+
+    for i, (b, d) in enumerate((b, d) for d in z for b in x2):
+        x1, rows = grammar.column(b, d)
+        if not len(rows):
+            continue
+
+        cells = grammar.data[np.ix_(rows, y)]
+        best = grammar.best_role[rows]
+        top = cells.argmax(axis=0)
+
+        notes[i] = log_notes(
+            grammar.logs[np.ix_(rows, y)].max(axis=0),
+            grammar.logs[rows, best].max(),
+            cells.max(axis=0)
+        )
+        best_x1[i] = x1[top]
+
+    return notes, best_x1
+
+
+class Candidate:
+    """
+    A role scored for a token by analyze_tokens, x1, x2 and z are either the roles of the context or the
+    candidates chosen for the neighbour tokens
+    """
+    __slots__ = ('word', 'score', 'role', 'position', 'x1', 'x2', 'z')
+
+    def __init__(self, word='', score=.0, role=0, pos=0, x1=0, x2=0, z=0):
+        self.word = word
+        self.score = score
+        self.role = role
+        self.position = pos
+        self.x1 = x1
+        self.x2 = x2
+        self.z = z
+
+
+def analyze_tokens(grammar: SparseGrammar, keys: list, infos, words, ancestors, factory=Candidate) -> dict:
+    """
+    scores every token of a block
+    :param keys: the tokens' (x1, x2, y, z) vocabulary ids, see TokenStream.keys
+    :param infos: returns the (roles, dict ids, skipped) of a vocabulary id, see Vocabulary.infos
+    :param words: the words by vocabulary id
+    :param ancestors: the (x2's dict id, y's dict id) pairs known by the predikt table
+    :param factory: the Candidate's class to instantiate
+    :return: the best candidate for every token, by its key
+    """
+    recorded = {}
+    solutions = {}
+    i = 0
+    for key in keys:
+        if key in recorded:
+            continue
+
+        previous_word, a2, word, n = key
+        y, word_ids, skipped = infos(word)
+        if skipped:
+            continue
+
+        x1, w1, _ = infos(previous_word)
+        x2, w2, _ = infos(a2)
+        x2o, w2o = x2, w2
+        word = words[word]
+        if i > 0:
+            try:
+                x2, w2 = zip(*filter(lambda a: a[0] in [s.role for s in solutions[i - 1]], zip(x2, w2)))
+            except ValueError:
+                pass
+
+        z, wz, _ = infos(n)
+
+        solutions[i] = [factory(word, pos=i, role=y[-1])]
+
+        notes, fail = score_contexts(grammar, x1, x2, y, z)
+        contexts = [(a, b, d) for a in x1 for b in x2 for d in z]
+        for k in running_best(notes.ravel(), solutions[i][-1].score):
+            (a, b, d), c = contexts[k // len(y)], y[k % len(y)]
+            solutions[i].append(factory(
+                word, score=float(notes.flat[k]), role=c,
+                pos=i, x1=a, x2=b, z=d
+            ))
+
+        progress_factor = 1.5
+        degress_factor = 0.95
+        if fail:
+            notes, best_x1 = score_fallback(grammar, x2o, y, z)
+            contexts = [(b, d) for d in z for b in x2o]
+            for k in running_best(notes.ravel(), solutions[i][-1].score):
+                (b, d), c = contexts[k // len(y)], y[k % len(y)]
+                solutions[i].append(factory(
+                    word, score=float(notes.flat[k]), role=c,
+                    pos=i, x1=int(best_x1.flat[k]), x2=b, z=d
+                ))
+            for sc in word_ids:
+                for sb in w2o:
+                    if (sb, sc) in ancestors:
+                        solutions[i][-1].score = min(solutions[i][-1].score * progress_factor, 1)
+                    elif sb in w2:
+                        solutions[i][-1].score *= degress_factor
+                        break
+                else:
+                    continue
+                break
+
+        if i > 0:
+            solutions[i][-1].x2 = solutions[i - 1][-1]
+            solutions[i - 1][-1].z = solutions[i][-1]
+            if i > 1:
+                solutions[i][-1].x1 = solutions[i - 2][-1]
+
+        bests = [t for t in sorted(solutions[i], key=lambda x: x.score, reverse=True)]
+        recorded[key] = bests[0]
+
+        i += 1
+
+    return recorded
+
+
+def flatten_solutions(recorded: dict) -> (dict, list):
+    """
+    the candidates as plain tuples, to be sent between processes, the links between the candidates are
+    replaced by -(n + 1), n being the linked candidate's row
+    :return: the row of the best candidate by key and the (word, score, role, position, x1, x2, z) rows
+    """
+    table, seen = [], {}
+
+    def row(candidate):
+        n = seen.get(id(candidate))
+        if n is None:
+            n = seen[id(candidate)] = len(table)
+            table.append(candidate)
+        return n
+
+    records = {key: row(candidate) for key, candidate in recorded.items()}
+
+    # the table grows while the links are followed
+    rows, n = [], 0
+    while n < len(table):
+        c = table[n]
+        links = (-row(link) - 1 if isinstance(link, Candidate) else link for link in (c.x1, c.x2, c.z))
+        rows.append((c.word, c.score, c.role, c.position, *links))
+        n += 1
+
+    return records, rows
+
+
+def expand_solutions(records: dict, rows: list, factory=Candidate) -> dict:
+    """
+    rebuilds the candidates flattened by flatten_solutions
+    """
+    candidates = [factory(word, score, role, position) for word, score, role, position, *_ in rows]
+    for candidate, (*_, x1, x2, z) in zip(candidates, rows):
+        candidate.x1, candidate.x2, candidate.z = (candidates[-v - 1] if v < 0 else v for v in (x1, x2, z))
+
+    return {key: candidates[n] for key, n in records.items()}
+
+
+def blocks_infos(vocabulary: Vocabulary, blocks: list, ancestors) -> (dict, dict, set):
+    """
+    returns what analyze_tokens reads for the blocks, as plain objects : the infos and the words of their
+    vocabulary ids and the pairs of ancestors they could ask for
+    :param blocks: the keys of every block, see TokenStream.keys
+    """
+    tokens = {token for keys in blocks for key in keys for token in key}
+    infos = {token: vocabulary.infos(token) for token in tokens}
+    words = {token: vocabulary.words[token] for token in tokens}
+
+    pairs = set()
+    for keys in blocks:
+        for _, a2, word, _ in keys:
+            pairs.update((sb, sc) for sb in infos[a2][1] for sc in infos[word][1] if (sb, sc) in ancestors)
+
+    return infos, words, pairs
+
+
+# the grammar of an analysis worker process and the cells changed since its snapshot, see ProcessAnalyzer
+_worker = {}
+
+
+def _init_worker(snapshot_path: str):
+    arrays = Snapshot(snapshot_path).load_grammar(mmap_mode='c')
+    grammar = SparseGrammar(arrays['data'].shape[1], capacity=0)
+    grammar.restore(**arrays)
+
+    _worker['grammar'] = grammar
+    _worker['changes'] = {}
+
+
+def _worker_grammar(changes: dict) -> SparseGrammar:
+    """
+    the worker's grammar, with the cells changed since the snapshot
+    """
+    grammar, applied = _worker['grammar'], _worker['changes']
+
+    for cell, w in changes.items():
+        if applied.get(cell) != w:
+            grammar[cell] = w
+            applied[cell] = w
+
+    return grammar
+
+
+def _analyze_blocks(task: tuple) -> list:
+    blocks, infos, words, ancestors, changes = task
+    grammar = _worker_grammar(changes)
+
+    return [flatten_solutions(analyze_tokens(grammar, keys, infos.__getitem__, words, ancestors)) for keys in blocks]
+
+
+class ProcessAnalyzer:
+    """
+    Runs analyze_tokens in worker processes, every worker maps the snapshot's grammar in copy-on-write mode
+    so the pages are shared with the instances, and receives with every task the infos of the tokens and
+    the cells changed since the snapshot was written.
+    The processes are spawned, forking a process running Qt's threads isn't safe
+    """
+
+    def __init__(self, snapshot_path: str, processes: int = 0):
+        self.processes = processes or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.executor = ProcessPoolExecutor(
+            self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(snapshot_path,)
+        )
+
+    def analyze(self, blocks: list, infos: dict, words: dict, ancestors: set, changes: dict) -> list:
+        """
+        analyzes the blocks, spread over the processes
+        :param blocks: the keys of every block, see TokenStream.keys
+        :param infos: the (roles, dict ids, skipped) of the blocks' vocabulary ids
+        :param words: the words of the blocks' vocabulary ids
+        :param ancestors: the pairs of the predikt table found in the blocks, see analyze_tokens
+        :param changes: the weight of the grammar's cells changed since the snapshot
+        :return: the flattened solutions of every block, in order, see expand_solutions
+        """
+        tasks = [
+            (blocks[n::self.processes], infos, words, ancestors, changes)
+            for n in range(min(self.processes, len(blocks)))
+        ]
+
+        results = [None] * len(blocks)
+        for n, records in enumerate(self.executor.map(_analyze_blocks, tasks)):
+            results[n::self.processes] = records
+
+        return results
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def html_blocks(content: str) -> list:
+    """
+    returns the plain text of a page's html, by block, the head (Qt's stylesheet) isn't part of the text
+    """
+    content = re.sub(r'<head>.*?</head>|<style[^>]*>.*?</style>', '', html.unescape(content), flags=re.S | re.I)
+    content = re.sub(r'<(br|/p)\s*/?>', '\n', content)
+    return [block for block in html.unescape(re.sub(r'<[^>]+>', '', content)).split('\n') if block.strip()]
+
+
+def document_blocks(path: str) -> list:
+    """
+    returns the plain text blocks of all the pages of a .786 book, or the lines of a text file
+    """
+    if os.path.splitext(path)[-1] == '.txt':
+        with open(path, mode='r', encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f if line.strip()]
+
+    connector = sqlite3.connect(path)
+    pages = connector.execute('SELECT text FROM book ORDER BY page').fetchall()
+    connector.close()
+
+    return [block for text, in pages for block in html_blocks(text or '')]
+
+
+def _init_learner(snapshot_path: str, roles: dict, words_id: dict, ancestors: dict):
+    _init_worker(snapshot_path)
+    _worker['roles'], _worker['words_id'], _worker['ancestors'] = roles, words_id, ancestors
+
+
+def _count_blocks(task: tuple) -> (Counter, Counter, Counter):
+    """
+    counts the words, predikt's entries and grammar's contexts of the blocks, see CorpusLearner
+    """
+    blocks, skipped, changes = task
+    grammar = _worker_grammar(changes)
+    vocabulary = Vocabulary(_worker['roles'], _worker['words_id'], skipped.__contains__)
+    all_roles = list(range(grammar.size))
+
+    words, predikt, contexts = Counter(), Counter(), Counter()
+    for tokens in blocks:
+        keys = TokenStream.encode(vocabulary, tokens).keys()
+        recorded = analyze_tokens(grammar, keys, vocabulary.infos, vocabulary.words, _worker['ancestors'])
+
+        # the role of every token, None for the skipped and the unknown ones
+        roles = [
+            recorded[key].role if key in recorded and vocabulary.infos(key[2])[1] != [0] else None
+            for key in keys
+        ]
+
+        def neighbours(k):
+            key = keys[k]
+            a = roles[k - 2] if key[0] else 0
+            b = roles[k - 1] if key[1] else 0
+            d = roles[k + 1] if key[3] and k + 1 < len(keys) and keys[k + 1][1] == key[2] else 0
+            return a, b, d
+
+        # an unknown word takes the role the grammar prefers between its neighbours' roles
+        for k, key in enumerate(keys):
+            if roles[k] is None and key in recorded:
+                a, b, d = (r or 0 for r in neighbours(k))
+                notes, _ = score_contexts(grammar, [a], [b], all_roles, [d])
+                if not np.isnan(notes).all():
+                    roles[k] = all_roles[int(np.nanargmax(notes))]
+
+        for k, key in enumerate(keys):
+            if roles[k] is None:
+                continue
+
+            word = vocabulary.words[key[2]]
+            words[word, roles[k]] += 1
+
+            a, b, d = neighbours(k)
+            if None in (a, b, d):
+                continue
+            contexts[a, b, roles[k], d] += 1
+
+            # the missing ancestors are None, stored as the predikt table's '' sentinel
+            first = (vocabulary.words[keys[k - 2][2]], a) if key[0] else (None, None)
+            last = (vocabulary.words[keys[k - 1][2]], b) if key[1] else (None, None)
+            predikt[first + last + (word, roles[k])] += 1
+
+    return words, predikt, contexts
+
+
+class CorpusLearner:
+    """
+    Counts the dict's words, the predikt's entries and the grammar's contexts of tokenized texts in worker
+    processes, the roles of the tokens are found by the grammar analysis (see analyze_tokens), the workers
+    are set up like the ProcessAnalyzer's ones.
+    The counts are summed as the tasks complete, only a few tasks per process are queued at once
+    """
+
+    def __init__(self, snapshot_path: str, roles: dict, words_id: dict, ancestors: dict, changes: dict = None,
+                 processes: int = 0, backlog: int = 2):
+        self.processes = processes or max(1, (os.cpu_count() or 2) - 1)
+        self.backlog = backlog
+        self.changes = changes or {}
+        self.executor = ProcessPoolExecutor(
+            self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_learner,
+            initargs=(snapshot_path, roles, words_id, ancestors)
+        )
+
+        self.pending = []
+        self.tokens = 0
+        self.words, self.predikt, self.contexts = Counter(), Counter(), Counter()
+
+    def _collect(self, future):
+        words, predikt, contexts = future.result()
+        self.words.update(words)
+        self.predikt.update(predikt)
+        self.contexts.update(contexts)
+
+    def feed(self, blocks: list, skipped: set):
+        """
+        :param blocks: the tokens of every block, as yielded by T.Regex.tokenize
+        :param skipped: the words the grammar analysis ignores
+        """
+        self.tokens += sum(map(len, blocks))
+        self.pending.append(self.executor.submit(_count_blocks, (blocks, skipped, self.changes)))
+
+        while len(self.pending) > self.processes * self.backlog:
+            self._collect(self.pending.pop(0))
+
+    def finish(self) -> (Counter, Counter, Counter):
+        """
+        waits for the tasks fed
+        :return: the counts of the (word, role), of the predikt's (first, role, last, role, word, role)
+        and of the grammar's (x1, x2, y, z)
+        """
+        while self.pending:
+            self._collect(self.pending.pop(0))
+
+        return self.words, self.predikt, self.contexts
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def merge_counts(db_path: str, words: dict, predikt: dict, contexts: dict) -> dict:
+    """
+    adds the counts of a CorpusLearner to the corpus.db in a single transaction, they're staged in
+    temporary tables and merged by table with one UPDATE ... FROM for the existing rows and one
+    INSERT ... SELECT for the new ones (SQLite 3.33+)
+    :return: the count of rows updated and inserted by table
+    """
+    connector = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        connector.executescript("""
+            CREATE TEMP TABLE learnt_dict(word TEXT, role INTEGER, w INTEGER, PRIMARY KEY(word, role));
+            CREATE TEMP TABLE learnt_ids(word TEXT, role INTEGER, id INTEGER, w INTEGER, PRIMARY KEY(word, role));
+            CREATE TEMP TABLE learnt_predikt(w1 TEXT, r1 INTEGER, w2 TEXT, r2 INTEGER, word TEXT, role INTEGER,
+                                             w INTEGER);
+            CREATE TEMP TABLE learnt_predikt_ids(x1 INTEGER, x2 INTEGER, word_id INTEGER, w INTEGER,
+                                                 PRIMARY KEY(x1, x2, word_id));
+            CREATE TEMP TABLE learnt_grammar(x1 INTEGER, x2 INTEGER, y INTEGER, z INTEGER, w INTEGER,
+                                             PRIMARY KEY(x1, x2, y, z));
+        """)
+        # the staging only writes the temporary database, the corpus.db isn't locked meanwhile
+        connector.execute('BEGIN')
+        connector.executemany('INSERT INTO learnt_dict VALUES (?, ?, ?)', ((*k, w) for k, w in words.items()))
+        connector.executemany('INSERT INTO learnt_predikt VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              ((*k, w) for k, w in predikt.items()))
+        connector.executemany('INSERT INTO learnt_grammar VALUES (?, ?, ?, ?, ?)', ((*k, w) for k, w in contexts.items()))
+        connector.execute('COMMIT')
+
+        report = {}
+        connector.execute('BEGIN IMMEDIATE')
+        try:
+            # dict, the counts go to the heaviest row of a word and role
+            connector.execute("""
+                INSERT INTO learnt_ids SELECT word, role, id, w FROM (
+                    SELECT d.word, d.role, d.id, t.w, MAX(d.weight) FROM dict d
+                    JOIN learnt_dict t ON d.word=t.word AND d.role=t.role GROUP BY d.word, d.role
+                )
+            """)
+            report['dict'] = [connector.execute(
+                'UPDATE dict SET weight=dict.weight + i.w FROM learnt_ids i WHERE dict.id=i.id'
+            ).rowcount]
+            last_id = connector.execute('SELECT COALESCE(MAX(id), 0) FROM dict').fetchone()[0]
+            report['dict'].append(connector.execute("""
+                INSERT INTO dict (word, role, lemma, weight)
+                SELECT t.word, t.role, '', t.w FROM learnt_dict t
+                LEFT JOIN learnt_ids i ON i.word=t.word AND i.role=t.role WHERE i.id IS NULL
+            """).rowcount)
+            connector.execute('INSERT INTO learnt_ids SELECT word, role, id, weight FROM dict WHERE id>?', (last_id,))
+
+            # predikt, by dict ids
+            connector.execute("""
+                INSERT INTO learnt_predikt_ids
+                SELECT COALESCE(a.id, ''), COALESCE(b.id, ''), c.id, SUM(t.w) FROM learnt_predikt t
+                LEFT JOIN learnt_ids a ON a.word=t.w1 AND a.role=t.r1
+                LEFT JOIN learnt_ids b ON b.word=t.w2 AND b.role=t.r2
+                JOIN learnt_ids c ON c.word=t.word AND c.role=t.role
+                GROUP BY 1, 2, 3
+            """)
+            report['predikt'] = [connector.execute("""
+                UPDATE predikt SET w=predikt.w + t.w FROM learnt_predikt_ids t
+                WHERE predikt.x1=t.x1 AND predikt.x2=t.x2 AND predikt.word_id=t.word_id
+            """).rowcount, connector.execute("""
+                INSERT INTO predikt (x1, x2, word_id, w) SELECT t.x1, t.x2, t.word_id, t.w FROM learnt_predikt_ids t
+                LEFT JOIN predikt p ON p.x1=t.x1 AND p.x2=t.x2 AND p.word_id=t.word_id WHERE p.rowid IS NULL
+            """).rowcount]
+
+            # grammar
+            report['grammar'] = [connector.execute("""
+                UPDATE grammar SET w=grammar.w + t.w FROM learnt_grammar t
+                WHERE grammar.x1=t.x1 AND grammar.x2=t.x2 AND grammar.y=t.y AND grammar.z=t.z
+            """).rowcount, connector.execute("""
+                INSERT INTO grammar (x1, x2, y, z, w) SELECT t.x1, t.x2, t.y, t.z, t.w FROM learnt_grammar t
+                LEFT JOIN grammar g ON g.x1=t.x1 AND g.x2=t.x2 AND g.y=t.y AND g.z=t.z WHERE g.rowid IS NULL
+            """).rowcount]
+
+            connector.execute('COMMIT')
+        except sqlite3.Error:
+            connector.execute('ROLLBACK')
+            raise
+
+    finally:
+        connector.close()
+
+    return {table: {'updated': updated, 'inserted': inserted} for table, (updated, inserted) in report.items()}
+
+
+# the indexes of the corpus.db the loaders' queries (w > level, by word, by lemma) and the merges rely on,
+# the loaders read the tables by weight from the covering ones
+INDEXES = {
+    'dict_word': 'dict(word, role)',
+    'dict_lemma': 'dict(lemma)',
+    'dict_weight': 'dict(weight, word, role, lemma)',
+    'predikt_weight': 'predikt(w, x1, x2, word_id)',
+    'grammar_weight': 'grammar(w, x1, x2, y, z)',
+    'grammar_context': 'grammar(x1, x2, y, z)'
+}
+
+# the version of the corpus.db's schema, stored in its user_version, see migrate
+SCHEMA_VERSION = 1
+
+# the queries run on every start or upvote, and the index they must be answered from
+PLANNED_QUERIES = (
+    ('SELECT * FROM dict ORDER BY weight ASC', (), 'dict_weight'),
+    ('SELECT * FROM grammar WHERE w>?', (5,), 'grammar_weight'),
+    ('SELECT * FROM grammar WHERE w>? AND w<=?', (5, 100), 'grammar_weight'),
+    ('SELECT * FROM predikt WHERE w>? ORDER BY w ASC', (5,), 'predikt_weight'),
+    ('SELECT * FROM predikt WHERE w>? AND w<=? ORDER BY w ASC', (5, 100), 'predikt_weight'),
+    ('UPDATE grammar SET w=? WHERE x1=? AND x2=? AND y=? AND z=?', (1, 0, 0, 0, 0), 'grammar_context'),
+)
+
+
+def create_indexes(connector: sqlite3.Connection, rebuild=False):
+    """
+    creates the missing INDEXES, and rebuilds them all if asked
+    """
+    for name, columns in INDEXES.items():
+        connector.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {columns}')
+        if rebuild:
+            connector.execute(f'REINDEX {name}')
+
+
+def _migrate_indexes(connector: sqlite3.Connection):
+    # the plain weight indexes of the first realignments
+    connector.execute('DROP INDEX IF EXISTS predikt_w')
+    connector.execute('DROP INDEX IF EXISTS grammar_w')
+    create_indexes(connector)
+
+
+# the steps bringing the schema from the version n to n + 1
+MIGRATIONS = (_migrate_indexes,)
+
+
+def migrate(db_path: str) -> int:
+    """
+    brings the corpus.db's schema to SCHEMA_VERSION, the steps needed are run in a single transaction
+    :return: the version found
+    """
+    connector = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        version = connector.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return version
+
+        connector.execute('BEGIN IMMEDIATE')
+        try:
+            # another instance may have migrated it while we waited for the lock
+            version = connector.execute('PRAGMA user_version').fetchone()[0]
+            for step in MIGRATIONS[version:SCHEMA_VERSION]:
+                step(connector)
+            connector.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+            connector.execute('COMMIT')
+        except sqlite3.Error:
+            connector.execute('ROLLBACK')
+            raise
+
+        # the planner's statistics for the new indexes
+        connector.execute('ANALYZE')
+
+    finally:
+        connector.close()
+
+    return version
+
+
+def check_query_plans(db_path: str) -> list:
+    """
+    returns the PLANNED_QUERIES not answered from their index, or needing a temporary b-tree to be sorted,
+    with their EXPLAIN QUERY PLAN
+    """
+    connector = connect(db_path, readonly=True)
+    try:
+        failures = []
+        for query, params, index in PLANNED_QUERIES:
+            plan = [row[-1] for row in connector.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()]
+            if not any(f'INDEX {index}' in detail for detail in plan) or any('TEMP B-TREE' in detail for detail in plan):
+                failures.append((query, plan))
+    finally:
+        connector.close()
+
+    return failures
+
+
+def read_mapping(path: str) -> list:
+    """
+    reads a realignment's mapping file, a line per word : "source destination" merges the source word into
+    the destination one, "source" alone deletes it, the lines starting by # are ignored
+    :return: the (source, destination) pairs, the destination is None for a deletion
+    """
+    mapping = []
+    with open(path, mode='r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if len(fields) == 1:
+                mapping.append((fields[0], None))
+            elif len(fields) == 2:
+                mapping.append((fields[0], fields[1]))
+            elif fields:
+                raise ValueError(f'invalid mapping line "{line.strip()}"')
+
+    return mapping
+
+
+def realign(db_path: str, mapping: list) -> dict:
+    """
+    merges and deletes words of the corpus.db in a single transaction, then rebuilds the INDEXES, vacuums
+    and analyzes it. A source word's row is merged into the destination's heaviest row of the same role,
+    or its heaviest row if the source has a single row matching no role : the weights are summed, the
+    lemmas and predikt's entries pointing to the source now point to the destination, the predikt's
+    entries colliding are summed. The dict rows of a deleted word and their predikt's entries are removed
+    :param mapping: the (source, destination) pairs, see read_mapping
+    :return: the counts of rows changed, the sizes and the time spent by step
+    """
+    report = {'size before': os.path.getsize(db_path)}
+    timings = report['timings'] = {}
+
+    connector = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        s = time.perf_counter()
+        connector.executescript("""
+            CREATE TEMP TABLE realign_map(src TEXT, dst TEXT);
+            CREATE TEMP TABLE moves(sid INTEGER PRIMARY KEY, did INTEGER, word TEXT, weight INTEGER);
+            CREATE TEMP TABLE deletions(id INTEGER PRIMARY KEY, word TEXT);
+            CREATE TEMP TABLE remapped(x1 INTEGER, x2 INTEGER, word_id INTEGER, w INTEGER,
+                                       PRIMARY KEY(x1, x2, word_id));
+        """)
+        connector.execute('BEGIN')
+        connector.executemany('INSERT INTO realign_map VALUES (?, ?)', mapping)
+        connector.execute('COMMIT')
+
+        connector.execute('BEGIN IMMEDIATE')
+        try:
+            # the source rows and their destination, by role then for the single rows by weight
+            connector.execute("""
+                INSERT INTO moves SELECT sid, did, word, weight FROM (
+                    SELECT s.id AS sid, d.id AS did, s.word, s.weight, MAX(d.weight) FROM realign_map m
+                    JOIN dict s ON s.word=m.src
+                    JOIN dict d ON d.word=m.dst AND d.role=s.role AND d.id<>s.id
+                    GROUP BY s.id
+                )
+            """)
+            connector.execute("""
+                INSERT INTO moves SELECT sid, did, word, weight FROM (
+                    SELECT s.id AS sid, d.id AS did, s.word, s.weight, MAX(d.weight) FROM realign_map m
+                    JOIN dict s ON s.word=m.src
+                    JOIN dict d ON d.word=m.dst AND d.id<>s.id
+                    WHERE (SELECT COUNT(*) FROM dict c WHERE c.word=m.src)=1
+                    AND s.id NOT IN (SELECT sid FROM moves)
+                    GROUP BY s.id
+                )
+            """)
+            connector.execute("""
+                INSERT INTO deletions SELECT d.id, d.word FROM realign_map m
+                JOIN dict d ON d.word=m.src WHERE m.dst IS NULL
+            """)
+            # a destination merged or deleted itself is left for a next run
+            connector.execute("""
+                DELETE FROM moves WHERE did IN (SELECT sid FROM moves) OR did IN (SELECT id FROM deletions)
+            """)
+            report['merged'] = connector.execute('SELECT COUNT(*) FROM moves').fetchone()[0]
+            report['unmatched'] = connector.execute("""
+                SELECT COUNT(*) FROM realign_map m JOIN dict s ON s.word=m.src
+                WHERE m.dst IS NOT NULL AND s.id NOT IN (SELECT sid FROM moves)
+            """).fetchone()[0]
+            report['deleted'] = connector.execute('SELECT COUNT(*) FROM deletions').fetchone()[0]
+
+            # dict
+            connector.execute("""
+                UPDATE dict SET weight=dict.weight + t.w
+                FROM (SELECT did, SUM(weight) AS w FROM moves GROUP BY did) t WHERE dict.id=t.did
+            """)
+            connector.execute('UPDATE dict SET lemma=m.did FROM moves m WHERE dict.lemma=m.sid')
+            # the lemmas given as words follow the heaviest source row
+            connector.execute("""
+                UPDATE dict SET lemma=t.did FROM (
+                    SELECT word, did, MAX(weight) FROM moves GROUP BY word
+                ) t WHERE dict.lemma=t.word
+            """)
+            connector.execute('UPDATE dict SET lemma=d.word FROM deletions d WHERE dict.lemma=d.id')
+
+            # predikt, the entries of a deleted word are dropped even if they point to a merged one
+            connector.execute("""
+                INSERT INTO remapped
+                SELECT COALESCE(a.did, p.x1), COALESCE(b.did, p.x2), COALESCE(c.did, p.word_id), SUM(p.w)
+                FROM predikt p
+                LEFT JOIN moves a ON a.sid=p.x1 LEFT JOIN moves b ON b.sid=p.x2 LEFT JOIN moves c ON c.sid=p.word_id
+                WHERE (a.sid IS NOT NULL OR b.sid IS NOT NULL OR c.sid IS NOT NULL)
+                AND p.x1 NOT IN (SELECT id FROM deletions) AND p.x2 NOT IN (SELECT id FROM deletions)
+                AND p.word_id NOT IN (SELECT id FROM deletions)
+                GROUP BY 1, 2, 3
+            """)
+            report['predikt deleted'] = connector.execute("""
+                DELETE FROM predikt WHERE x1 IN (SELECT sid FROM moves UNION ALL SELECT id FROM deletions)
+                OR x2 IN (SELECT sid FROM moves UNION ALL SELECT id FROM deletions)
+                OR word_id IN (SELECT sid FROM moves UNION ALL SELECT id FROM deletions)
+            """).rowcount
+            report['predikt merged'] = connector.execute("""
+                UPDATE predikt SET w=predikt.w + r.w FROM remapped r
+                WHERE predikt.x1=r.x1 AND predikt.x2=r.x2 AND predikt.word_id=r.word_id
+            """).rowcount
+            report['predikt moved'] = connector.execute("""
+                INSERT INTO predikt (x1, x2, word_id, w) SELECT r.x1, r.x2, r.word_id, r.w FROM remapped r
+                LEFT JOIN predikt p ON p.x1=r.x1 AND p.x2=r.x2 AND p.word_id=r.word_id WHERE p.rowid IS NULL
+            """).rowcount
+
+            connector.execute('DELETE FROM dict WHERE id IN (SELECT sid FROM moves UNION ALL SELECT id FROM deletions)')
+
+            connector.execute('COMMIT')
+        except sqlite3.Error:
+            connector.execute('ROLLBACK')
+            raise
+        timings['realign'] = time.perf_counter() - s
+
+        # the pages freed by the realignment, the new indexes reuse them before the vacuum
+        report['reclaimed'] = connector.execute('PRAGMA freelist_count').fetchone()[0] * \
+            connector.execute('PRAGMA page_size').fetchone()[0]
+
+        s = time.perf_counter()
+        create_indexes(connector, rebuild=True)
+        timings['indexes'] = time.perf_counter() - s
+
+        s = time.perf_counter()
+        connector.execute('VACUUM')
+        connector.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        timings['vacuum'] = time.perf_counter() - s
+
+        s = time.perf_counter()
+        connector.execute('ANALYZE')
+        timings['analyze'] = time.perf_counter() - s
+
+    finally:
+        connector.close()
+
+    report['size after'] = os.path.getsize(db_path)
+    return report
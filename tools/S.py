@@ -10,15 +10,23 @@ import tempfile
 import os
 import re
 import math
+import pickle
+import time
 from functools import partial
+from concurrent.futures.process import BrokenProcessPool
 from html.parser import HTMLParser
 import numpy as np
 
 from PyQt6.QtWidgets import QApplication, QStyleFactory
 from PyQt6.QtGui import QPalette, QColor
-from PyQt6.QtCore import Qt, pyqtSignal, QObject, QThreadPool, QRunnable, QDir, QThread, QSemaphore, QMutex
+from PyQt6.QtCore import Qt, pyqtSignal, QObject, QThreadPool, QRunnable, QDir, QThread, QMutex, QTimer
 
 from tools import G, T, Audio
+from tools.Cache import LRUCache
+from tools.Corpus import Word, SparseGrammar, QuantizedGrammar, PrediktIndex, Snapshot, UpvoteJournal, TokenStream, \
+    Vocabulary, Candidate, ProcessAnalyzer, IndexCache, CorpusLearner, analyze_tokens, blocks_infos, expand_solutions, \
+    digest_words, digest_ancestors, digest_predikt, predikt_entries, document_blocks, merge_counts, migrate, connect, \
+    enable_wal, weight_tiers, tier_clause, renote, SCHEMA_VERSION
 from tools.translitteration import translitterate
 
 QDir.addSearchPath('icons', G.rsc_path('images/icons'))
@@ -466,27 +474,54 @@ class GlobalSettings(_Settings):
     class Corpus(QRunnable):
         name = 'Corpus'
         db_path = G.appdata_path(r"corpus.db")
+        snapshot_path = G.appdata_path(r"corpus.snapshot")
+        journal_path = G.appdata_path(r"corpus.journal")
+        indexes_path = G.appdata_path(r"corpus.indexes")
         grammar_loaded = False
         predikt_loaded = False
 
         size = 0
         level = 5
+        cache_size = 50000
+        # words of a vocabulary's generation, the words typed are encoded on every highlight
+        vocabulary_size = 20000
+        # the weights separating the tiers loaded, the heaviest rows are loaded first and usable meanwhile
+        tiers = (1000, 100)
+        # delay before the upvotes are written to the corpus.db (ms)
+        flush_delay = 5000
+        # bits of the log-scaled codes storing the grammar's weights in memory (8 or 16), 0 keeps the full weights.
+        # Not a setting, for the benchmarks only : it's read once when the grammar is allocated, the accuracy and
+        # memory it trades are measured by the quantize command of .core-rsc/corpus_benchmark.py
+        quantized = 0
+
+        class Solution(Candidate):
+            __slots__ = ('_id', '_lemma')
 
-        class Solution:
             def __init__(self, word='', score=.0, role=0, pos=0, x1=0, x2=0, z=0):
-                self.word = word
-                self.score = score
-                self.role = role
-                self.position = pos
-                self.x1 = x1
-                self.x2 = x2
-                self.z = z
+                super().__init__(word, score, role, pos, x1, x2, z)
+
+                # resolved on first access, most of the solutions are never asked for
+                self._id = None
+                self._lemma = ''
 
+            def _resolve(self):
                 try:
-                    self.id = GLOBAL.CORPUS.words_id[word][GLOBAL.CORPUS.roles[word].index(role)]
-                    self.lemma = GLOBAL.CORPUS.words[self.id][2]
+                    self._id = GLOBAL.CORPUS.words_id[self.word][GLOBAL.CORPUS.roles[self.word].index(self.role)]
+                    self._lemma = GLOBAL.CORPUS.words[self._id][2]
                 except (ValueError, KeyError):
-                    self.id, self.lemma = 0, ''
+                    self._id, self._lemma = 0, ''
+
+            @property
+            def id(self):
+                if self._id is None:
+                    self._resolve()
+                return self._id
+
+            @property
+            def lemma(self):
+                if self._id is None:
+                    self._resolve()
+                return self._lemma
 
             def __repr__(self):
                 ret = f'{self.word} ({GLOBAL.CORPUS.renote(self.score * 100)}) [{self.position}] :: '
@@ -521,51 +556,14 @@ class GlobalSettings(_Settings):
                 else:
                     return 0
 
-        class Word:
-            def __init__(self, word, ancestors=('', ''), tag='', _weight=1):
-                self.word = str(word)
-                self.tag = tag
-                self._ancestors = []
-                self.tail = ''
-
-                self.weight = _weight
-
-                self.first_ancestor = ''
-                self.last_ancestor = ''
-
-                self.ancestors = list(ancestors)
-
-            @property
-            def ancestors(self):
-                return self._ancestors
-
-            @ancestors.setter
-            def ancestors(self, value: [str]):
-                self._ancestors = value
-                self.first_ancestor, self.last_ancestor = value
-                self.tail = ' '.join(value)
-
-            def __repr__(self):
-                res = f'"{self.word}" ({self.weight}) [{", ".join(map(str, self.ancestors))}]'
-                res += f' #{hash(self)}'
-
-                return res
-
-            def __hash__(self):
-                return hash(' '.join(self.ancestors) + self.word)
-
-            def __eq__(self, other):
-                if isinstance(other, GlobalSettings.Corpus.Word):
-                    return (' '.join(self.ancestors) + self.word) == (' '.join(other.ancestors) + other.word)
-
-                return False
+        Word = Word
 
         class Analyze(QRunnable):
             name = 'Analyze'
 
-            def __init__(self, iterator, root, callback):
+            def __init__(self, stream, root, callback):
                 self.root = root
-                self.iterator = iterator
+                self.stream = stream
 
                 self.cb = callback
 
@@ -580,155 +578,165 @@ class GlobalSettings(_Settings):
                     self.done(self.name)
                     return
 
+                self.cb(self.analyze(self.stream))
+                self.done(self.name)
+
+            def analyze(self, stream: TokenStream) -> dict:
+                """
+                scores every token of the stream
+                :param stream: the encoded tokens, see Corpus.encode
+                :return: the best solution for every token, by its key
+                """
+                return analyze_tokens(
+                    self.root.grammar,
+                    stream.keys(),
+                    self.root.vocabulary.infos,
+                    self.root.vocabulary.words,
+                    self.root.predict_ancestors,
+                    factory=self.root.Solution
+                )
+
+        class AnalyzeBlocks(Analyze):
+            name = 'AnalyzeBlocks'
+
+            def __init__(self, blocks: dict, root, callback):
+                """
+                analyze each block on its own, the way the highlighter tokenizes them
+                :param blocks: the text of the blocks to analyze, by block's number
+                :param callback: receives the solutions and the analyzed blocks
+                """
+                self.blocks = blocks
+
+                super().__init__(None, root, callback)
+
+            def run(self):
+                if not GLOBAL.check_grammar or not GLOBAL.CORPUS.grammar_loaded:
+                    self.done(self.name)
+                    return
+
+                streams = [self.root.encode(text) for text in self.blocks.values()]
+
+                records = None
+                if GLOBAL.grammar_processes:
+                    records = self.root.analyze_processes(streams)
+                if records is None:
+                    records = [self.analyze(stream) for stream in streams]
+
                 recorded = {}
-                solutions = {}
-                previous_word = None
-                i = 0
-                for pos, a2, word, n in self.iterator:
-                    try:
-                        recorded[(previous_word, a2, word, n)]
-                        continue
-                    except KeyError:
-                        pass
+                for record in records:
+                    recorded.update(record)
+
+                self.cb(recorded, self.blocks)
+                self.done(self.name)
+
+        class Learn(QRunnable):
+            name = 'CorpusLearn'
+
+            # blocks sent to the workers by task
+            batch = 200
+
+            def __init__(self, paths: list, root):
+                """
+                teaches the corpus.db the words, predikt's entries and grammar's contexts of the documents, the
+                counts are made by a CorpusLearner and merged at once, see merge_counts
+                :param paths: .786 books and text files, only the lines without spelling mistakes of the text
+                files are learnt
+                """
+                self.paths = paths
+                self.root = root
+
+                super().__init__()
+
+            def tokenize(self, block: str) -> list:
+                # the block as the highlighter reads it
+                text = block.replace(chr(T.TEXT.para_char), '').replace(chr(T.TEXT.audio_char), '')
+                if len(text):
+                    text = text[0].lower() + text[1:]
+
+                return list(T.Regex.tokenize(text))
+
+            def run(self):
+                root = self.root
+                s = time.perf_counter()
+                learner = None
+                try:
+                    # the workers read the grammar from a snapshot of the current corpus.db
+                    root.journal.flush(root.db_path)
+                    if not root.snapshot.valid(root.db_path, root.level):
+                        root.snapshot.write(root.db_path, root.level)
+
+                    learner = CorpusLearner(
+                        root.snapshot_path,
+                        root.roles,
+                        root.words_id,
+                        root.predict_ancestors,
+                        root.grammar_changes.copy()
+                    )
+
+                    for n, path in enumerate(self.paths):
+                        GLOBAL.step.emit(int(n / len(self.paths) * 80), f'Learning "{os.path.basename(path)}"')
+
+                        blocks = document_blocks(path)
+                        if os.path.splitext(path)[-1] == '.txt':
+                            blocks = [block for block in blocks if T.SPELL.block_check(block)]
+
+                        for i in range(0, len(blocks), self.batch):
+                            tokens = [self.tokenize(block) for block in blocks[i:i + self.batch]]
+                            skipped = {word for block in tokens for _, _, word, _ in block if root.vocabulary.skip(word)}
+                            learner.feed(tokens, skipped)
+
+                    GLOBAL.step.emit(85, 'Merging into the corpus')
+                    counted = time.perf_counter() - s
+                    report = merge_counts(root.db_path, *learner.finish())
+
+                except (OSError, sqlite3.Error, BrokenProcessPool) as e:
+                    G.exception(e)
+                    GLOBAL.step.emit(100, 'Learning failed')
+
+                else:
+                    elapsed = time.perf_counter() - s
+                    rate = learner.tokens / max(counted, 1e-9)
+                    G.logger.info(f'{self.name} : {learner.tokens} words in {elapsed:.1f}s ({rate:.0f} words/s), '
+                                  f'merged in {elapsed - counted:.1f}s : {report}')
+                    GLOBAL.step.emit(100, f'{learner.tokens} words learnt ({rate:.0f} words/s), '
+                                          f'available from the next start')
+
+                finally:
+                    if learner is not None:
+                        learner.close()
 
-                    if not a2 and previous_word:
-                        previous_word = None
-
-                    if (T.Regex.is_title(word) and word not in self.root.words_id) or T.Regex.is_digit(word):
-                        continue
-
-                    y, word_ids = self.root.get_word_infos(word)
-                    x1, w1 = self.root.get_word_infos(previous_word)
-                    x2o, w2o = x2, w2 = self.root.get_word_infos(a2)
-                    if i > 0:
-                        try:
-                            x2, w2 = zip(*filter(lambda a: a[0] in [s.role for s in solutions[i - 1]],
-                                                 zip(x2, w2)))
-                        except ValueError:
-                            pass
-
-                    z, wz = self.root.get_word_infos(n)
-
-                    solutions[i] = [self.root.Solution(word, pos=i, role=y[-1])]
-                    fail = True
-
-                    for a in x1:
-                        for b in x2:
-
-                            for d in z:
-                                best_suggestion_idx = np.argsort(self.root.grammar[a, b, :, d])[::-1][0]
-                                best_suggestion_score = self.root.grammar[a, b, best_suggestion_idx, d]
-                                best_current_score = 0
-
-                                for c in y:
-                                    best_current_score = max(self.root.grammar[a, b, c, d], best_current_score)
-                                    if self.root.grammar[a, b, c, d]:
-                                        if best_suggestion_score:
-                                            note = self.log_compare(self.root.grammar[a, b, c, d], best_suggestion_score)
-                                            if note > solutions[i][-1].score:
-                                                solutions[i].append(self.root.Solution(
-                                                    word, score=note, role=c,
-                                                    pos=i, x1=a, x2=b, z=d
-                                                ))
-                                            if note == 1:
-                                                fail = False
-                                    else:
-                                        fail = True
-
-                    progress_factor = 1.5
-                    degress_factor = 0.95
-                    if fail:
-                        # print(f'{word} : FALLBACK...')
-                        for d in z:
-                            for b in x2o:
-                                for c in y:
-                                    u, j = np.amax(self.root.grammar[:, b, c, d]), np.amax(self.root.grammar[:, b, :, d], axis=(0, 1))
-                                    if j:
-                                        if u:
-                                            res = self.log_compare(u, j)
-                                            if res > solutions[i][-1].score:
-                                                solutions[i].append(self.root.Solution(
-                                                    word, score=res, role=c,
-                                                    pos=i, x1=np.argmax(self.root.grammar[:, b, c, d]), x2=b, z=d
-                                                ))
-                        for sc in word_ids:
-                            for sb in w2o:
-                                if (sb, sc) in self.root.predict_ancestors:
-                                    # print('found', word)
-                                    solutions[i][-1].score = min(solutions[i][-1].score * progress_factor, 1)
-                                elif sb in w2:
-                                    solutions[i][-1].score *= degress_factor
-                                    break
-                            else:
-                                continue
-                            break
-
-                    if i > 0:
-                        solutions[i][-1].x2 = solutions[i - 1][-1]
-                        solutions[i - 1][-1].z = solutions[i][-1]
-                        if i > 1:
-                            solutions[i][-1].x1 = solutions[i - 2][-1]
-
-                    bests = [t for t in sorted(solutions[i], key=lambda x: x.score, reverse=True)]
-                    recorded[(previous_word, a2, word, n)] = bests[0]
-                    previous_word = a2
-
-                    i += 1
-
-                self.cb(recorded)
                 self.done(self.name)
 
         class Loader:
+            """
+            The SQLite loaders read their table concurrently through read-only connections, the predikt
+            table is read once and digested by the Corpus once the words are known
+            """
             class Words(QRunnable):
                 name = 'CorpusLoaderWords'
 
-                def __init__(self, semaphore, db_path, callback):
-                    self.semaphore = semaphore
+                def __init__(self, db_path, callback):
                     self.db_path = db_path
                     self.cb = callback
 
                     super().__init__()
 
                 def run(self):
-                    self.semaphore.acquire()
-                    connector = sqlite3.connect(self.db_path)
-                    cursor = connector.cursor()
-
-                    data = cursor.execute(f'SELECT * FROM dict ORDER BY weight ASC').fetchall()
-                    predikt_data = cursor.execute(f'SELECT * FROM predikt WHERE w>{GlobalSettings.Corpus.level} ORDER BY w ASC').fetchall()
+                    s = time.perf_counter()
+                    connector = connect(self.db_path, readonly=True)
+                    data = connector.execute('SELECT * FROM dict ORDER BY weight ASC').fetchall()
                     connector.close()
-                    self.semaphore.release()
-
-                    words = {'': (0, 0, '', 0)}
-                    lemmas = {}
-                    roles = {}
-                    words_id = {}
-
-                    words.update({word_id: (word, role, lemma, weight) for word_id, word, role, lemma, weight in data})
-                    for word_id, word, role, lemma, weight in data:
-                        try:
-                            new_lemma = word if lemma in ('', 0) else (lemma if isinstance(lemma, str) else words[lemma][0])
-                            lemmas[new_lemma][role] = word_id
-                        except KeyError:
-                            lemmas[new_lemma] = {role: word_id}
-
-                        try:
-                            roles[word].append(role)
-                            words_id[word].append(word_id)
-                        except KeyError:
-                            roles[word] = [role]
-                            words_id[word] = [word_id]
-
-                    self.cb(predikt_data, words, lemmas, roles, words_id,
-                            {word_id: word for word_id, word, role, lemma, weight in data})
+                    read = time.perf_counter() - s
+
+                    self.cb(*digest_words(data))
+                    G.logger.info(f'{self.name} : read {read:.3f}s, digest {time.perf_counter() - s - read:.3f}s')
 
                     self.done(self.name)
 
             class Grammar(QRunnable):
                 name = 'CorpusLoaderGrammar'
 
-                def __init__(self, semaphore, db_path, grammar, callback):
-                    self.semaphore = semaphore
+                def __init__(self, db_path, grammar, callback):
                     self.db_path = db_path
                     self.grammar = grammar
                     self.cb = callback
@@ -736,47 +744,156 @@ class GlobalSettings(_Settings):
                     super().__init__()
 
                 def run(self):
-                    self.semaphore.acquire()
-                    connector = sqlite3.connect(self.db_path)
-                    cursor = connector.cursor()
+                    # every tier is loaded in a copy of the previous one, which is still in use meanwhile
+                    grammar = self.grammar
+                    for n, tier in enumerate(weight_tiers(GlobalSettings.Corpus.level, GlobalSettings.Corpus.tiers)):
+                        s = time.perf_counter()
+                        clause, params = tier_clause(tier)
+                        connector = connect(self.db_path, readonly=True)
+                        data = connector.execute(f'SELECT * FROM grammar WHERE {clause}', params).fetchall()
+                        connector.close()
+                        read = time.perf_counter() - s
+
+                        grammar = grammar.copy() if n else grammar
+                        grammar.load(data)
+                        self.cb(grammar)
+                        G.logger.info(f'{self.name} #{n} : read {read:.3f}s, load {time.perf_counter() - s - read:.3f}s')
 
-                    data = cursor.execute(f'SELECT * FROM grammar WHERE w>{GlobalSettings.Corpus.level}').fetchall()
-                    connector.close()
-                    self.semaphore.release()
+                    self.done(self.name)
+
+            class PrediktTable(QRunnable):
+                name = 'CorpusLoaderPrediktTable'
+
+                def __init__(self, db_path, callback):
+                    self.db_path = db_path
+                    self.cb = callback
+
+                    super().__init__()
+
+                def run(self):
+                    data = []
+                    for n, tier in enumerate(weight_tiers(GlobalSettings.Corpus.level, GlobalSettings.Corpus.tiers)):
+                        s = time.perf_counter()
+                        clause, params = tier_clause(tier)
+                        connector = connect(self.db_path, readonly=True)
+                        # the lighter tier goes before the rows already loaded to keep them ordered by weight
+                        data = connector.execute(f'SELECT * FROM predikt WHERE {clause} ORDER BY w ASC',
+                                                 params).fetchall() + data
+                        connector.close()
+                        read = time.perf_counter() - s
+
+                        self.cb(data)
+                        G.logger.info(f'{self.name} #{n} : read {read:.3f}s, digest {time.perf_counter() - s - read:.3f}s')
+
+                    self.done(self.name)
+
+            class Snapshot(QRunnable):
+                name = 'CorpusLoaderSnapshot'
+
+                def __init__(self, snapshot, grammar, grammar_callback, predikt_callback=None, words_callback=None):
+                    """
+                    without the predikt and words callbacks only the grammar is read
+                    """
+                    self.snapshot = snapshot
+                    self.grammar = grammar
+                    self.grammar_cb = grammar_callback
+                    self.predikt_cb = predikt_callback
+                    self.words_cb = words_callback
 
-                    for x1, x2, y, z, w in data:
-                        self.grammar[x1, x2, y, z] = w
+                    super().__init__()
+
+                def run(self):
+                    s = time.perf_counter()
+                    # the grammar's pages are shared by every instance until they're changed by an upvote
+                    if self.words_cb is None:
+                        data = {'grammar': self.snapshot.load_grammar(mmap_mode='c')}
+                    else:
+                        data = self.snapshot.load(mmap_mode='c')
+                    read = time.perf_counter() - s
+
+                    self.grammar.restore(**data['grammar'])
+                    self.grammar_cb(self.grammar)
+                    if self.words_cb is not None:
+                        self.predikt_cb(data['predikt'])
+                        self.words_cb(*digest_words(data['dict']))
+                    G.logger.info(f'{self.name} : read {read:.3f}s, digest {time.perf_counter() - s - read:.3f}s')
 
                     self.done(self.name)
 
-            class PrediktAncestor(QRunnable):
-                name = 'CorpusLoaderPrediktAncestor'
+            class Indexes(QRunnable):
+                name = 'CorpusLoaderIndexes'
 
-                def __init__(self, semaphore, db_path, callback):
-                    self.semaphore = semaphore
+                def __init__(self, cache, db_path, callback):
+                    self.cache = cache
                     self.db_path = db_path
                     self.cb = callback
 
                     super().__init__()
 
                 def run(self):
-                    self.semaphore.acquire()
-                    connector = sqlite3.connect(self.db_path)
-                    cursor = connector.cursor()
+                    s = time.perf_counter()
+                    try:
+                        indexes = self.cache.load(self.db_path)
+                    except (OSError, pickle.UnpicklingError, EOFError, KeyError) as e:
+                        G.exception(e)
+                        indexes = None
 
-                    data = cursor.execute(f'SELECT * FROM predikt WHERE w>{GlobalSettings.Corpus.level} ORDER BY w ASC').fetchall()
-                    connector.close()
-                    self.semaphore.release()
+                    self.cb(indexes)
+                    G.logger.info(f'{self.name} : {time.perf_counter() - s:.3f}s')
+
+                    self.done(self.name)
+
+            class IndexesWriter(QRunnable):
+                name = 'CorpusIndexesWriter'
+
+                def __init__(self, cache, db_path):
+                    self.cache = cache
+                    self.db_path = db_path
+
+                    super().__init__()
+
+                def run(self):
+                    try:
+                        self.cache.write(self.db_path, GlobalSettings.Corpus.level)
+                    except (OSError, sqlite3.Error, pickle.PicklingError) as e:
+                        G.exception(e)
+
+                    self.done(self.name)
+
+            class JournalFlush(QRunnable):
+                name = 'CorpusJournalFlush'
+
+                def __init__(self, journal, db_path):
+                    self.journal = journal
+                    self.db_path = db_path
+
+                    super().__init__()
+
+                def run(self):
+                    try:
+                        self.journal.flush(self.db_path)
+                    except (OSError, sqlite3.Error) as e:
+                        G.exception(e)
+
+                    self.done(self.name)
+
+            class SnapshotWriter(QRunnable):
+                name = 'CorpusSnapshotWriter'
+
+                def __init__(self, snapshot, db_path, callback):
+                    self.snapshot = snapshot
+                    self.db_path = db_path
+                    self.cb = callback
 
-                    res = {}
+                    super().__init__()
 
-                    for x1, x2, word_id, w in data:
-                        try:
-                            res[(x1, x2)].append(word_id)
-                        except KeyError:
-                            res[(x1, x2)] = [word_id]
+                def run(self):
+                    try:
+                        self.snapshot.write(self.db_path, GlobalSettings.Corpus.level)
+                        self.cb()
+                    except (OSError, sqlite3.Error) as e:
+                        G.exception(e)
 
-                    self.cb(res)
                     self.done(self.name)
 
             class Predikt(QRunnable):
@@ -790,40 +907,7 @@ class GlobalSettings(_Settings):
                     super().__init__()
 
                 def run(self):
-                    words_tail_last_word = {}
-                    wide_range = {}
-
-                    for x1, x2, word_id, w in self.predikt_data:
-                        try:
-                            w1, w2, y = self.words[x1][0], self.words[x2][0], self.words[word_id][0]
-                            word = GlobalSettings.Corpus.Word(y, ancestors=[w1, w2], _weight=w)
-                        except KeyError:
-                            continue
-
-                        try:
-                            if word.last_ancestor in words_tail_last_word:
-                                words_tail_last_word[word.last_ancestor].append(word)
-                            else:
-                                words_tail_last_word[word.last_ancestor] = [word]
-
-                        except IndexError:
-                            # no ancestor
-                            pass
-
-                        try:
-                            if len(word.word) <= 2:
-                                raise IndexError
-
-                            for chr in range(1, len(word.word)):
-                                if word.word[:chr] in wide_range:
-                                    wide_range[word.word[:chr]].append(word)
-                                else:
-                                    wide_range[word.word[:chr]] = [word]
-
-                        except IndexError:
-                            pass
-
-                    self.cb(words_tail_last_word, wide_range)
+                    self.cb(PrediktIndex(predikt_entries(self.predikt_data, self.words)))
                     self.done(self.name)
 
         def __init__(self):
@@ -834,6 +918,13 @@ class GlobalSettings(_Settings):
 
             self.unique_words = {}
 
+            try:
+                s = time.perf_counter()
+                if migrate(self.db_path) < SCHEMA_VERSION:
+                    G.logger.info(f'{self.name} : schema migrated to v{SCHEMA_VERSION} in {time.perf_counter() - s:.3f}s')
+            except sqlite3.Error as e:
+                G.exception(e)
+
             con = sqlite3.connect(self.db_path)
             cur = con.cursor()
 
@@ -842,128 +933,333 @@ class GlobalSettings(_Settings):
 
             con.close()
 
-            self.grammar = np.zeros(shape=(self.size, self.size, self.size, self.size), dtype=np.int32)
+            if self.quantized:
+                self.grammar = QuantizedGrammar(self.size, bits=self.quantized)
+            else:
+                self.grammar = SparseGrammar(self.size)
 
             self.predict_ancestors = {}
             self.predict_after = {}
             self.predict_roles = {}
 
-            self.predikt_words_tail = {}
-            self.predikt_wide = {}
+            self.predikt = PrediktIndex()
+            # the predikt rows waiting for the words to be loaded
+            self.predikt_data = None
+            # count of predikt tiers read, and the tier of the current index
+            self.predikt_tiers = 0
+            self.predikt_tier = 0
+
+            # the loaders' phases done
+            self.loaded = set()
+            self.loaders_mutex = QMutex()
+
+            self.recorded = LRUCache(self.cache_size)
+            self.vocabulary = Vocabulary(
+                self.roles,
+                self.words_id,
+                lambda word: (T.Regex.is_title(word) and word not in self.words_id) or T.Regex.is_digit(word),
+                limit=self.vocabulary_size,
+                forget=self.forget_tokens
+            )
+            self.snapshot = Snapshot(self.snapshot_path)
+            self.journal = UpvoteJournal(self.journal_path)
+            self.indexes = IndexCache(self.indexes_path)
 
-            self.recorded = {}
+            # the process backend needs a snapshot matching the loaded grammar, and the cells changed since
+            self.snapshot_ready = False
+            self.grammar_changes = {}
+            self.analyzer = None
+            self.analyzer_mutex = QMutex()
 
             super().__init__()
             self.setAutoDelete(False)
 
-        def get_words_data(self, predikt_data, words, lemmas, roles, words_id, unique_words):
+        def get_words_data(self, words, lemmas, roles, words_id, unique_words):
             self.words.update(words)
             self.lemmas.update(lemmas)
             self.roles.update(roles)
             self.words_id.update(words_id)
             self.unique_words.update(unique_words)
+            self.vocabulary.reset()
 
-            self.predict_roles.update({
-                (x1, x2, self.words[word_id][1]): word_id
-                for x1, x2, word_id, w in predikt_data
-            })
+            self.join_loaders('words')
 
-            for x1, x2, word_id, w in predikt_data:
-                try:
-                    self.predict_after[(x1, self.words[word_id][1])].append(x2)
-                except KeyError:
-                    self.predict_after[(x1, self.words[word_id][1])] = [x2]
-
-            POOL.start(
-                self.Loader.Predikt(
-                    predikt_data[::-1],
-                    words,
-                    self.get_predikt_data
-                ),
-                priority=5
-            )
+        def get_grammar_data(self, grammar):
+            # the snapshot is mapped in full precision
+            if self.quantized and not isinstance(grammar, QuantizedGrammar):
+                grammar = QuantizedGrammar.quantize(grammar, self.quantized)
+
+            # the upvotes given since the start, the tier may have been read before some of them
+            if grammar is not self.grammar:
+                for (x1, x2, y, z), w in self.grammar_changes.copy().items():
+                    grammar[x1, x2, y, z] = w
 
+            loaded = self.grammar_loaded
+            self.grammar = grammar
             self.recorded.clear()
-            self.grammar_loaded = True
 
-        def get_grammar_data(self, data):
-            self.grammar = data
+            self.join_loaders('grammar')
+
+            # the solutions of the page were scored by the former tier
+            if loaded:
+                GLOBAL.grammarChanged.emit()
+
+        def get_indexes_data(self, indexes):
+            # the cache couldn't be read or is stale, the tables are digested instead
+            if indexes is None:
+                POOL.start(self.Loader.Words(self.db_path, self.get_words_data), priority=5)
+                POOL.start(self.Loader.PrediktTable(self.db_path, self.get_predikt_table), priority=5)
+                POOL.start(self.Loader.IndexesWriter(self.indexes, self.db_path))
+                return
+
+            self.predict_roles = indexes['predict_roles']
+            self.predict_after = indexes['predict_after']
+            self.predict_ancestors = indexes['predict_ancestors']
+            self.get_predikt_data(indexes['predikt'], tier=1)
+
+            self.get_words_data(
+                indexes['words'],
+                indexes['lemmas'],
+                indexes['roles'],
+                indexes['words_id'],
+                indexes['unique_words']
+            )
+
+        def get_predikt_table(self, predikt_data):
+            self.predikt_data = predikt_data
+
+            self.join_loaders('predikt_table')
 
-        def get_predikt_ancestors_data(self, data):
-            self.predict_ancestors.update(data)
+        def join_loaders(self, phase: str):
+            """
+            marks the phase as loaded and runs the steps needing several tables once they're all loaded,
+            called from the loaders' threads, every tier loaded replaces the structures built from the former
+            """
+            self.loaders_mutex.lock()
+            try:
+                self.loaded.add(phase)
 
-        def get_predikt_data(self, words_tail, wide_range):
-            self.predikt_words_tail.update(words_tail)
-            self.predikt_wide.update(wide_range)
+                if 'words' in self.loaded and self.predikt_data is not None:
+                    predikt_data, self.predikt_data = self.predikt_data, None
+
+                    predict_roles, predict_after = digest_predikt(predikt_data, self.words)
+
+                    self.predict_ancestors = digest_ancestors(predikt_data)
+                    self.predict_roles, self.predict_after = predict_roles, predict_after
+
+                    self.predikt_tiers += 1
+                    POOL.start(
+                        self.Loader.Predikt(
+                            predikt_data,
+                            self.words,
+                            partial(self.get_predikt_data, tier=self.predikt_tiers)
+                        ),
+                        priority=5
+                    )
+
+                if {'words', 'grammar'} <= self.loaded and not self.grammar_loaded:
+                    self.recorded.clear()
+                    self.grammar_loaded = True
+                    GLOBAL.grammarChanged.emit()
+
+            finally:
+                self.loaders_mutex.unlock()
+
+        def get_predikt_data(self, index, tier=0):
+            self.loaders_mutex.lock()
+            try:
+                # the index of a lighter tier may be built before the former one
+                if tier < self.predikt_tier:
+                    return
+                self.predikt_tier = tier
+                self.predikt = index
+            finally:
+                self.loaders_mutex.unlock()
 
             self.predikt_loaded = True
 
         def init(self):
-            semaphore = QSemaphore(1)
-
-            POOL.start(
-                self.Loader.Words(
-                    semaphore,
-                    self.db_path,
-                    self.get_words_data
-                ),
-                priority=5
-            )
+            # the upvotes of an instance which didn't close properly
+            try:
+                self.journal.replay(self.db_path)
+            except (OSError, sqlite3.Error) as e:
+                G.exception(e)
+
+            # the indexes derived from the dict and predikt tables are only rebuilt when they're stale, the loader
+            # falls back on the tables if the content of the corpus.db turns out changed
+            indexed = self.indexes.valid(self.db_path, self.level)
+            if indexed:
+                POOL.start(self.Loader.Indexes(self.indexes, self.db_path, self.get_indexes_data), priority=5)
+
+            if self.snapshot.valid(self.db_path, self.level):
+                self.snapshot_ready = True
+                if indexed:
+                    POOL.start(self.Loader.Snapshot(self.snapshot, self.grammar, self.get_grammar_data), priority=5)
+                    return
 
-            POOL.start(
-                self.Loader.Grammar(
-                    semaphore,
-                    self.db_path,
-                    self.grammar,
-                    self.get_grammar_data
-                ),
-                priority=5
-            )
+                POOL.start(
+                    self.Loader.Snapshot(
+                        self.snapshot,
+                        self.grammar,
+                        self.get_grammar_data,
+                        self.get_predikt_table,
+                        self.get_words_data
+                    ),
+                    priority=5
+                )
+                POOL.start(self.Loader.IndexesWriter(self.indexes, self.db_path))
+                return
 
-            POOL.start(
-                self.Loader.PrediktAncestor(
-                    semaphore,
-                    self.db_path,
-                    self.get_predikt_ancestors_data
-                ),
-                priority=5
-            )
+            # the readers don't wait for each other
+            try:
+                enable_wal(self.db_path)
+            except sqlite3.Error as e:
+                G.exception(e)
+
+            POOL.start(self.Loader.Grammar(self.db_path, self.grammar, self.get_grammar_data), priority=5)
+            if not indexed:
+                POOL.start(self.Loader.Words(self.db_path, self.get_words_data), priority=5)
+                POOL.start(self.Loader.PrediktTable(self.db_path, self.get_predikt_table), priority=5)
+                POOL.start(self.Loader.IndexesWriter(self.indexes, self.db_path))
+
+            # the next start will read the snapshot instead
+            POOL.start(self.Loader.SnapshotWriter(self.snapshot, self.db_path, self.get_snapshot_written))
+
+        def get_snapshot_written(self):
+            self.snapshot_ready = True
 
         def get_word_infos(self, word):
-            try:
-                x = self.roles[word]
-                w = self.words_id[word]
-            except KeyError:
-                x, w = [0], [0]
-            return x, w
+            roles, words_id, _ = self.vocabulary.infos(self.vocabulary.encode(word))
+            return roles, words_id
 
         def get_solutions(self, record):
             self.recorded.update(record)
 
-        def get_solution(self, a1, a2, word, n) -> Solution:
+        def encode(self, text: str) -> TokenStream:
+            return TokenStream.encode(self.vocabulary, T.Regex.tokenize(text))
+
+        def analyzed(self, text: str) -> bool:
+            """
+            whether the solutions of every token scored in the text are recorded, the text is analyzed again
+            once one of them is evicted or outdated
+            """
+            return all(key in self.recorded for key in self.encode(text).keys() if not self.vocabulary.infos(key[2])[2])
+
+        def forget_tokens(self, tokens: set):
+            """
+            drops the solutions keyed by the tokens the vocabulary forgot, their blocks will be analyzed again
+            """
+            self.recorded.invalidate(lambda key: not tokens.isdisjoint(key))
+
+        def get_solution(self, key: tuple) -> Solution:
+            """
+            :param key: a token of a TokenStream
+            """
             try:
                 assert GLOBAL.check_grammar
-                return self.recorded[(a1, a2, word, n)]
+                return self.recorded[key]
             except (KeyError, AssertionError):
                 pass
 
+        def context_weights(self, x1, x2, z) -> dict:
+            """
+            the exact weights {y: w} of the context, as the corpus.db and the upvotes since the start hold them,
+            the quantized grammar only holds approximations
+            """
+            connector = connect(self.db_path, readonly=True)
+            try:
+                weights = dict(connector.execute(
+                    'SELECT y, w FROM grammar WHERE x1=? AND x2=? AND z=? AND w>?', (x1, x2, z, self.level)
+                ).fetchall())
+            finally:
+                connector.close()
+
+            for (a, b, y, d), w in self.grammar_changes.copy().items():
+                if (a, b, d) == (x1, x2, z):
+                    weights[y] = w
+
+            return weights
+
         def upvote_grammar(self, x1, x2, y, z):
-            self.grammar[x1, x2, y, z] += np.amax(self.grammar[x1, x2, :, z])
-            connector = sqlite3.connect(self.db_path)
-            cursor = connector.cursor()
-            cursor.execute('UPDATE grammar SET w=? WHERE x1=? AND x2=? AND y=? AND z=?',
-                           (int(self.grammar[x1, x2, y, z]), x1, x2, y, z))
-            connector.commit()
-            connector.close()
-
-        @staticmethod
-        def renote(n):
-            ramp = 1.75
-            return (pow(n, ramp) / (pow(100, ramp) / 100)) * (1 - n / 100) + \
-                (1 - math.cos(pow(n, pow(n, .5) / 10) / (100 / math.pi))) * 50 * (n / 100)
-
-        def solve(self, x1, x2, y, z):
-            s = self.get_solution(x1, x2, y, z)
+            if self.quantized:
+                # the vote is journaled, it must be counted on the exact weights
+                weights = self.context_weights(x1, x2, z)
+                w = weights.get(y, 0) + max(weights.values(), default=0)
+            else:
+                w = int(self.grammar[x1, x2, y, z]) + self.grammar.best(x1, x2, z)
+
+            self.grammar[x1, x2, y, z] = w
+
+            # the solutions scored in this context are outdated
+            self.recorded.invalidate(
+                lambda key: x2 in self.vocabulary.infos(key[1])[0] and z in self.vocabulary.infos(key[3])[0]
+            )
+
+            self.grammar_changes[x1, x2, y, z] = w
+
+            # the vote is journaled and written later to the corpus.db with the next ones
+            if self.journal.record(x1, x2, y, z, w):
+                QTimer.singleShot(self.flush_delay, self.flush_journal)
+
+        def analyze_processes(self, streams: list) -> list:
+            """
+            analyzes the streams in the worker processes, see ProcessAnalyzer
+            :return: the best solution for every token by its key, for every stream, or None if the
+            processes can't be used
+            """
+            if not self.snapshot_ready:
+                return
+
+            blocks = [stream.keys() for stream in streams]
+            infos, words, ancestors = blocks_infos(self.vocabulary, blocks, self.predict_ancestors)
+
+            self.analyzer_mutex.lock()
+            try:
+                if self.analyzer is None:
+                    self.analyzer = ProcessAnalyzer(self.snapshot_path)
+                analyzer = self.analyzer
+            finally:
+                self.analyzer_mutex.unlock()
+
+            s = time.perf_counter()
+            try:
+                records = analyzer.analyze(blocks, infos, words, ancestors, self.grammar_changes.copy())
+            except (OSError, BrokenProcessPool) as e:
+                G.exception(e)
+                self.close_analyzer()
+                return
+
+            G.logger.info(f'AnalyzeProcesses : {len(blocks)} blocks in {time.perf_counter() - s:.3f}s')
+            return [expand_solutions(*record, factory=self.Solution) for record in records]
+
+        def close_analyzer(self):
+            self.analyzer_mutex.lock()
+            try:
+                if self.analyzer is not None:
+                    self.analyzer.close()
+                    self.analyzer = None
+            finally:
+                self.analyzer_mutex.unlock()
+
+        def flush_journal(self):
+            POOL.start(self.Loader.JournalFlush(self.journal, self.db_path), uniq='journal')
+
+        def close(self):
+            """
+            writes the pending upvotes, must be called once the POOL's jobs are done
+            """
+            try:
+                self.journal.flush(self.db_path)
+            except (OSError, sqlite3.Error) as e:
+                G.exception(e)
+
+            self.journal.close()
+            self.close_analyzer()
+
+        renote = staticmethod(renote)
+
+        def solve(self, key: tuple):
+            s = self.get_solution(key)
 
             if not s:
                 return
@@ -1002,9 +1298,10 @@ class GlobalSettings(_Settings):
 
             suggestions = [s.word]
 
+            ranking = self.grammar.ranking(x1.role, x2.role, z.role)
+
             cnt = 1
-            for alt in filter(lambda x: self.grammar[x1.role, x2.role, x, z.role],
-                              reversed(np.argsort(self.grammar[x1.role, x2.role, :, z.role]))):
+            for alt in filter(lambda x: self.grammar[x1.role, x2.role, x, z.role], ranking):
                 if alt in lemmas:
                     if cnt > 3:
                         break
@@ -1024,7 +1321,7 @@ class GlobalSettings(_Settings):
                 w2 = ''
 
             cnt = 1
-            for alt in filter(lambda x: x, reversed(np.argsort(self.grammar[x1.role, x2.role, :, z.role]))):
+            for alt in filter(lambda x: x, ranking):
                 if (w1, w2, alt) in self.predict_roles:
                     if cnt > scale:
                         break
@@ -1046,7 +1343,7 @@ class GlobalSettings(_Settings):
                 pass
 
             successors = []
-            valids = set([alt for alt in filter(lambda x: self.grammar[x1.role, x2.role, x, z.role], reversed(np.argsort(self.grammar[x1.role, x2.role, :, z.role])))])
+            valids = set([alt for alt in filter(lambda x: self.grammar[x1.role, x2.role, x, z.role], ranking)])
             try:
                 if (w2, z.role) in self.predict_after:
                     for pre in sorted(self.predict_after[(w2, z.role)], key=lambda x: self.words[x][3], reverse=True):
@@ -1075,45 +1372,7 @@ class GlobalSettings(_Settings):
             if not self.predikt_loaded:
                 return ''
 
-            res = ''
-            tail = ' '.join((w1, w2,))
-
-            # print(f'trying to predict... "{tail}"..."{word}"')
-
-            try:
-                candidates = self.predikt_wide[word]
-                # sort_by_tense(candidates)
-                results = filter(lambda x: x.tail.endswith(tail), candidates)
-
-                try:
-                    res = next(results).word
-
-                except StopIteration:
-                    if not greedy:
-                        raise KeyError
-
-            except KeyError:
-                # print("= CANT FIND WORD AND TAIL")
-                # both word first letter and tail can't be found
-
-                try:
-                    target = self.Word(word, (w1, w2))
-                    candidates = self.predikt_words_tail[target.last_ancestor]
-                    # sort_by_tense(candidates)
-                    results = filter(lambda x: x.word.startswith(word), candidates)
-
-                    try:
-                        res = next(results).word
-
-                    except StopIteration:
-                        res = self.predikt_wide[word][0].word
-                        raise KeyError
-
-                except (IndexError, KeyError):
-                    pass
-                    # print('CANT FIND LAST ANCESTOR ONLY')
-
-            return res
+            return self.predikt.predict(w1, w2, word, greedy)
 
     themes = {
         'dark': Dark(),
@@ -1136,11 +1395,14 @@ class GlobalSettings(_Settings):
         'arabic_font_family': 'Arial',
         'latin_font_family': 'Arial',
         'font_size': 14,
-        'check_grammar': True
+        'check_grammar': True,
+        'grammar_processes': False
     }
 
     step = pyqtSignal(int, str)
     loaded = pyqtSignal()
+    # the grammar is loaded or replaced by a new tier, the solutions have to be scored again
+    grammarChanged = pyqtSignal()
 
     def __init__(self):
         self.QURAN = GlobalSettings.Quran()
@@ -1172,6 +1434,7 @@ class GlobalSettings(_Settings):
         self.font_size = self.defaults['font_size']
 
         self.check_grammar = self.defaults['check_grammar']
+        self.grammar_processes = self.defaults['grammar_processes']
 
         self.AUDIOMAP = Audio.AudioMap
 
@@ -1237,6 +1500,7 @@ class GlobalSettings(_Settings):
 
         self.CORPUS.init()
         self.check_grammar = bool(settings['check_grammar'])
+        self.grammar_processes = bool(settings['grammar_processes'])
 
         self.loaded.emit()
 
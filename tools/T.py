@@ -3,17 +3,21 @@
 Some handful text operations especially on HTML code
 NOT IMPLEMENTED YET
 """
+import os
+import pickle
 import re
 import sys
+import threading
 import time
 
 from symspellpy import SymSpell, Verbosity
 from string import ascii_letters, digits, whitespace
 from html.parser import HTMLParser
 
-from PyQt6.QtCore import QRunnable, pyqtSignal, QObject, Qt
+from PyQt6.QtCore import QRunnable, pyqtSignal, QObject, Qt, QTimer
 from PyQt6.QtGui import QTextDocument, QFont, QTextOption, QTextBlockFormat, QTextCursor, QFontMetrics
 from tools import G
+from tools.Cache import LRUCache, file_digest
 
 
 class Regex:
@@ -79,6 +83,23 @@ class Regex:
 
         return cleanup
 
+    @staticmethod
+    def Predikt_context(last_words: str) -> (str, str, str):
+        """
+        splits the text typed before the cursor into the prediction's context
+        :param last_words: the block's text until the cursor
+        :return: the two previous words and the word being typed
+        :raise IndexError, AssertionError: nothing to predict for this text
+        """
+        hard_split = Regex.Predikt_hard_split.split(last_words)[-1]
+        hard_split = hard_split[0].lower() + hard_split[1:]
+        words = Regex.Predikt_soft_split.split(hard_split)
+        words_tuple = (('', '',) + tuple(words))[-3:]
+        tail, word = words_tuple[:-1] + ('', '',), words_tuple[-1]
+
+        assert (not Regex.Predikt_ignore_token.match(''.join(tail + (word,))))
+        return tail[0], tail[1], word
+
     @staticmethod
     def tokenize(body_text: str):
         """
@@ -132,7 +153,71 @@ class Keys:
 class SpellChecker(QObject):
     dictionary: SymSpell
     dictionary_path = G.appdata_path("dict.txt")
+    cache_path = G.appdata_path("dict.cache")
     finished = pyqtSignal()
+    # count of verdicts remembered for the words missing from the dictionary
+    cache_size = 20000
+
+    # delay before the added words are written to the dict.txt (ms)
+    flush_delay = 2000
+
+    # the SymSpell's parameters, the index built from the dict.txt is cached for them
+    max_edit_distance = 3
+    prefix_length = 5
+
+    class Cache:
+        """
+        The SymSpell index built from the dict.txt, pickled after a header holding the dict.txt's hash and the
+        parameters it was built with, the cache is used only if both match
+        """
+        version = 1
+
+        def __init__(self, path: str):
+            self.path = path
+
+        @staticmethod
+        def key(dictionary_path: str) -> dict:
+            return {
+                'version': SpellChecker.Cache.version,
+                'data_version': SymSpell.data_version,
+                'max_edit_distance': SpellChecker.max_edit_distance,
+                'prefix_length': SpellChecker.prefix_length,
+                'hash': file_digest(dictionary_path)
+            }
+
+        def load(self, dictionary: SymSpell, key: dict) -> bool:
+            """
+            loads the cached index in the dictionary
+            :return: False if the cache is missing or outdated
+            """
+            try:
+                with open(self.path, mode='rb') as f:
+                    if pickle.load(f) != key:
+                        return False
+
+                    return dictionary.load_pickle(f.read(), from_bytes=True)
+
+            except (OSError, EOFError, pickle.UnpicklingError, KeyError) as e:
+                G.exception(e)
+                return False
+
+        def write(self, dictionary: SymSpell, key: dict, count: int) -> bool:
+            """
+            pickles the index, it's done without the lock of the additions
+            :param count: the dictionary's word count when the key was made, the index isn't written if words
+            were added since, their flush will write it
+            """
+            data = dictionary.save_pickle(to_bytes=True)
+            if dictionary.word_count != count:
+                return False
+
+            tmp = f'{self.path}.tmp'
+            with open(tmp, mode='wb') as f:
+                pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(data)
+
+            os.replace(tmp, self.path)
+            return True
 
     class Worker(QRunnable):
         name = 'SpellChecker'
@@ -142,61 +227,238 @@ class SpellChecker(QObject):
             self.callback_fn = callback_fn
 
         def run(self) -> None:
-            sympell = SymSpell(max_dictionary_edit_distance=3, prefix_length=5)
-            sympell.load_dictionary(SpellChecker.dictionary_path, term_index=0,
-                                    count_index=1, encoding="utf8", separator="\t")
+            s = time.perf_counter()
+            sympell = SymSpell(max_dictionary_edit_distance=SpellChecker.max_edit_distance,
+                               prefix_length=SpellChecker.prefix_length)
+
+            cache = SpellChecker.Cache(SpellChecker.cache_path)
+            key = cache.key(SpellChecker.dictionary_path)
+            cached = os.path.exists(cache.path) and cache.load(sympell, key)
+
+            if not cached:
+                sympell.load_dictionary(SpellChecker.dictionary_path, term_index=0,
+                                        count_index=1, encoding="utf8", separator="\t")
+
+            count = sympell.word_count
+            self.callback_fn(sympell, set(sympell.words))
+            G.logger.info(f'{self.name} : ready in {time.perf_counter() - s:.3f}s '
+                          f'({"cached index" if cached else "built from the dict.txt"})')
+
+            # the next launches will load the index directly, unless words were added meanwhile, the index
+            # wouldn't match the hash anymore
+            if not cached:
+                try:
+                    cache.write(sympell, key, count)
+                except OSError as e:
+                    G.exception(e)
 
-            flat_dictionary = set()
+            self.done(self.name)
 
-            with open(SpellChecker.dictionary_path, mode='r+', encoding='utf-8') as f:
-                for line in f.readlines():
-                    flat_dictionary.add(line.split('\t')[0])
+    class Scan(QRunnable):
+        name = 'SpellScan'
+
+        def __init__(self, blocks: dict, checker, callback, known=()):
+            """
+            checks the spelling of the blocks, away from the UI's thread, then prepares the suggestions of
+            the misspelled words
+            :param blocks: the text of the blocks to scan, by block's number
+            :param callback: receives the blocks, their misspelled words (see SpellChecker.scan) and the
+            suggestions of the new misspelled words (see SpellChecker.suggest)
+            :param known: the misspelled words whose suggestions are already known
+            """
+            super().__init__()
+            self.blocks = blocks
+            self.checker = checker
+            self.cb = callback
+            self.known = known
 
-            self.callback_fn(sympell, flat_dictionary)
+        def run(self) -> None:
+            misspellings = self.checker.scan(self.blocks)
 
+            words = set(word for misspelled in misspellings.values() for word in misspelled.values())
+            suggestions = self.checker.suggest(word for word in words if word not in self.known)
+
+            self.cb(self.blocks, misspellings, suggestions)
             self.done(self.name)
 
+    class Writer(QRunnable):
+        name = 'SpellCheckerWriter'
+
+        def __init__(self, checker):
+            super().__init__()
+            self.checker = checker
+
+        def run(self) -> None:
+            # the next writes are refused until it's done, whatever happens
+            try:
+                self.checker.flush()
+            except OSError as e:
+                G.exception(e)
+            finally:
+                self.done(self.name)
+
     def __init__(self):
         super().__init__()
         self.dictionary = None
         self.flat_dictionary = set()
         self.loaded = False
 
+        # the words added during the session, and those still to be written to the dict.txt
+        self.added = set()
+        self.pending = []
+        self.lock = threading.Lock()
+
+        # the verdicts of the lookups, shared with the threads learning the corpus
+        self.verdicts = LRUCache(self.cache_size)
+        self.exact = 0
+
     def build(self):
         from tools.S import POOL
         POOL.start(self.Worker(self.load))
 
     def load(self, dictionary: SymSpell, flat_dictionary: set):
-        self.dictionary = dictionary
+        with self.lock:
+            # the words added while the index was built
+            for word in self.added - flat_dictionary:
+                dictionary.create_dictionary_entry(word, 1)
+
+            self.dictionary = dictionary
+
         self.flat_dictionary.update(flat_dictionary)
+        self.verdicts.clear()
 
-        self.finished.emit()
+        # the spell scans started by the signal need the dictionary loaded
         self.loaded = True
+        self.finished.emit()
 
     def add(self, word):
         """
-        add a new word to the dictionary
+        add a new word to the dictionary, the index is updated right away and the dict.txt later with the
+        next words added, see flush
         :param word: new word
         """
+        if word in self.flat_dictionary:
+            return
 
-        with open(self.dictionary_path, 'a', encoding='utf-8') as f:
-            # adding a new line for the word and a frequency of 1
-            f.write(f'\n{word}\t1')
+        with self.lock:
+            # with a frequency of 1
+            if self.dictionary is not None:
+                self.dictionary.create_dictionary_entry(word, 1)
 
-        self.build()
+            self.added.add(word)
+            self.pending.append(word)
+            scheduled = len(self.pending) > 1
+
+        # the word is valid right now, the other verdicts can't change since the lookups return the word only if
+        # it's the one checked
+        self.flat_dictionary.add(word)
+        self.verdicts.pop(word)
+
+        if not scheduled:
+            QTimer.singleShot(self.flush_delay, self.write)
+
+    def write(self):
+        from tools.S import POOL
+        POOL.start(self.Writer(self), uniq='spell')
+
+    def flush(self):
+        """
+        appends the pending words to the dict.txt at once, then the cached index is written again so the next
+        launch doesn't have to rebuild it
+        """
+        with self.lock:
+            words, self.pending = self.pending, []
+            if not len(words):
+                return
+
+            with open(self.dictionary_path, 'a', encoding='utf-8') as f:
+                # a new line for every word and a frequency of 1
+                f.write(''.join(f'\n{word}\t1' for word in words))
+
+            if self.dictionary is None:
+                return
+
+            cache = self.Cache(self.cache_path)
+            key = cache.key(self.dictionary_path)
+            count = self.dictionary.word_count
+
+        # the words added meanwhile aren't blocked by the pickle
+        cache.write(self.dictionary, key, count)
 
     def lookup(self, *args, **kwargs):
         return self.dictionary.lookup(*args, ignore_token=Regex.ignoretoken, **kwargs)
 
     def word_check(self, word: str):
+        """
+        returns True if the word is correctly spelled, False if a better word is suggested and None if the
+        word has no suggestion at all
+        """
+        # the lookup always returns the words of the dictionary and the ignored tokens first
+        if word in self.flat_dictionary or Regex.ignoretoken.match(word):
+            self.exact += 1
+            return True
+
+        try:
+            return self.verdicts[word]
+        except KeyError:
+            pass
+
         suggestions = self.lookup(word, max_edit_distance=2, verbosity=Verbosity.TOP,
                                   include_unknown=False, transfer_casing=False)
 
         try:
-            return suggestions[0].term == word
+            verdict = suggestions[0].term == word
 
         except IndexError:
-            pass
+            verdict = None
+
+        self.verdicts.update({word: verdict})
+        return verdict
+
+    def stats(self) -> dict:
+        """
+        the counters of the verdicts, the exact matches are never cached
+        """
+        return {'exact': self.exact, **self.verdicts.stats()}
+
+    def cached_check(self, word: str) -> bool:
+        """
+        returns the verdict of word_check if it's known without a lookup, otherwise the word is considered valid
+        until a spell scan checks it
+        """
+        if word in self.flat_dictionary or Regex.ignoretoken.match(word):
+            return True
+
+        return self.verdicts.get(word, True)
+
+    def scan(self, blocks: dict) -> dict:
+        """
+        checks all the words of the blocks at once, every word is checked only once
+        :param blocks: the text of the blocks, by block's number, as the highlighter reads them
+        :return: the misspelled words as {offset: word}, by block's number
+        """
+        tokens = {
+            number: [(pos, word) for pos, _, word, _ in Regex.tokenize(text) if len(word) > 1]
+            for number, text in blocks.items()
+        }
+        unique = set(word for words in tokens.values() for _, word in words)
+        verdicts = {word: self.word_check(word) for word in unique}
+
+        return {
+            number: {pos: word for pos, word in words if not verdicts[word]}
+            for number, words in tokens.items()
+        }
+
+    def suggest(self, words) -> dict:
+        """
+        the corrections of the words, the ones of the context menu
+        :return: the (term, distance) of the closest suggestions, the most frequent first, by word
+        """
+        return {
+            word: [(s.term, s.distance) for s in self.lookup(word, max_edit_distance=2, verbosity=Verbosity.CLOSEST,
+                                                            include_unknown=False, transfer_casing=False)]
+            for word in words
+        }
 
     def block_check(self, text: str):
         for word in Regex.highlight_split.split(text):